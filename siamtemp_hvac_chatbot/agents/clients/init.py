@@ -1,5 +1,6 @@
 """Client modules for external services."""
 
 from .ollama import SimplifiedOllamaClient
+from .ollama_usage import OllamaUsage, OllamaUsageTracker
 
-__all__ = ['SimplifiedOllamaClient']
\ No newline at end of file
+__all__ = ['SimplifiedOllamaClient', 'OllamaUsage', 'OllamaUsageTracker']
\ No newline at end of file
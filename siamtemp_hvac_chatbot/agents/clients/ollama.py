@@ -13,6 +13,7 @@ import psycopg2
 from textwrap import dedent
 from psycopg2.extras import RealDictCursor
 from collections import Counter, defaultdict
+from .ollama_usage import OllamaUsage, OllamaUsageTracker
 logger = logging.getLogger(__name__)
 
 class SimplifiedOllamaClient:
@@ -22,11 +23,14 @@ class SimplifiedOllamaClient:
     def __init__(self):
         self.base_url = os.getenv('OLLAMA_BASE_URL', 'http://52.74.36.160:12434')
         self.timeout = 120
+        # Token counts and timings per call (labels: tenant, intent, template)
+        self.usage = OllamaUsageTracker()
         logger.info(f"🔗 Ollama client configured with: {self.base_url}")
     
-    async def generate(self, prompt: str, model: str) -> str:
+    async def generate(self, prompt: str, model: str, labels: Optional[Dict[str, str]] = None) -> str:
         """
         Generate response from Ollama with proper streaming/NDJSON handling
+        labels attribute the call's token usage (tenant, intent, template)
         """
         payload = {
             'model': model,
@@ -56,11 +60,12 @@ class SimplifiedOllamaClient:
                     if 'application/json' in content_type:
                         # Standard JSON response
                         result = await response.json()
+                        self.usage.record(OllamaUsage.from_response(model, result), prompt, labels)
                         return result.get('response', '').strip()
                     
                     elif 'application/x-ndjson' in content_type or 'text/plain' in content_type:
                         # Streaming/NDJSON response (even though we requested non-streaming)
-                        return await self._handle_streaming_response(response)
+                        return await self._handle_streaming_response(response, model, prompt, labels)
                     
                     else:
                         # Fallback to text parsing
@@ -74,17 +79,19 @@ class SimplifiedOllamaClient:
         except aiohttp.ContentTypeError as e:
             logger.warning(f"Content type error, attempting alternative parsing: {e}")
             # Try alternative parsing method
-            return await self._alternative_generate(prompt, model)
+            return await self._alternative_generate(prompt, model, labels)
             
         except Exception as e:
             logger.error(f"Ollama request failed: {e}")
             return self._generate_fallback_sql(prompt, model)
     
-    async def _handle_streaming_response(self, response) -> str:
+    async def _handle_streaming_response(self, response, model: str, prompt: str,
+                                         labels: Optional[Dict[str, str]] = None) -> str:
         """
-        Handle NDJSON streaming response
+        Handle NDJSON streaming response (the final line carries the usage stats)
         """
         accumulated_response = []
+        usage = None
         
         try:
             async for line in response.content:
@@ -99,19 +106,22 @@ class SimplifiedOllamaClient:
                             
                             # Check if done
                             if data.get('done', False):
+                                usage = OllamaUsage.from_response(model, data)
                                 break
                                 
                         except json.JSONDecodeError:
                             # Skip invalid JSON lines
                             continue
             
+            self.usage.record(usage, prompt, labels)
             return ''.join(accumulated_response).strip()
             
         except Exception as e:
             logger.error(f"Error parsing streaming response: {e}")
             return ""
     
-    async def _alternative_generate(self, prompt: str, model: str) -> str:
+    async def _alternative_generate(self, prompt: str, model: str,
+                                    labels: Optional[Dict[str, str]] = None) -> str:
         """
         Alternative generation method with explicit streaming handling
         """
@@ -147,6 +157,7 @@ class SimplifiedOllamaClient:
                                         if 'response' in data:
                                             accumulated.append(data['response'])
                                         if data.get('done'):
+                                            self.usage.record(OllamaUsage.from_response(model, data), prompt, labels)
                                             return ''.join(accumulated).strip()
                                     except:
                                         continue
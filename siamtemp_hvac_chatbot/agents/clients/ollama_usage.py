@@ -0,0 +1,166 @@
+# agents/clients/ollama_usage.py
+"""
+Ollama token and timing accounting
+/api/generate reports prompt_eval_count, eval_count and the prompt / eval /
+load durations (nanoseconds) in its final message; SimplifiedOllamaClient
+records them here per call, labelled with tenant, intent and prompt template
+"""
+
+import os
+import time
+import heapq
+import logging
+from collections import deque
+from dataclasses import dataclass
+from itertools import count
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NS = 1e-9
+
+@dataclass
+class OllamaUsage:
+    """Token counts and timings of one generate call (seconds)"""
+    model: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    prompt_eval_seconds: float = 0.0
+    eval_seconds: float = 0.0
+    load_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    @classmethod
+    def from_response(cls, model: str, data: Dict[str, Any]) -> Optional['OllamaUsage']:
+        """None when the message carries no stats (not the final one)"""
+        if 'eval_count' not in data and 'total_duration' not in data:
+            return None
+        # prompt_eval_count is omitted when the whole prompt came from Ollama's cache
+        return cls(
+            model=data.get('model') or model,
+            prompt_tokens=int(data.get('prompt_eval_count') or 0),
+            output_tokens=int(data.get('eval_count') or 0),
+            prompt_eval_seconds=(data.get('prompt_eval_duration') or 0) * _NS,
+            eval_seconds=(data.get('eval_duration') or 0) * _NS,
+            load_seconds=(data.get('load_duration') or 0) * _NS,
+            total_seconds=(data.get('total_duration') or 0) * _NS
+        )
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.output_tokens / self.eval_seconds if self.eval_seconds else 0.0
+
+    @property
+    def prompt_tokens_per_second(self) -> float:
+        return self.prompt_tokens / self.prompt_eval_seconds if self.prompt_eval_seconds else 0.0
+
+class OllamaUsageTracker:
+    """
+    Per-worker usage report
+    - most expensive prompts (by prompt tokens) in a bounded min-heap
+    - per-template totals, to spot templates that bloat prompts
+    - model loads: load_duration above load_threshold means the model was
+      not resident (first use or evicted by another model) and was loaded
+    observe(usage, labels) feeds the service's Prometheus histograms
+    """
+
+    PREVIEW_CHARS = 300
+
+    def __init__(self, top_n: int = int(os.getenv('OLLAMA_TOP_PROMPTS', '20')),
+                 load_threshold: float = float(os.getenv('OLLAMA_LOAD_THRESHOLD', '1.0')),
+                 max_load_events: int = 50,
+                 observe: Optional[Callable[[OllamaUsage, Dict[str, str]], None]] = None):
+        self.top_n = top_n
+        self.load_threshold = load_threshold
+        self.observe = observe
+        self._top: List[Tuple[int, int, Dict[str, Any]]] = []
+        self._seq = count()
+        self.templates: Dict[str, Dict[str, float]] = {}
+        self.models: Dict[str, Dict[str, float]] = {}
+        self.load_events: Deque[Dict[str, Any]] = deque(maxlen=max_load_events)
+        self.calls = 0
+        self.calls_without_stats = 0
+
+    def record(self, usage: Optional[OllamaUsage], prompt: str, labels: Optional[Dict[str, str]] = None):
+        labels = {'tenant': 'unknown', 'intent': 'unknown', 'template': 'unknown', **(labels or {})}
+        self.calls += 1
+        if usage is None:
+            self.calls_without_stats += 1
+            return
+        try:
+            if self.observe:
+                self.observe(usage, labels)
+            self._aggregate(self.templates, labels['template'], usage)
+            self._aggregate(self.models, usage.model, usage)
+            if usage.load_seconds >= self.load_threshold:
+                self._record_load(usage)
+            self._keep_if_expensive(usage, prompt, labels)
+        except Exception as e:
+            logger.warning(f"Ollama usage accounting failed: {e}")
+
+    def _aggregate(self, table: Dict[str, Dict[str, float]], key: str, usage: OllamaUsage):
+        row = table.setdefault(key, {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0,
+                                     'eval_seconds': 0.0, 'total_seconds': 0.0, 'max_prompt_tokens': 0})
+        row['calls'] += 1
+        row['prompt_tokens'] += usage.prompt_tokens
+        row['output_tokens'] += usage.output_tokens
+        row['eval_seconds'] += usage.eval_seconds
+        row['total_seconds'] += usage.total_seconds
+        row['max_prompt_tokens'] = max(row['max_prompt_tokens'], usage.prompt_tokens)
+
+    def _record_load(self, usage: OllamaUsage):
+        model = self.models[usage.model]
+        previous = model.get('last_load')
+        now = time.time()
+        model['loads'] = model.get('loads', 0) + 1
+        model['last_load'] = now
+        self.load_events.append({
+            'model': usage.model,
+            'load_seconds': round(usage.load_seconds, 3),
+            'timestamp': now,
+            'since_previous_load': round(now - previous, 1) if previous else None
+        })
+        logger.info(f"📦 Ollama loaded {usage.model} in {usage.load_seconds:.1f}s")
+
+    def _keep_if_expensive(self, usage: OllamaUsage, prompt: str, labels: Dict[str, str]):
+        if len(self._top) >= self.top_n and usage.prompt_tokens <= self._top[0][0]:
+            return
+        entry = {
+            **labels,
+            'model': usage.model,
+            'prompt_tokens': usage.prompt_tokens,
+            'output_tokens': usage.output_tokens,
+            'tokens_per_second': round(usage.tokens_per_second, 1),
+            'total_seconds': round(usage.total_seconds, 3),
+            'load_seconds': round(usage.load_seconds, 3),
+            'prompt_chars': len(prompt),
+            'prompt_preview': prompt[:self.PREVIEW_CHARS],
+            'timestamp': time.time()
+        }
+        item = (usage.prompt_tokens, next(self._seq), entry)
+        if len(self._top) < self.top_n:
+            heapq.heappush(self._top, item)
+        else:
+            heapq.heapreplace(self._top, item)
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        def with_means(row: Dict[str, float]) -> Dict[str, Any]:
+            calls = row['calls'] or 1
+            return {
+                **row,
+                'eval_seconds': round(row['eval_seconds'], 3),
+                'total_seconds': round(row['total_seconds'], 3),
+                'mean_prompt_tokens': round(row['prompt_tokens'] / calls, 1),
+                'mean_output_tokens': round(row['output_tokens'] / calls, 1),
+                'tokens_per_second': round(row['output_tokens'] / row['eval_seconds'], 1) if row['eval_seconds'] else 0.0
+            }
+
+        templates = sorted(self.templates.items(), key=lambda kv: kv[1]['prompt_tokens'], reverse=True)
+        return {
+            'calls': self.calls,
+            'calls_without_stats': self.calls_without_stats,
+            'models': {model: with_means(row) for model, row in self.models.items()},
+            'templates': [{'template': name, **with_means(row)} for name, row in templates[:limit]],
+            'top_prompts': [entry for _, _, entry in sorted(self._top, reverse=True)][:limit],
+            'model_loads': list(self.load_events)[::-1][:limit]
+        }
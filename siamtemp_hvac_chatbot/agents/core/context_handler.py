@@ -11,6 +11,9 @@ from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+from ..sql.pagination import ResultCursor
+from ..data.result_snapshot import ResultSnapshot
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -36,6 +39,32 @@ class ConversationState:
     state_type: str = 'querying'  # querying, clarifying, following_up, comparing
     active_entities: Dict = field(default_factory=dict)
     turn_count: int = 0
+    active_cursor_id: Optional[str] = None
+    result_cursors: Dict = field(default_factory=dict)  # cursor_id -> ResultCursor
+    last_result: Optional[Any] = None                   # ResultSnapshot of the last answer
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe form, shared between workers through Redis"""
+        return {
+            'user_id': self.user_id,
+            'session_id': self.session_id,
+            'current_topic': self.current_topic,
+            'state_type': self.state_type,
+            'active_entities': self.active_entities,
+            'turn_count': self.turn_count,
+            'active_cursor_id': self.active_cursor_id,
+            'result_cursors': {cid: cursor.to_dict() for cid, cursor in self.result_cursors.items()},
+            'last_result': self.last_result.to_dict() if self.last_result is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ConversationState':
+        data = dict(data)
+        data['result_cursors'] = {cid: ResultCursor.from_dict(cursor)
+                                  for cid, cursor in (data.get('result_cursors') or {}).items()}
+        if data.get('last_result') is not None:
+            data['last_result'] = ResultSnapshot.from_dict(data['last_result'])
+        return cls(**data)
 
 class ContextHandler:
     """Handle multi-turn conversation context"""
@@ -85,6 +114,33 @@ class ContextHandler:
             'temporal': ['เดือน', 'ปี', 'วันที่', 'ช่วง', 'period']
         }
         
+        # "Show more" messages - the whole message must be a paging request
+        # ("ดูต่อ", "มีอีกไหมครับ", "next page"), so "ยอดขายต่อเดือน" or
+        # "next year sales" are new questions
+        self.continuation_pattern = re.compile(
+            r'^(?:(?:ขอ|มี)\s*)?(?:(?:ดู|แสดง|โชว์)\s*)?'
+            r'(?:หน้า|รายการ)?\s*(?:ต่อ|ถัดไป|เพิ่มเติม|เพิ่ม|อีก)'
+            r'(?:\s*(?:อีก|ไป))?(?:\s*\d+\s*(?:รายการ|แถว|อัน))?'
+            r'(?:\s*(?:หน่อย|เลย|ด้วย))?(?:\s*(?:ได้ไหม|ไหม|มั้ย|มั๊ย))?'
+            r'(?:\s*(?:ครับ|คับ|ค่ะ|คะ|นะ|จ้า))?$'
+            r'|^(?:show\s+)?(?:more|next(?:\s+page)?|continue)(?:\s+please)?$'
+        )
+        self.continuation_max_length = 30
+        
+        # Follow-ups answerable from the previous result set
+        self.result_followup_max_length = 60
+        # The question must point at the shown result - "ทั้งหมด" or "5 อันดับ"
+        # alone start new questions ("งานซ่อมทั้งหมดเดือนนี้"). No bare "นั้น":
+        # it is part of "ดังนั้น" / "อย่างนั้น"
+        self.previous_result_refs = [
+            'เหล่านั้น', 'พวกนั้น', 'ทั้งหมดนั้น', 'รายการนั้น', 'ข้อมูลนั้น', 'ผลลัพธ์นั้น',
+            'ข้างต้น', 'ข้างบน', 'จากผลลัพธ์', 'ผลลัพธ์ก่อนหน้า', 'ผลลัพธ์นี้', 'ที่แสดง', 'เมื่อกี้'
+        ]
+        # A year in the question means a new query - AD (2024) or Buddhist era
+        # (2567, "ปี 67") as in IntentDetector._extract_years
+        self.year_pattern = re.compile(r'(?<!\d)(?:19|20|25)\d{2}(?!\d)|ปี\s*\d{2}(?!\d)')
+        self.rank_pattern = re.compile(r'top\s*\d+|\d+\s*อันดับ', re.IGNORECASE)
+        
         # State machine transitions
         self.state_transitions = {
             'querying': ['clarifying', 'following_up', 'comparing'],
@@ -130,6 +186,34 @@ class ContextHandler:
         
         return False
     
+    def is_continuation_request(self, question: str) -> bool:
+        """Check if the message only asks for the next page of the last result"""
+        text = re.sub(r'[\s?!.ๆ]+', ' ', question.lower()).strip()
+        if not text or len(text) > self.continuation_max_length:
+            return False
+        return bool(self.continuation_pattern.match(text))
+    
+    def detect_result_followup(self, question: str) -> Optional[str]:
+        """
+        Return the result reference type if the question only operates on
+        the previous result (explicit reference, no new year, short), otherwise None
+        """
+        if len(question) > self.result_followup_max_length or self.year_pattern.search(question):
+            return None
+        
+        text = question.lower()
+        for entity_ref in self.entity_refs:
+            text = text.replace(entity_ref, ' ')  # "บริษัทนั้น" is a subject, not the result
+        if not any(ref in text for ref in self.previous_result_refs):
+            return None
+        
+        matched = [phrase for phrase in self.result_refs if phrase in text]
+        if matched:
+            return self.result_refs[max(matched, key=len)]
+        if self.rank_pattern.search(text):
+            return 'top_n'
+        return 'previous_result'
+    
     def resolve_references(self, question: str, history: List[ConversationTurn]) -> Tuple[str, Dict]:
         """Resolve all references in the question"""
         if not history:
@@ -1,6 +1,7 @@
 """Core orchestration and system management."""
 
 from .orchestrator import ImprovedDualModelDynamicAISystem
+from .instrumentation import StageTimer, PipelineInstrumentation, PIPELINE_STAGES
 
 # Aliases for backward compatibility
 DualModelDynamicAISystem = ImprovedDualModelDynamicAISystem
@@ -12,4 +13,7 @@ __all__ = [
     'DualModelDynamicAISystem',
     'UnifiedEnhancedPostgresOllamaAgent',
     'EnhancedUnifiedPostgresOllamaAgent',
+    'StageTimer',
+    'PipelineInstrumentation',
+    'PIPELINE_STAGES',
 ]
\ No newline at end of file
@@ -0,0 +1,113 @@
+# agents/core/instrumentation.py
+"""
+Pipeline stage timing and dependency in-flight tracking
+- StageTimer: one per request (QueryContext.timings); `with timings.stage('execution'):`
+  adds the block's wall time to that stage
+- PipelineInstrumentation: process-wide sinks set by the service layer
+  observe_stage(stage, seconds, tenant, intent, outcome) - once per stage when
+  the request finishes, so every stage carries the final intent and outcome
+  observe_dependency(name, in_flight) - whenever an Ollama / Postgres / Redis call starts or ends
+  span(name, attributes, kind=..., current=...) - tracing span factory (tracing.span),
+  wrapped around every stage and dependency call when set
+"""
+
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STAGES = (
+    'state',           # conversation state from Redis
+    'prepare',         # Ollama check + conversation context
+    'intent',
+    'snapshot',        # follow-ups answered from the previous result
+    'sql_generation',  # LLM
+    'validation',      # SQL validator + customer alias rewrite
+    'execution',
+    'cleaning',
+    'export',
+    'formatting'
+)
+DEPENDENCIES = ('ollama', 'postgres', 'redis')
+
+SpanFactory = Callable[..., ContextManager]
+
+class StageTimer:
+    """Accumulated wall time per stage for one request (and a span per stage if span is set)"""
+    __slots__ = ('timings', 'started', 'span')
+
+    def __init__(self, span: Optional[SpanFactory] = None):
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.span = span
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        with self.span(f"pipeline.{name}", {'pipeline.stage': name}) if self.span else nullcontext():
+            try:
+                yield
+            finally:
+                self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def breakdown(self) -> Dict[str, float]:
+        """Milliseconds per stage in pipeline order, plus 'other' (untimed) and 'total'"""
+        total = time.perf_counter() - self.started
+        result = {name: round(self.timings[name] * 1000, 2)
+                  for name in sorted(self.timings, key=_stage_order)}
+        result['other'] = round(max(0.0, total - sum(self.timings.values())) * 1000, 2)
+        result['total'] = round(total * 1000, 2)
+        return result
+
+def _stage_order(name: str) -> int:
+    return PIPELINE_STAGES.index(name) if name in PIPELINE_STAGES else len(PIPELINE_STAGES)
+
+class PipelineInstrumentation:
+    """Sinks for stage timings and dependency concurrency (no-ops until set)"""
+
+    def __init__(self, observe_stage: Optional[Callable[[str, float, str, str, str], None]] = None,
+                 observe_dependency: Optional[Callable[[str, int], None]] = None,
+                 span: Optional[SpanFactory] = None):
+        self.observe_stage = observe_stage
+        self.observe_dependency = observe_dependency
+        self.span = span
+        self.in_flight: Dict[str, int] = {name: 0 for name in DEPENDENCIES}
+
+    def timer(self) -> StageTimer:
+        return StageTimer(self.span)
+
+    @contextmanager
+    def dependency(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """
+        Count a call to an external dependency while it runs
+        The span is not made current: the block may yield from an async generator
+        """
+        self._set_in_flight(name, 1)
+        try:
+            if self.span is None:
+                yield
+            else:
+                with self.span(name, {'peer.service': name, **(attributes or {})}, kind='client', current=False):
+                    yield
+        finally:
+            self._set_in_flight(name, -1)
+
+    def _set_in_flight(self, name: str, delta: int):
+        self.in_flight[name] = self.in_flight.get(name, 0) + delta
+        if self.observe_dependency:
+            self.observe_dependency(name, self.in_flight[name])
+
+    def finish(self, timer: StageTimer, tenant_id: str, intent: Optional[str], outcome: str):
+        """Report a finished request's stages"""
+        if self.observe_stage is None:
+            return
+        try:
+            for stage, seconds in timer.timings.items():
+                self.observe_stage(stage, seconds, tenant_id, intent or 'unknown', outcome)
+        except Exception as e:
+            logger.warning(f"Stage metrics failed: {e}")
@@ -4,18 +4,29 @@ Refactored ImprovedDualModelDynamicAISystem
 Clean architecture with separated concerns
 """
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import os
+import re
 import time
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
+from dataclasses import dataclass, field
 from ..storage.redis_memory import ScalableStorageAdapter
 from ..storage.scalable_database import ScalableDatabaseHandler
 from ..storage.database import SimplifiedDatabaseHandler
 from .context_handler import ContextHandler, ConversationTurn, ConversationState
+from .instrumentation import StageTimer, PipelineInstrumentation
 from collections import defaultdict
 from agents.nlp.general_chat_handler import GeneralChatHandler
-from ..utils.table_formatter import format_results_as_table_response
+from ..utils.table_formatter import format_results_as_table_response, get_table_title, TableFormatter
+from ..sql.pagination import ResultCursor
+from ..data.result_snapshot import ResultSnapshot, SnapshotQueryEngine
+from ..data.customer_alias import CustomerAliasBuilder, CustomerAliasRewriter
+from ..storage.fanout import FanoutExecutor
+from ..storage.result_export import ResultExportStore, ExportInfo
+from ..storage.memory import BoundedStateStore
+from ..storage.shared_state import SharedState
 logger = logging.getLogger(__name__)
 
 # =============================================================================
@@ -32,6 +43,7 @@ class QueryContext:
     entities: Optional[Dict] = None
     confidence: float = 0.0
     previous_intent: Optional[str] = None
+    timings: StageTimer = field(default_factory=StageTimer)
     
 @dataclass
 class ProcessingResult:
@@ -63,7 +75,12 @@ class ImprovedDualModelDynamicAISystem:
         # self.db_handler = ScalableDatabaseHandler()
         # self.db_handler = SimplifiedDatabaseHandler()
         self.context_handler = ContextHandler()
-        self.conversation_turns = defaultdict(list) 
+        # Per-user cursors and result snapshots: LRU capped, dropped after STATE_IDLE_TTL idle
+        self.conversation_states = BoundedStateStore(
+            int(os.getenv('MAX_CONVERSATION_STATES', '10000')),
+            float(os.getenv('STATE_IDLE_TTL', '86400'))
+        )
+        self.shared_state.on_invalidate(self._drop_conversation_state)
         self.general_chat = GeneralChatHandler()
         logger.info("🚀 Refactored System initialized")
     
@@ -83,15 +100,20 @@ class ImprovedDualModelDynamicAISystem:
         # ✅ ใช้ SimplifiedDatabaseHandler เสมอ (ซึ่งทำงานได้ดีอยู่แล้ว)
         self.db_handler = SimplifiedDatabaseHandler()
         
+        # Multi-year UNION ALL queries run per partition on a pooled handler
+        self.fanout_executor = FanoutExecutor(query_stats=self.db_handler.query_stats)
+        
+        # Large results are downloadable from /v1/results/{id}
+        self.result_exports = ResultExportStore()
+        
         # Redis storage (optional)
         try:
             from ..storage.redis_memory import ScalableStorageAdapter
             self.conversation_memory = ScalableStorageAdapter()
             logger.info("✅ Using Redis-based conversation memory")
         except Exception as e:
-            from ..storage.memory import ConversationMemory
             logger.warning(f"Redis unavailable: {e}, using in-memory storage")
-            self.conversation_memory = ConversationMemory()
+            self.conversation_memory = ScalableStorageAdapter(use_redis=False)
         
         # Other components
         self.prompt_manager = PromptManager()
@@ -99,6 +121,18 @@ class ImprovedDualModelDynamicAISystem:
         self.intent_detector = ImprovedIntentDetector()
         self.data_cleaner = DataCleaningEngine()
         self.ollama_client = SimplifiedOllamaClient()
+        self.table_formatter = TableFormatter()
+        self.snapshot_engine = SnapshotQueryEngine(self.table_formatter._translate_headers)
+        
+        # GROUP BY customer runs on canonical names once customer_alias is built
+        self.customer_alias = CustomerAliasRewriter()
+        try:
+            if self.db_handler.connection:
+                self.customer_alias.load(self.db_handler.connection)
+        except Exception as e:
+            logger.warning(f"Customer alias not loaded: {e}")
+    
+    FEATURES = ('conversation_memory', 'parallel_processing', 'data_cleaning', 'sql_validation')
     
     def _initialize_features(self):
         """Initialize feature flags"""
@@ -107,6 +141,15 @@ class ImprovedDualModelDynamicAISystem:
         self.enable_data_cleaning = True
         self.enable_sql_validation = True
         self.enable_few_shot_learning = True
+        
+        # Result paging ("ต่อ" / "show more")
+        self.page_size = int(os.getenv('RESULT_PAGE_SIZE', '100'))
+        self.cursor_ttl = int(os.getenv('RESULT_CURSOR_TTL', '1800'))
+        self.max_cursors_per_user = 3
+        
+        # Results at least this large are also written to a download file
+        self.export_threshold = int(os.getenv('RESULT_EXPORT_THRESHOLD', '500'))
+        self.export_base_url = os.getenv('RESULT_EXPORT_BASE_URL', '').rstrip('/')
     
     def _initialize_stats(self):
         """Initialize statistics tracking"""
@@ -120,6 +163,14 @@ class ImprovedDualModelDynamicAISystem:
         }
         self.dynamic_examples = []
         self.max_dynamic_examples = 100
+        
+        # Counters, feature flags and conversation states shared by all workers
+        self.shared_state = SharedState('orchestrator', flags=self.feature_flags(),
+                                        to_json=ConversationState.to_dict,
+                                        from_json=ConversationState.from_dict)
+        
+        # Per-stage timings and dependency in-flight counts (metric sinks set by the service)
+        self.instrumentation = PipelineInstrumentation()
     
     # =========================================================================
     # MAIN PROCESSING METHOD - REFACTORED
@@ -132,76 +183,396 @@ class ImprovedDualModelDynamicAISystem:
         Main processing pipeline - clean and modular
         """
         start_time = time.time()
-        context = QueryContext(question, tenant_id, user_id)
+        context = QueryContext(question, tenant_id, user_id, timings=self.instrumentation.timer())
         
         try:
-            # Step 1: Preparation (MUST BE FIRST - loads conversation context)
-            await self._prepare_processing(context)
-            await self._detect_intent(context)
-            is_general, chat_type = self.general_chat.is_general_chat(question)
-            if is_general:
-                response = self.general_chat.get_response(chat_type, question)
-                return {
-                    'answer': response,
-                    'success': True,
-                    'intent': f'general_{chat_type}',
-                    'entities': {},
-                    'confidence': 1.0,
-                    'processing_time': time.time() - start_time,
-                    'tenant_id': tenant_id,
-                    'user_id': user_id
-                }
-            # Check for continuation query (AFTER context is loaded)
-            continuation_result = await self.handle_continuation_query(context)
-            if continuation_result:
-                return continuation_result
+            with context.timings.stage('state'):
+                await self._load_conversation_state(user_id)
             
-            # Step 2: Intent Detection
-            await self._detect_intent(context)
+            # Steps 1-4: Preparation, intent, clarification, SQL generation
+            early_response, sql_query = await self._plan_query(context, start_time)
+            if early_response:
+                return self._record_timings(context, early_response)
             
-            # Step 3: Check if clarification needed
-            if await self._needs_clarification(context):
-                return self._create_clarification_response(context)
+            # Step 5: Query Execution
+            with context.timings.stage('execution'):
+                results = await self._execute_query(sql_query, context.tenant_id)
             
-            # Step 4: SQL Generation
-            sql_query = await self._generate_sql(context)
+            # Keep the full result for follow-ups ("อันดับแรก", "รวมทั้งหมดนั้น")
+            self._remember_result(context, results)
             
-            # Step 5: Query Execution
-            results = await self._execute_query(sql_query)
+            # Very large results: write the full set once as a download
+            with context.timings.stage('export'):
+                export = await self._export_results(context, results, sql_query)
+            
+            # Large results: show the first page, keep a cursor for "ต่อ"
+            cursor = self._open_cursor(context, sql_query, results)
+            if cursor:
+                results = results[:self.page_size]
             
             # Step 6: Data Processing
-            processed_data = await self._process_results(results, context)
+            processed_data = await self._process_results(results, context, sql_query)
             
             # Step 7: Response Generation
-            response = await self._generate_response(
-                context, sql_query, processed_data
-            )
+            with context.timings.stage('formatting'):
+                response = await self._generate_response(
+                    context, sql_query, processed_data, cursor
+                )
+            if export:
+                response += '\n\n' + self._format_export_link(export)
             
             # Step 8: Finalization
-            return self._finalize_response(
+            final_response = self._finalize_response(
                 response, context, start_time
             )
+            if export:
+                final_response['export'] = self._export_summary(export)
+            return self._record_timings(context, final_response)
             
         except Exception as e:
-            return self._handle_error(e, context, start_time)
+            return self._record_timings(context, self._handle_error(e, context, start_time))
     
-    async def handle_continuation_query(self, context: QueryContext) -> Optional[Dict[str, Any]]:
+    async def stream_any_question(self, question: str,
+                                  tenant_id: str = 'company-a',
+                                  user_id: str = 'default',
+                                  batch_size: int = 500) -> AsyncIterator[str]:
+        """
+        Streaming pipeline - yields markdown chunks as rows arrive
+        server-side cursor batches → lazy cleaner → incremental table formatter
+        """
+        start_time = time.time()
+        context = QueryContext(question, tenant_id, user_id, timings=self.instrumentation.timer())
+        
+        try:
+            with context.timings.stage('state'):
+                await self._load_conversation_state(user_id)
+            early_response, sql_query = await self._plan_query(context, start_time)
+            if early_response:
+                self._record_timings(context, early_response)
+                yield early_response.get('answer', '')
+                return
+            
+            # The full result is streamed, so there is nothing left to page
+            # and no snapshot to answer follow-ups from
+            self._clear_active_cursor(context.user_id)
+            self._remember_result(context, [])
+            
+            cleaning_stats = self.data_cleaner.new_stats()
+            table = self.table_formatter.markdown_stream(get_table_title(context.question))
+            
+            # Execution = waiting for the next batch; cleaning is lazy, so it
+            # is counted in formatting (time spent sending chunks is not timed)
+            batches = self.db_handler.stream_query(sql_query, context.tenant_id, batch_size)
+            with self.instrumentation.dependency('postgres', self._db_span_attributes(sql_query, context.tenant_id)):
+                while True:
+                    with context.timings.stage('execution'):
+                        batch = await anext(batches, None)
+                    if batch is None:
+                        break
+                    rows = batch
+                    if self.enable_data_cleaning:
+                        rows = self.data_cleaner.iter_clean_rows(batch, context.intent, cleaning_stats)
+                    with context.timings.stage('formatting'):
+                        chunks = list(table.feed(rows))
+                    for chunk in chunks:
+                        yield chunk
+            
+            yield table.close()
+            logger.info(f"Streamed {table.row_count} rows")
+            self._record_timings(context, self._finalize_response('', context, start_time))
+            
+        except Exception as e:
+            yield self._record_timings(context, self._handle_error(e, context, start_time))['answer']
+    
+    async def _plan_query(self, context: QueryContext,
+                          start_time: float) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Steps shared by the buffered and streaming pipelines
+        Returns (early_response, None) when no SQL is needed, otherwise (None, sql)
+        """
+        # "ต่อ" pages the previous result directly - no LLM, intent or re-planning
+        continuation_result = await self.handle_continuation_query(context, start_time)
+        if continuation_result:
+            return continuation_result, None
+        
+        # Follow-ups over the previous result are computed locally
+        snapshot_result = await self.answer_from_snapshot(context, start_time)
+        if snapshot_result:
+            return snapshot_result, None
+        
+        # Step 1: Preparation (loads conversation context)
+        with context.timings.stage('prepare'):
+            await self._prepare_processing(context)
+        
+        # Step 2: Intent Detection
+        with context.timings.stage('intent'):
+            await self._detect_intent(context)
+            is_general, chat_type = self.general_chat.is_general_chat(context.question)
+        if is_general:
+            response = self.general_chat.get_response(chat_type, context.question)
+            return {
+                'answer': response,
+                'success': True,
+                'intent': f'general_{chat_type}',
+                'entities': {},
+                'confidence': 1.0,
+                'processing_time': time.time() - start_time,
+                'tenant_id': context.tenant_id,
+                'user_id': context.user_id
+            }, None
+        
+        # Step 3: Check if clarification needed
+        if await self._needs_clarification(context):
+            return self._create_clarification_response(context), None
+        
+        # Step 4: SQL Generation
+        return None, await self._generate_sql(context)
+    
+    async def handle_continuation_query(self, context: QueryContext,
+                                        start_time: float) -> Optional[Dict[str, Any]]:
         """
         Handle continuation/pagination queries
         Returns None if not a continuation query
         """
-        # Get conversation context (already loaded in _prepare_processing)
-        user_memory = self.conversation_memory.get_context(
-            context.user_id, 
-            context.question
+        if not self.context_handler.is_continuation_request(context.question):
+            return None
+        
+        state = self.conversation_states.get(context.user_id)
+        cursor = state.result_cursors.get(state.active_cursor_id) if state else None
+        if cursor is None or cursor.is_expired(self.cursor_ttl):
+            return None  # Nothing to page, proceed normally
+        
+        self._count('total_queries')
+        context.intent = cursor.intent
+        context.entities = {}
+        context.confidence = 1.0
+        
+        if cursor.exhausted:
+            return self._finalize_response("แสดงข้อมูลครบทุกรายการแล้ว", context, start_time)
+        
+        sql, params = cursor.next_page_query()
+        with context.timings.stage('execution'):
+            rows = await self._execute_query(sql, context.tenant_id, params)
+        cursor.advance(rows)
+        cursor.page += 1
+        self._save_conversation_state(context.user_id)
+        logger.info(f"Continuation page {cursor.page} of cursor {cursor.cursor_id}: {len(rows)} rows")
+        
+        if not rows:
+            return self._finalize_response("แสดงข้อมูลครบทุกรายการแล้ว", context, start_time)
+        
+        processed_data = await self._process_results(rows, context, cursor.plan.base_sql)
+        with context.timings.stage('formatting'):
+            answer = self._format_page(processed_data['results'], cursor)
+        return self._finalize_response(answer, context, start_time)
+    
+    async def answer_from_snapshot(self, context: QueryContext,
+                                   start_time: float) -> Optional[Dict[str, Any]]:
+        """
+        Answer result-reference follow-ups from the last result snapshot
+        Returns None when the question needs a fresh query
+        """
+        ref_type = self.context_handler.detect_result_followup(context.question)
+        if not ref_type:
+            return None
+        
+        state = self.conversation_states.get(context.user_id)
+        snapshot = state.last_result if state else None
+        if snapshot is None or snapshot.is_expired(self.cursor_ttl):
+            return None
+        
+        with context.timings.stage('snapshot'):
+            if self._changes_subject(context.question, snapshot):
+                return None
+            local = self.snapshot_engine.answer(snapshot, context.question, ref_type)
+        if local is None:
+            return None
+        
+        self._count('total_queries')
+        context.intent = snapshot.intent
+        context.entities = {}
+        context.confidence = 1.0
+        logger.info(f"Answered from snapshot: {local.operation} over {snapshot.row_count} rows")
+        
+        if local.rows is None:
+            value = f"{local.value:,}" if isinstance(local.value, int) else f"{local.value:,.2f}"
+            answer = f"**{local.description}: {value}**\n\n_คำนวณจากผลลัพธ์ก่อนหน้า {snapshot.row_count:,} รายการ_"
+        else:
+            rows = local.rows[:self.page_size]
+            processed_data = await self._process_results(rows, context)
+            summary = local.description
+            if len(local.rows) > len(rows):
+                summary += f" - แสดง {len(rows):,} จาก {len(local.rows):,} รายการ"
+            with context.timings.stage('formatting'):
+                answer = self.table_formatter.format_results_as_table(
+                    processed_data['results'], title=get_table_title(snapshot.question), summary=summary
+                ) if rows else self._generate_no_results_response(context)
+        
+        response = self._finalize_response(answer, context, start_time)
+        response['answered_from'] = 'result_snapshot'
+        return response
+
+    # Entities that make a question about something other than the snapshot
+    SNAPSHOT_SUBJECT_ENTITIES = ('customers', 'products', 'brands', 'job_types', 'years', 'months', 'dates')
+    SNAPSHOT_INTENT_CONFIDENCE = 0.8
+
+    def _changes_subject(self, question: str, snapshot: ResultSnapshot) -> bool:
+        """
+        True when the question names a customer / product / period the snapshot
+        question did not, or is confidently about another intent
+        """
+        detection = self.intent_detector.detect_intent_and_entities(question)
+        previous = self.intent_detector.detect_intent_and_entities(snapshot.question).get('entities') or {}
+        entities = detection.get('entities') or {}
+        for key in self.SNAPSHOT_SUBJECT_ENTITIES:
+            new = set(map(str, entities.get(key) or [])) - set(map(str, previous.get(key) or []))
+            if new:
+                logger.info(f"Not answering from snapshot: new {key} {sorted(new)}")
+                return True
+        intent = detection.get('intent')
+        if (snapshot.intent and intent and intent != snapshot.intent
+                and detection.get('confidence', 0) >= self.SNAPSHOT_INTENT_CONFIDENCE):
+            logger.info(f"Not answering from snapshot: intent {intent} differs from {snapshot.intent}")
+            return True
+        return False
+
+    async def last_turn(self, user_id: str, fallback_question: str = '') -> ConversationTurn:
+        """
+        The user's last answered question and intent, for OpenWebUI background
+        prompts (title, tags, follow-ups) - no pipeline, no LLM
+        Falls back to detecting the intent of fallback_question
+        """
+        await self._load_conversation_state(user_id)
+        state = self.conversation_states.get(user_id)
+        snapshot = state.last_result if state is not None else None
+        if snapshot is not None and snapshot.question:
+            return ConversationTurn(turn_id=state.turn_count, question=snapshot.question, intent=snapshot.intent)
+
+        if not fallback_question:
+            return ConversationTurn(turn_id=0, question='')
+        detection = self.intent_detector.detect_intent_and_entities(fallback_question)
+        return ConversationTurn(turn_id=0, question=fallback_question,
+                                intent=detection.get('intent'), entities=detection.get('entities') or {})
+
+    def _remember_result(self, context: QueryContext, results: List[Dict]):
+        """Replace the user's result snapshot (empty/oversized results clear it)"""
+        snapshot = ResultSnapshot.from_rows(results, context.question, context.intent)
+        if snapshot is None and context.user_id not in self.conversation_states:
+            return
+        self._get_conversation_state(context.user_id).last_result = snapshot
+    
+    def _get_conversation_state(self, user_id: str) -> ConversationState:
+        """Per-user conversation state (LRU bounded, idle TTL)"""
+        state = self.conversation_states.get(user_id)
+        if state is None:
+            state = ConversationState(user_id=user_id, session_id=user_id)
+            self.conversation_states.set(user_id, state)
+        # Callers modify the state
+        self._save_conversation_state(user_id)
+        return state
+    
+    async def _load_conversation_state(self, user_id: str):
+        """Pick up the state another worker saved (only on a local miss)"""
+        if not self.shared_state.shared or user_id in self.conversation_states:
+            return
+        with self.instrumentation.dependency('redis'):
+            state = await self.shared_state.load(user_id)
+        if state is not None and user_id not in self.conversation_states:
+            self.conversation_states.set(user_id, state)
+    
+    def _save_conversation_state(self, user_id: str):
+        self.shared_state.save_later(user_id, self.conversation_states.get(user_id))
+    
+    def _drop_conversation_state(self, user_id: Optional[str]):
+        """Another worker saved this user's state (None: drop all, updates may be missed)"""
+        if user_id is None:
+            self.conversation_states.clear()
+        else:
+            self.conversation_states.pop(user_id)
+    
+    def _open_cursor(self, context: QueryContext, sql: str,
+                     results: List[Dict]) -> Optional[ResultCursor]:
+        """Register a cursor when results exceed one page (results = raw DB rows)"""
+        if len(results) <= self.page_size:
+            self._clear_active_cursor(context.user_id)
+            return None
+        
+        cursor = ResultCursor.after_first_page(
+            sql, results, self.page_size, context.question, context.intent
         )
+        state = self._get_conversation_state(context.user_id)
+        state.result_cursors[cursor.cursor_id] = cursor
+        state.active_cursor_id = cursor.cursor_id
+        while len(state.result_cursors) > self.max_cursors_per_user:
+            state.result_cursors.pop(next(iter(state.result_cursors)))
         
-        # Check if this is a continuation query
-        if not user_memory.get('is_continuation'):
-            return None  # Not a continuation, proceed normally
+        mode = 'keyset' if cursor.plan.uses_keyset else 'offset'
+        logger.info(f"Opened {mode} cursor {cursor.cursor_id} ({len(results)} rows, page size {self.page_size})")
+        return cursor
+    
+    async def _export_results(self, context: QueryContext, results: List[Dict],
+                              sql: str) -> Optional[ExportInfo]:
+        """Write cleaned results to the export store (None below the threshold or on failure)"""
+        if len(results) < self.export_threshold:
+            return None
+        try:
+            return await asyncio.to_thread(
+                self.result_exports.write,
+                self._iter_export_rows(results, context, sql),
+                question=context.question,
+                tenant_id=context.tenant_id
+            )
+        except Exception as e:
+            logger.warning(f"Result export failed: {e}")
+            return None
+    
+    def _iter_export_rows(self, results: List[Dict], context: QueryContext,
+                          sql: str, batch_size: int = 5000):
+        """Clean rows batch by batch so the full result is never copied at once"""
+        if not self.enable_data_cleaning:
+            yield from results
+            return
+        for start in range(0, len(results), batch_size):
+            yield from self.data_cleaner.iter_clean_rows(results[start:start + batch_size], context.intent)
+    
+    def _export_summary(self, export: ExportInfo) -> Dict[str, Any]:
+        return {
+            'result_id': export.result_id,
+            'url': f"{self.export_base_url}/v1/results/{export.result_id}",
+            'format': export.format,
+            'rows': export.rows,
+            'size_bytes': export.size_bytes,
+            'expires_at': export.expires_at
+        }
+    
+    def _format_export_link(self, export: ExportInfo) -> str:
+        url = f"{self.export_base_url}/v1/results/{export.result_id}"
+        minutes = max(int((export.expires_at - export.created_at) // 60), 1)
+        return (
+            f"📥 [ดาวน์โหลดผลลัพธ์ทั้งหมด ({export.rows:,} รายการ, {export.format.upper()})]({url})"
+            f" _ลิงก์ใช้ได้ {minutes} นาที_"
+        )
+    
+    def _clear_active_cursor(self, user_id: str):
+        """A new answer replaces whatever "ต่อ" would have paged"""
+        state = self.conversation_states.get(user_id)
+        if state and state.active_cursor_id:
+            state.active_cursor_id = None
+            self._save_conversation_state(user_id)
+    
+    def _format_page(self, results: List[Dict], cursor: ResultCursor) -> str:
+        """Render one page with its position and a "show more" hint"""
+        start = cursor.fetched - len(results) + 1
+        summary = f"แสดงรายการที่ {start:,}-{cursor.fetched:,}"
+        if cursor.total_rows:
+            summary += f" จากทั้งหมด {cursor.total_rows:,} รายการ"
         
-        # Rest of continuation handling logic...
-        # (code from the artifact I provided earlier)   
+        answer = self.table_formatter.format_results_as_table(
+            results, title=get_table_title(cursor.question), summary=summary
+        )
+        if not cursor.exhausted:
+            answer += '\n\n_พิมพ์ "ต่อ" เพื่อดูรายการถัดไป_'
+        return answer
 
     # =========================================================================
     # STEP 1: PREPARATION
@@ -209,16 +580,18 @@ class ImprovedDualModelDynamicAISystem:
     
     async def _prepare_processing(self, context: QueryContext):
         """Prepare for processing"""
-        self.stats['total_queries'] += 1
+        self._count('total_queries')
         
         # Ensure Ollama connection
-        await self.ollama_client.test_connection()
+        with self.instrumentation.dependency('ollama'):
+            await self.ollama_client.test_connection()
         
         # Get conversation context if enabled
         if self.enable_conversation_memory:
-            conv_context = self.conversation_memory.get_context(
-                context.user_id, context.question
-            )
+            with self.instrumentation.dependency('redis'):
+                conv_context = await self.conversation_memory.get_context(
+                    context.user_id, context.question
+                )
             context.previous_intent = conv_context.get('recent_intents', [None])[-1] if conv_context.get('recent_intents') else None
         
         logger.info(f"Processing: {context.question[:100]}...")
@@ -325,16 +698,25 @@ class ImprovedDualModelDynamicAISystem:
         )
         
         # Generate SQL
-        sql = await self.ollama_client.generate(prompt, self.SQL_MODEL)
+        usage_labels = {'tenant': context.tenant_id, 'intent': context.intent or 'unknown',
+                        'template': self.prompt_manager.last_template}
+        span_attributes = {'llm.model': self.SQL_MODEL, 'llm.template': usage_labels['template']}
+        with context.timings.stage('sql_generation'), self.instrumentation.dependency('ollama', span_attributes):
+            sql = await self.ollama_client.generate(prompt, self.SQL_MODEL, usage_labels)
         sql = self._clean_sql_response(sql)
         
-        # Validate and fix if enabled
-        if self.enable_sql_validation:
-            is_valid, fixed_sql, issues = self.sql_validator.validate_and_fix(sql)
-            if issues:
-                self.stats['validation_fixes'] += len(issues)
-                logger.info(f"SQL fixes applied: {len(issues)}")
-            sql = fixed_sql
+        with context.timings.stage('validation'):
+            # Validate and fix if enabled
+            if self.enable_sql_validation:
+                is_valid, fixed_sql, issues = self.sql_validator.validate_and_fix(sql)
+                if issues:
+                    self._count('validation_fixes', len(issues))
+                    logger.info(f"SQL fixes applied: {len(issues)}")
+                sql = fixed_sql
+            
+            sql, aliased = self.customer_alias.rewrite(sql)
+        if aliased:
+            logger.info("Customer names grouped through customer_alias")
         
         logger.info(f"Generated SQL:\n{sql}") 
         return sql
@@ -343,23 +725,57 @@ class ImprovedDualModelDynamicAISystem:
     # STEP 5: QUERY EXECUTION
     # =========================================================================
     
-    async def _execute_query(self, sql: str) -> List[Dict]:
-        """Execute SQL query"""
+    async def _execute_query(self, sql: str, tenant_id: Optional[str] = None,
+                             params: Optional[tuple] = None) -> List[Dict]:
+        """Execute SQL query (cost guard applies per tenant)"""
         try:
-            results = await self.db_handler.execute_query(sql)
+            if params is None and self.enable_parallel_processing:
+                with self.instrumentation.dependency('postgres', self._db_span_attributes(sql, tenant_id)):
+                    results = await self._execute_fanout(sql, tenant_id)
+                if results is not None:
+                    logger.info(f"Query returned {len(results)} results")
+                    return results
+            
+            with self.instrumentation.dependency('postgres', self._db_span_attributes(sql, tenant_id)):
+                results = await self.db_handler.execute_query(sql, tenant_id, params)
             logger.info(f"Query returned {len(results)} results")
             return results
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
             raise
     
+    @staticmethod
+    def _db_span_attributes(sql: str, tenant_id: Optional[str]) -> Dict[str, Any]:
+        return {'db.system': 'postgresql', 'db.statement': sql[:2000], 'tenant': tenant_id or ''}
+    
+    async def _execute_fanout(self, sql: str, tenant_id: Optional[str]) -> Optional[List[Dict]]:
+        """
+        Run multi-year UNION ALL queries as concurrent partitions
+        Returns None when the query is not eligible (caller runs it serially)
+        """
+        plan = self.fanout_executor.plan(sql)
+        if plan is None:
+            return None
+        
+        # Same admission as the serial path; a LIMIT rewrite means run it serially
+        admitted_sql, _ = self.db_handler.admit_query(sql, tenant_id)
+        if admitted_sql != sql:
+            return None
+        
+        try:
+            return await self.fanout_executor.execute(sql, plan)
+        except Exception as e:
+            logger.warning(f"Fan-out failed, running serially: {e}")
+            return None
+    
     # =========================================================================
     # STEP 6: DATA PROCESSING
     # =========================================================================
     
     async def _process_results(self, results: List[Dict], 
-                              context: QueryContext) -> Dict:
-        """Process and clean results"""
+                              context: QueryContext,
+                              sql: Optional[str] = None) -> Dict:
+        """Process and clean results (sql picks the cleaner's cached column plan)"""
         processed = {
             'results': results,
             'insights': {},
@@ -371,7 +787,12 @@ class ImprovedDualModelDynamicAISystem:
         
         # Clean data if enabled
         if self.enable_data_cleaning:
-            cleaned_results, cleaning_stats = self.data_cleaner.clean_results(results, context.intent)
+            view = re.search(r'\bv_[a-z_]+\d*', sql or '', re.IGNORECASE)
+            with context.timings.stage('cleaning'):
+                cleaned_results, cleaning_stats = self.data_cleaner.clean_results(
+                    results, context.intent, view.group().lower() if view else None,
+                    standardize_names=not self.customer_alias.is_rewritten(sql)
+                )
             processed['results'] = cleaned_results  # ← ใช้ cleaned
         else:
             processed['results'] = results
@@ -384,12 +805,16 @@ class ImprovedDualModelDynamicAISystem:
     
     async def _generate_response(self, context: QueryContext, 
                                 sql_query: str,
-                                processed_data: Dict) -> str:
+                                processed_data: Dict,
+                                cursor: Optional[ResultCursor] = None) -> str:
         results = processed_data['results']
         
         if not results:
             return self._generate_no_results_response(context)
         
+        if cursor:
+            return self._format_page(results, cursor)
+        
         # ใช้ Table Formatter แทน LLM
         return format_results_as_table_response(results, context.question)
     
@@ -403,7 +828,7 @@ class ImprovedDualModelDynamicAISystem:
         processing_time = time.time() - start_time
         
         # Update stats
-        self.stats['successful_queries'] += 1
+        self._count('successful_queries')
         self._update_response_time_stats(processing_time)
         
         # Add to conversation memory if enabled
@@ -411,7 +836,7 @@ class ImprovedDualModelDynamicAISystem:
             self.conversation_memory.add_conversation(
                 context.user_id,
                 context.question,
-                {'intent': context.intent, 'success': True}
+                {'intent': context.intent, 'success': True, 'processing_time': processing_time}
             )
         
         return {
@@ -425,6 +850,19 @@ class ImprovedDualModelDynamicAISystem:
             'user_id': context.user_id
         }
     
+    def _record_timings(self, context: QueryContext, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Report stage timings under the final intent/outcome and attach the breakdown (ms)"""
+        if not response.get('success', False):
+            outcome = 'error'
+        elif response.get('needs_clarification'):
+            outcome = 'clarification'
+        else:
+            outcome = 'success'
+        self.instrumentation.finish(context.timings, context.tenant_id,
+                                    response.get('intent') or context.intent, outcome)
+        response['timings'] = context.timings.breakdown()
+        return response
+    
     # =========================================================================
     # ERROR HANDLING
     # =========================================================================
@@ -432,7 +870,7 @@ class ImprovedDualModelDynamicAISystem:
     def _handle_error(self, error: Exception, context: QueryContext, 
                      start_time: float) -> Dict[str, Any]:
         """Handle processing errors"""
-        self.stats['failed_queries'] += 1
+        self._count('failed_queries')
         processing_time = time.time() - start_time
         
         logger.error(f"Processing failed: {error}")
@@ -469,8 +907,14 @@ class ImprovedDualModelDynamicAISystem:
             sql += ';'
         return sql.strip()
     
+    def _count(self, name: str, amount: float = 1):
+        """Bump a counter here and in the cross-worker totals"""
+        self.stats[name] += amount
+        self.shared_state.incr(name, amount)
+    
     def _update_confidence_stats(self, confidence: float):
         """Update confidence statistics"""
+        self.shared_state.incr('confidence_sum', confidence)
         total = self.stats['total_queries']
         if total > 0:  # เพิ่มการ check
             self.stats['avg_confidence'] = (
@@ -481,6 +925,7 @@ class ImprovedDualModelDynamicAISystem:
     
     def _update_response_time_stats(self, response_time: float):
         """Update response time statistics"""
+        self.shared_state.incr('response_time_sum', response_time)
         total = self.stats['successful_queries']
         self.stats['avg_response_time'] = (
             (self.stats['avg_response_time'] * (total - 1) + response_time) / total
@@ -510,6 +955,8 @@ class ImprovedDualModelDynamicAISystem:
             return "ขออภัย เกิดข้อผิดพลาดในการเข้าถึงข้อมูล กรุณาลองใหม่"
         elif 'timeout' in error_msg.lower():
             return "ขออภัย การประมวลผลใช้เวลานานเกินไป กรุณาลองใหม่"
+        elif 'too expensive' in error_msg.lower():
+            return "ขออภัย คำถามนี้ครอบคลุมข้อมูลกว้างเกินไป กรุณาระบุช่วงเวลา ลูกค้า หรือเงื่อนไขให้แคบลง"
         else:
             return "ขออภัย เกิดข้อผิดพลาดในการประมวลผล กรุณาลองใหม่"
     
@@ -517,6 +964,64 @@ class ImprovedDualModelDynamicAISystem:
     # PUBLIC METHODS
     # =========================================================================
     
+    def rebuild_customer_aliases(self) -> Dict[str, Any]:
+        """Rebuild customer_alias and reload the rewriter (blocking - run in a thread)"""
+        connection = self.db_handler.open_connection()
+        try:
+            builder = CustomerAliasBuilder(self.data_cleaner._standardize_company_name)
+            stats = builder.build(connection)
+            self.customer_alias.load(connection)
+            return stats
+        finally:
+            connection.close()
+    
+    def feature_flags(self) -> Dict[str, bool]:
+        return {name: getattr(self, f"enable_{name}") for name in self.FEATURES}
+    
+    def apply_feature_flags(self):
+        """Set flags from the shared values (admin toggles reach every worker)"""
+        for name, enabled in self.shared_state.flags.items():
+            if name in self.FEATURES:
+                setattr(self, f"enable_{name}", enabled)
+    
+    async def set_feature_flag(self, name: str, enabled: bool):
+        setattr(self, f"enable_{name}", enabled)
+        await self.shared_state.set_flag(name, enabled)
+    
+    async def get_shared_performance(self) -> Dict[str, Any]:
+        """Performance totals over all workers"""
+        counters = await self.shared_state.counters()
+        total = counters.get('total_queries', 0)
+        successful = counters.get('successful_queries', 0)
+        return {
+            'total_queries': int(total),
+            'successful_queries': int(successful),
+            'failed_queries': int(counters.get('failed_queries', 0)),
+            'validation_fixes': int(counters.get('validation_fixes', 0)),
+            'success_rate': successful / total * 100 if total else 0.0,
+            'avg_confidence': counters.get('confidence_sum', 0) / total if total else 0.0,
+            'avg_response_time': counters.get('response_time_sum', 0) / successful if successful else 0.0
+        }
+    
+    # =========================================================================
+    # MULTI-WORKER (gunicorn --preload)
+    # =========================================================================
+    
+    def prepare_for_fork(self):
+        """
+        In the master before workers fork: close sockets the children must
+        not share; loaded prompts, schemas and alias maps stay and are shared
+        copy-on-write
+        """
+        if self.db_handler.connection:
+            self.db_handler.connection.close()
+            self.db_handler.connection = None   # each worker reconnects on first query
+    
+    def after_fork(self):
+        """In each worker: fresh identities so pub/sub messages reach the other workers"""
+        self.shared_state.after_fork()
+        self.conversation_memory.after_fork()
+    
     def get_system_stats(self) -> Dict[str, Any]:
         """Get system statistics"""
         return {
@@ -527,6 +1032,15 @@ class ImprovedDualModelDynamicAISystem:
                 'data_cleaning': self.enable_data_cleaning,
                 'sql_validation': self.enable_sql_validation
             },
+            'fanout': self.fanout_executor.get_stats(),
+            'exports': self.result_exports.get_stats(),
+            'customer_alias': self.customer_alias.get_stats(),
+            'conversation_memory': self.conversation_memory.get_stats(),
+            'shared_state': self.shared_state.get_stats(),
+            'conversation_states': {
+                'users': len(self.conversation_states),
+                'evictions': dict(self.conversation_states.evictions)
+            },
             'models': {
                 'sql_generation': getattr(self, 'SQL_MODEL', 'default'),
                 'response_generation': getattr(self, 'NL_MODEL', 'default')
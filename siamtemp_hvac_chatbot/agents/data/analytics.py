@@ -0,0 +1,173 @@
+# agents/data/analytics.py
+"""
+Vectorized result analytics
+A result set is converted to typed columns once; totals, distinct counts,
+top-k, per-group aggregates and breakdowns then run on NumPy arrays
+"""
+
+import re
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_NON_NUMERIC = re.compile(r'[^0-9.-]')
+_NUMBER_TYPES = (int, float, Decimal)
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+def sequential_sum(values: np.ndarray) -> float:
+    """
+    Left-to-right float sum (np.sum is pairwise and can differ in the last
+    bits from the Python loops these aggregates replaced)
+    """
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+def stable_desc_order(values: np.ndarray) -> np.ndarray:
+    """Indices sorting values descending, ties keep input order (like sorted(reverse=True))"""
+    return np.argsort(-values, kind='stable')
+
+def factorize(values: Sequence[Any], include: Optional[Callable[[Any], bool]] = None
+              ) -> Tuple[List[Any], np.ndarray]:
+    """
+    (uniques in first-seen order, codes) - excluded values get code -1
+    """
+    index: Dict[Any, int] = {}
+    setdefault = index.setdefault
+    if include is None:
+        codes = [setdefault(value, len(index)) for value in values]
+    else:
+        codes = [setdefault(value, len(index)) if include(value) else -1 for value in values]
+    return list(index), np.fromiter(codes, dtype=np.int64, count=len(codes))
+
+def grouped_totals(keys: Sequence[Any], weights: np.ndarray,
+                   include: Optional[Callable[[Any], bool]] = bool
+                   ) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+    """Per-group (keys, sums, counts) in first-seen key order"""
+    uniques, codes = factorize(keys, include)
+    mask = codes >= 0
+    size = len(uniques)
+    sums = np.bincount(codes[mask], weights=weights[mask], minlength=size)
+    counts = np.bincount(codes[mask], minlength=size)
+    return uniques, sums, counts
+
+# =============================================================================
+# TYPED COLUMNS
+# =============================================================================
+
+class ResultColumns:
+    """
+    Column view over a list of row dicts
+    Columns come from the first row (DB result sets are rectangular);
+    each column is materialized once and cached
+    """
+
+    __slots__ = ('rows', 'columns', 'row_count', '_values', '_numeric', '_factors')
+
+    def __init__(self, rows: Optional[List[Dict]]):
+        self.rows = rows or []
+        self.columns = list(self.rows[0].keys()) if self.rows else []
+        self.row_count = len(self.rows)
+        self._values: Dict[str, List[Any]] = {}
+        self._numeric: Dict[Tuple[str, bool], np.ndarray] = {}
+        self._factors: Dict[Tuple[str, bool], Tuple[List[Any], np.ndarray]] = {}
+
+    def has(self, name: str) -> bool:
+        return name in self.columns
+
+    def first_present(self, *names: str) -> Optional[str]:
+        return next((name for name in names if name in self.columns), None)
+
+    def values(self, name: str) -> List[Any]:
+        column = self._values.get(name)
+        if column is None:
+            column = [row.get(name) for row in self.rows]
+            self._values[name] = column
+        return column
+
+    def numeric(self, name: str, parse_strings: bool = False) -> np.ndarray:
+        """
+        float64 column - None/empty count as 0
+        parse_strings=True reads '1,234.50 บาท' style cells; otherwise text is 0
+        """
+        key = (name, parse_strings)
+        column = self._numeric.get(key)
+        if column is None:
+            column = np.fromiter(
+                (self._to_float(value, parse_strings) for value in self.values(name)),
+                dtype=np.float64, count=self.row_count
+            )
+            self._numeric[key] = column
+        return column
+
+    @staticmethod
+    def _to_float(value: Any, parse_strings: bool) -> float:
+        if not value:
+            return 0.0
+        if isinstance(value, _NUMBER_TYPES):
+            return float(value)
+        if parse_strings and isinstance(value, str):
+            cleaned = _NON_NUMERIC.sub('', value)
+            try:
+                return float(cleaned) if cleaned else 0.0
+            except ValueError:
+                return 0.0
+        return 0.0
+
+    def _factorize(self, name: str, truthy_only: bool) -> Tuple[List[Any], np.ndarray]:
+        key = (name, truthy_only)
+        factors = self._factors.get(key)
+        if factors is None:
+            factors = factorize(self.values(name), bool if truthy_only else None)
+            self._factors[key] = factors
+        return factors
+
+    # =========================================================================
+    # AGGREGATES
+    # =========================================================================
+
+    def total(self, name: str, parse_strings: bool = False) -> float:
+        return sequential_sum(self.numeric(name, parse_strings))
+
+    def mean(self, name: str) -> float:
+        """Average over all rows (0 for an empty result)"""
+        return self.total(name) / max(self.row_count, 1)
+
+    def count_positive(self, name: str) -> int:
+        return int(np.count_nonzero(self.numeric(name) > 0))
+
+    def count_truthy(self, name: str) -> int:
+        return sum(1 for value in self.values(name) if value)
+
+    def distinct(self, name: str) -> List[Any]:
+        """Distinct non-empty values in first-seen order"""
+        return self._factorize(name, truthy_only=True)[0]
+
+    def value_counts(self, name: str, truthy_only: bool = False,
+                     top: Optional[int] = None, ordered: bool = True) -> List[Tuple[Any, int]]:
+        """
+        (value, count) pairs - ordered=True sorts like Counter.most_common(),
+        ordered=False keeps first-seen order
+        """
+        uniques, codes = self._factorize(name, truthy_only)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        order = stable_desc_order(counts) if ordered else np.arange(len(uniques))
+        if top is not None:
+            order = order[:top]
+        return [(uniques[i], int(counts[i])) for i in order]
+
+    def breakdown(self, name: str, truthy_only: bool = False) -> Dict[Any, float]:
+        """Percentage of rows per value (first-seen order)"""
+        if not self.row_count:
+            return {}
+        return {
+            value: count / self.row_count * 100
+            for value, count in self.value_counts(name, truthy_only, ordered=False)
+        }
+
+    def top_k(self, name: str, k: int) -> List[Dict]:
+        """Rows with the k largest values of a numeric column"""
+        order = stable_desc_order(self.numeric(name))[:k]
+        return [self.rows[i] for i in order]
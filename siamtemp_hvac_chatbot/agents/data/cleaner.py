@@ -6,12 +6,26 @@ Since encoding issues are resolved, focus on standardization and formatting
 
 import re
 import logging
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Iterable, Iterator, NamedTuple
 from datetime import datetime
-from collections import Counter, defaultdict
+from decimal import Decimal
+
+import numpy as np
+
+from .analytics import ResultColumns, grouped_totals, stable_desc_order
 
 logger = logging.getLogger(__name__)
 
+_NONE = type(None)
+_NUMERIC_KINDS = {_NONE, Decimal, int, float}
+_TEXT_KINDS = {_NONE, str}
+
+class ColumnPlan(NamedTuple):
+    """Transformations that apply to one result column"""
+    name: str
+    standardize_names: bool
+    numeric: bool
+
 class DataCleaningEngine:
     """
     DataCleaningEngine - Optimized for Siamtemp data
@@ -58,31 +72,206 @@ class DataCleaningEngine:
             'VRF': 'Variable Refrigerant Flow',
             'COMP': 'Compressor'
         }
+        
+        # Column-planned cleaning caches
+        self._column_plans: Dict[Tuple, Tuple[ColumnPlan, ...]] = {}
+        self._name_cache: Dict[str, str] = {}
+        self.max_column_plans = 256
+        self.max_name_cache = 20000
+        self._company_pattern = re.compile(
+            '|'.join(re.escape(old) for old in self.company_standardizations)
+        )
     
-    def clean_results(self, results: List[Dict], intent: str = None) -> Tuple[List[Dict], Dict]:
+    def clean_results(self, results: List[Dict], intent: str = None,
+                      view: str = None, standardize_names: bool = True) -> Tuple[List[Dict], Dict]:
         """
         Main cleaning method - simplified for clean data
+        Columns are planned once per (view, columns) and cleaned column-wise
+        standardize_names=False when the SQL already returned canonical names
         """
         if not results:
             return results, {'cleaned': 0}
         
-        cleaned_results = []
-        stats = {
-            'total_rows': len(results),
+        stats = self.new_stats()
+        stats['total_rows'] = len(results)
+        cleaned_results = self._clean_columnar(results, stats, view, standardize_names)
+        
+        # Add insights if intent provided
+        if intent:
+            cleaned_results = self._enhance_for_intent(cleaned_results, intent)
+        
+        return cleaned_results, stats
+    
+    def iter_clean_rows(self, rows: Iterable[Dict], intent: str = None,
+                        stats: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Lazy variant of clean_results for the streaming pipeline
+        Rows are cleaned one at a time; stats accumulate into the given dict
+        """
+        if stats is None:
+            stats = self.new_stats()
+        
+        # Server-side cursor batches arrive as lists - clean them column-wise
+        if isinstance(rows, list):
+            stats['total_rows'] += len(rows)
+            cleaned_rows = self._clean_columnar(rows, stats)
+        else:
+            cleaned_rows = (self._clean_single_row(row, stats) for row in self._count_rows(rows, stats))
+        
+        for cleaned_row in cleaned_rows:
+            if intent:
+                cleaned_row = self._enhance_row_for_intent(cleaned_row, intent)
+            yield cleaned_row
+    
+    def _count_rows(self, rows: Iterable[Dict], stats: Dict) -> Iterator[Dict]:
+        for row in rows:
+            stats['total_rows'] += 1
+            yield row
+    
+    def new_stats(self) -> Dict:
+        """Empty stats dict for incremental cleaning"""
+        return {
+            'total_rows': 0,
             'standardized_names': 0,
             'null_values_handled': 0,
             'numeric_cleaned': 0
         }
+    
+    # =========================================================================
+    # COLUMN-PLANNED CLEANING
+    # =========================================================================
+    
+    def _plan_columns(self, columns: Tuple[str, ...], view: str = None,
+                      standardize_names: bool = True) -> Tuple[ColumnPlan, ...]:
+        """Decide per column (once per view + column tuple) which transforms apply"""
+        key = (view, columns, standardize_names)
+        plan = self._column_plans.get(key)
+        if plan is None:
+            plan = tuple(
+                ColumnPlan(
+                    name=column,
+                    standardize_names=standardize_names and (
+                        'customer' in column.lower() or 'name' in column.lower()
+                    ),
+                    numeric=self._is_numeric_field(column)
+                )
+                for column in columns
+            )
+            if len(self._column_plans) >= self.max_column_plans:
+                self._column_plans.clear()
+            self._column_plans[key] = plan
+        return plan
+    
+    def _clean_columnar(self, rows: List[Dict], stats: Dict, view: str = None,
+                        standardize_names: bool = True) -> List[Dict]:
+        """Column-wise equivalent of _clean_single_row over a whole result set"""
+        if not rows:
+            return []
+        
+        columns = tuple(rows[0].keys())
+        width = len(columns)
+        if any(len(row) != width for row in rows):
+            # Ragged rows - keep exact per-row semantics
+            return [self._clean_single_row(row, stats) for row in rows]
+        try:
+            values_by_column = [[row[column] for row in rows] for column in columns]
+        except KeyError:
+            return [self._clean_single_row(row, stats) for row in rows]
         
-        for row in results:
-            cleaned_row = self._clean_single_row(row, stats)
-            cleaned_results.append(cleaned_row)
+        cleaned_columns = [
+            self._clean_column(values, plan, stats)
+            for values, plan in zip(values_by_column, self._plan_columns(columns, view, standardize_names))
+        ]
+        return [dict(zip(columns, values)) for values in zip(*cleaned_columns)]
+    
+    def _clean_column(self, values: List[Any], plan: ColumnPlan, stats: Dict) -> List[Any]:
+        """Clean one column according to its plan (dispatch on the column's value types)"""
+        kinds = set(map(type, values))
+        
+        # Numeric column (Decimal / int / float with NULLs): no string compares needed
+        if kinds <= _NUMERIC_KINDS:
+            present = [i for i, value in enumerate(values) if value is not None] if _NONE in kinds else range(len(values))
+            stats['null_values_handled'] += len(values) - len(present)
+            if not plan.numeric:
+                return list(values)
+            cleaned = list(values)
+            self._coerce_numeric(cleaned, present)
+            stats['numeric_cleaned'] += len(present)
+            return cleaned
+        
+        # Text column (str with NULLs)
+        if kinds <= _TEXT_KINDS:
+            cleaned = []
+            append = cleaned.append
+            for value in values:
+                if value is None or value == 'NULL' or value == '':
+                    append(None)
+                    stats['null_values_handled'] += 1
+                    continue
+                if plan.standardize_names:
+                    standardized = self._standardize_company_name_cached(value)
+                    if standardized != value:
+                        stats['standardized_names'] += 1
+                    value = standardized
+                # Same as re.sub(r'\s+', ' ', value).strip()
+                append(' '.join(value.split()))
+            return cleaned
+        
+        # Mixed types - per-value rules, identical to _clean_single_row
+        cleaned = list(values)
+        numeric_positions = []
+        for i, value in enumerate(values):
+            if value is None or value == 'NULL' or value == '':
+                cleaned[i] = None
+                stats['null_values_handled'] += 1
+            elif isinstance(value, str):
+                if plan.standardize_names:
+                    standardized = self._standardize_company_name_cached(value)
+                    if standardized != value:
+                        stats['standardized_names'] += 1
+                    value = standardized
+                cleaned[i] = ' '.join(value.split())
+            elif plan.numeric:
+                numeric_positions.append(i)
         
-        # Add insights if intent provided
-        if intent:
-            cleaned_results = self._enhance_for_intent(cleaned_results, intent)
+        if numeric_positions:
+            self._coerce_numeric(cleaned, numeric_positions)
+            stats['numeric_cleaned'] += len(numeric_positions)
         
-        return cleaned_results, stats
+        return cleaned
+    
+    def _coerce_numeric(self, cleaned: List[Any], positions):
+        """Vectorized _clean_numeric_value for non-string values (float, falsy → 0)"""
+        raw = [cleaned[i] for i in positions]
+        try:
+            numbers = np.array(list(map(float, raw)), dtype=np.float64)
+        except (TypeError, ValueError):
+            for i in positions:
+                cleaned[i] = self._clean_numeric_value(cleaned[i])
+            return
+        
+        as_list = numbers.tolist()
+        for i, number in zip(positions, as_list):
+            cleaned[i] = number
+        # Falsy originals become int 0 (float 0.0 only for non-zero values that underflow)
+        for k in np.flatnonzero(numbers == 0).tolist():
+            cleaned[positions[k]] = 0 if not raw[k] else 0.0
+    
+    def _standardize_company_name_cached(self, name: str) -> str:
+        """_standardize_company_name with a prefilter and memoization"""
+        cached = self._name_cache.get(name)
+        if cached is not None:
+            return cached
+        
+        if self._company_pattern.search(name):
+            result = self._standardize_company_name(name)
+        else:
+            result = ' '.join(name.split())
+        
+        if len(self._name_cache) >= self.max_name_cache:
+            self._name_cache.clear()
+        self._name_cache[name] = result
+        return result
     
     def _clean_single_row(self, row: Dict, stats: Dict) -> Dict:
         """Clean a single row - optimized version"""
@@ -162,6 +351,12 @@ class DataCleaningEngine:
             return self._enhance_parts_data(results)
         return results
     
+    def _enhance_row_for_intent(self, row: Dict, intent: str) -> Dict:
+        """Per-row enhancement (streaming path)"""
+        if intent in ['work_force', 'work_plan']:
+            return self._enhance_work_row(row)
+        return row
+    
     def _enhance_sales_data(self, results: List[Dict]) -> List[Dict]:
         """Enhance sales data"""
         return results
@@ -169,18 +364,24 @@ class DataCleaningEngine:
     def _enhance_work_data(self, results: List[Dict]) -> List[Dict]:
         """Enhance work force data"""
         for row in results:
-            # Derive job type
-            row['job_type'] = self._get_job_type(row)
-            
-            # Parse date if string
-            if 'date' in row and isinstance(row['date'], str):
-                row['parsed_date'] = self._parse_date(row['date'])
-            
-            # Get work status
-            row['status'] = self._get_work_status(row)
+            self._enhance_work_row(row)
         
         return results
     
+    def _enhance_work_row(self, row: Dict) -> Dict:
+        """Enhance a single work force row"""
+        # Derive job type
+        row['job_type'] = self._get_job_type(row)
+        
+        # Parse date if string
+        if 'date' in row and isinstance(row['date'], str):
+            row['parsed_date'] = self._parse_date(row['date'])
+        
+        # Get work status
+        row['status'] = self._get_work_status(row)
+        
+        return row
+    
     def _enhance_parts_data(self, results: List[Dict]) -> List[Dict]:
         """Enhance spare parts data"""
         # for row in results:
@@ -248,7 +449,8 @@ class DataCleaningEngine:
         
         return date_str
     
-    def create_summary_insights(self, results: List[Dict], intent: str) -> Dict[str, Any]:
+    def create_summary_insights(self, results: List[Dict], intent: str,
+                                standardize_names: bool = True) -> Dict[str, Any]:
         """Create summary insights for response generation"""
         if not results:
             return {'total_count': 0, 'summary': 'ไม่พบข้อมูล'}
@@ -267,7 +469,7 @@ class DataCleaningEngine:
         elif intent in ['spare_parts', 'parts_price', 'inventory_value']:
             insights = self._create_parts_insights(results, insights)
         elif intent in ['customer_history', 'top_customers']:
-            insights = self._create_customer_insights(results, insights)
+            insights = self._create_customer_insights(results, insights, standardize_names)
         
         return insights
     
@@ -278,25 +480,17 @@ class DataCleaningEngine:
     
     def _create_work_insights(self, results: List[Dict], insights: Dict) -> Dict:
         """Create work-specific insights"""
-        job_types = Counter()
-        statuses = Counter()
-        teams = Counter()
-        
-        for r in results:
-            if 'job_type' in r:
-                job_types[r['job_type']] += 1
-            if 'status' in r:
-                statuses[r['status']] += 1
-            if r.get('service_group'):
-                teams[r['service_group']] += 1
+        columns = ResultColumns(results)
+        job_types = columns.value_counts('job_type') if columns.has('job_type') else []
+        statuses = dict(columns.value_counts('status', ordered=False)) if columns.has('status') else {}
         
         insights['summary'] = {
-            'job_types': dict(job_types.most_common()),
-            'status_breakdown': dict(statuses)
+            'job_types': dict(job_types),
+            'status_breakdown': statuses
         }
         
         insights['top_items'] = {
-            'busiest_teams': dict(teams.most_common(5))
+            'busiest_teams': dict(columns.value_counts('service_group', truthy_only=True, top=5))
         }
         
         completed = statuses.get('Completed', 0)
@@ -311,22 +505,18 @@ class DataCleaningEngine:
     
     def _create_parts_insights(self, results: List[Dict], insights: Dict) -> Dict:
         """Create spare parts insights"""
-        total_value = sum(r.get('total_num', 0) or 0 for r in results)
-        in_stock = sum(1 for r in results if (r.get('balance_num', 0) or 0) > 0)
-        
-        # Group by warehouse
-        warehouse_counts = Counter()
-        for r in results:
-            if r.get('wh'):
-                warehouse_counts[r['wh']] += 1
+        columns = ResultColumns(results)
+        total_value = columns.total('total_num')
+        in_stock = columns.count_positive('balance_num')
         
         insights['summary'] = {
             'total_inventory_value': f"{total_value:,.0f}",
             'in_stock_percentage': f"{(in_stock/len(results)*100):.1f}%" if results else "0%"
         }
         
+        # Group by warehouse
         insights['top_items'] = {
-            'warehouse_distribution': dict(warehouse_counts.most_common())
+            'warehouse_distribution': dict(columns.value_counts('wh', truthy_only=True))
         }
         
         insights['statistics'] = {
@@ -337,41 +527,37 @@ class DataCleaningEngine:
         
         return insights
     
-    def _create_customer_insights(self, results: List[Dict], insights: Dict) -> Dict:
+    def _create_customer_insights(self, results: List[Dict], insights: Dict,
+                                  standardize_names: bool = True) -> Dict:
         """Create customer-specific insights"""
-        customer_totals = defaultdict(lambda: {'revenue': 0, 'transactions': 0})
+        columns = ResultColumns(results)
+        customers = [
+            name or other
+            for name, other in zip(columns.values('customer_name'), columns.values('customer'))
+        ]
+        if standardize_names:
+            customers = [self._standardize_company_name_cached(c) if c else c for c in customers]
         
-        for r in results:
-            customer = self._standardize_company_name(
-                r.get('customer_name') or r.get('customer', '')
-            )
-            if customer:
-                revenue = r.get('total_revenue', 0) or 0
-                customer_totals[customer]['revenue'] += revenue
-                customer_totals[customer]['transactions'] += 1
+        names, revenue, transactions = grouped_totals(customers, columns.numeric('total_revenue'))
         
         # Sort by revenue
-        top_customers = sorted(
-            customer_totals.items(),
-            key=lambda x: x[1]['revenue'],
-            reverse=True
-        )[:10]
+        top_customers = stable_desc_order(revenue)[:10]
         
         insights['summary'] = {
-            'unique_customers': len(customer_totals),
-            'total_transactions': sum(c['transactions'] for c in customer_totals.values())
+            'unique_customers': len(names),
+            'total_transactions': int(transactions.sum())
         }
         
         insights['top_items'] = {
             'top_10_customers': {
-                name: {
-                    'revenue': f"{data['revenue']:,.0f}",
-                    'transactions': data['transactions'],
-                    'avg_transaction': f"{data['revenue']/data['transactions']:,.0f}" 
-                        if data['transactions'] > 0 else "0"
+                names[i]: {
+                    'revenue': f"{revenue[i]:,.0f}",
+                    'transactions': int(transactions[i]),
+                    'avg_transaction': f"{revenue[i]/transactions[i]:,.0f}" 
+                        if transactions[i] > 0 else "0"
                 }
-                for name, data in top_customers
+                for i in top_customers
             }
         }
         
-        return insights
\ No newline at end of file
+        return insights
@@ -0,0 +1,318 @@
+# agents/data/customer_alias.py
+"""
+Customer alias dimension
+A build job maps every distinct customer_name / customer value to a canonical
+name and stores it in the customer_alias table; generated SQL that groups by
+customer is rewritten to group on the canonical name inside PostgreSQL
+"""
+
+import re
+import time
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple, Callable
+
+from psycopg2 import sql as pgsql
+from psycopg2.extras import execute_values
+
+from ..sql.clauses import mask_sql, clause_spans
+
+logger = logging.getLogger(__name__)
+
+ALIAS_TABLE = 'customer_alias'
+CUSTOMER_COLUMNS = ('customer_name', 'customer')
+
+# Legal-form noise ignored when deciding that two names are the same customer
+_LEGAL_FORMS = re.compile(
+    r'\bco\s*\.?\s*,?\s*ltd\b\.?|\bcompany\s+limited\b|\blimited\b|\bltd\b\.?|\bpublic\b'
+    r'|\bpcl\b\.?|\binc\b\.?|\bcorporation\b|\bcorp\b\.?|\(\s*thailand\s*\)|\(\s*ประเทศไทย\s*\)'
+    r'|บริษัท|บจก\.?|บมจ\.?|หจก\.?|จำกัด|\(\s*มหาชน\s*\)|มหาชน',
+    re.IGNORECASE
+)
+_PUNCTUATION = re.compile(r'[^\w\u0E00-\u0E7F]+')
+# Calls whose arguments use FROM (not a table source)
+_FROM_CALL = re.compile(r'\b(?:EXTRACT|SUBSTRING|TRIM|OVERLAY|POSITION)\s*$', re.IGNORECASE)
+
+# =============================================================================
+# CANONICALIZATION
+# =============================================================================
+
+def alias_key(name: str) -> str:
+    """
+    Grouping key for a raw customer name
+    'STANLEY ELECTRIC CO.,LTD.' and 'Stanley Electric Co., Ltd' share one key
+    """
+    key = _LEGAL_FORMS.sub(' ', name.lower())
+    key = ' '.join(_PUNCTUATION.sub(' ', key).split())
+    return key or ' '.join(name.lower().split())
+
+def build_alias_map(name_counts: Dict[str, int],
+                    standardize: Optional[Callable[[str], str]] = None) -> Dict[str, Tuple[str, str]]:
+    """
+    raw name -> (canonical_key, canonical_name)
+    The canonical name is the most common standardized spelling in the key group
+    """
+    groups: Dict[str, Counter] = defaultdict(Counter)
+    keys = {}
+    for raw, count in name_counts.items():
+        if not raw or not raw.strip():
+            continue
+        key = alias_key(raw)
+        keys[raw] = key
+        spelling = standardize(raw) if standardize else ' '.join(raw.split())
+        groups[key][spelling] += count
+
+    canonical = {
+        key: max(spellings.items(), key=lambda item: (item[1], len(item[0]), item[0]))[0]
+        for key, spellings in groups.items()
+    }
+    return {raw: (key, canonical[key]) for raw, key in keys.items()}
+
+# =============================================================================
+# BUILD JOB
+# =============================================================================
+
+class CustomerAliasBuilder:
+    """Compute canonical customer names from the views and store them in customer_alias"""
+
+    def __init__(self, standardize: Optional[Callable[[str], str]] = None):
+        self.standardize = standardize
+
+    def discover_sources(self, cursor) -> List[Tuple[str, str]]:
+        """(view, column) pairs that carry a customer name"""
+        cursor.execute("""
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name LIKE 'v\\_%%'
+              AND column_name IN %s
+            ORDER BY table_name
+        """, (CUSTOMER_COLUMNS,))
+        return [self._pair(row) for row in cursor.fetchall()]
+
+    def collect(self, cursor, sources: List[Tuple[str, str]]) -> Counter:
+        """Row counts per distinct raw name across all sources"""
+        counts = Counter()
+        for view, column in sources:
+            cursor.execute(
+                pgsql.SQL("SELECT {col} AS name, COUNT(*) AS n FROM {view} WHERE {col} IS NOT NULL GROUP BY {col}")
+                .format(col=pgsql.Identifier(column), view=pgsql.Identifier(view))
+            )
+            for row in cursor.fetchall():
+                name, count = (row['name'], row['n']) if isinstance(row, dict) else row
+                counts[name] += count
+        return counts
+
+    def write(self, cursor, alias_map: Dict[str, Tuple[str, str]]):
+        """Replace the table contents (caller commits)"""
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ALIAS_TABLE} (
+                raw_name       TEXT PRIMARY KEY,
+                canonical_key  TEXT NOT NULL,
+                canonical_name TEXT NOT NULL,
+                updated_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {ALIAS_TABLE}_key_idx ON {ALIAS_TABLE} (canonical_key)")
+        cursor.execute(f"DELETE FROM {ALIAS_TABLE}")
+        execute_values(
+            cursor,
+            f"INSERT INTO {ALIAS_TABLE} (raw_name, canonical_key, canonical_name) VALUES %s",
+            [(raw, key, name) for raw, (key, name) in alias_map.items()],
+            page_size=1000
+        )
+        cursor.execute(f"ANALYZE {ALIAS_TABLE}")
+
+    def build(self, connection) -> Dict:
+        """Run the full job on connection (committed on success)"""
+        start_time = time.time()
+        try:
+            with connection.cursor() as cursor:
+                sources = self.discover_sources(cursor)
+                counts = self.collect(cursor, sources)
+                alias_map = build_alias_map(counts, self.standardize)
+                self.write(cursor, alias_map)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        stats = {
+            'sources': [f"{view}.{column}" for view, column in sources],
+            'raw_names': len(alias_map),
+            'canonical_names': len({name for _, name in alias_map.values()}),
+            'build_time': round(time.time() - start_time, 3)
+        }
+        logger.info(f"✅ Customer alias built: {stats['raw_names']} names → {stats['canonical_names']} customers")
+        return stats
+
+    @staticmethod
+    def _pair(row) -> Tuple[str, str]:
+        return (row['table_name'], row['column_name']) if isinstance(row, dict) else (row[0], row[1])
+
+# =============================================================================
+# SQL REWRITER
+# =============================================================================
+
+class CustomerAliasRewriter:
+    """
+    Rewrite generated SQL so GROUP BY customer groups canonical names
+    FROM v_sales2024 → FROM (SELECT ..., COALESCE(ca.canonical_name, v.customer_name)
+                              AS customer_name, ... LEFT JOIN customer_alias ca ...) AS v_sales2024
+    A WHERE filter on the customer column must keep matching raw spellings:
+    single-source queries get the raw column as customer_name_raw and their
+    WHERE filters read it; other filtered queries (joins, HAVING) are left alone
+    """
+
+    RAW_SUFFIX = '_raw'
+
+    _NOT_ALIAS = {'where', 'group', 'order', 'limit', 'join', 'left', 'right', 'inner',
+                  'full', 'cross', 'on', 'union', 'having', 'offset', 'window', 'fetch', 'natural'}
+
+    def __init__(self):
+        self.view_columns: Dict[str, List[str]] = {}   # view -> ordered columns
+        self.customer_column: Dict[str, str] = {}      # view -> customer column
+        self.loaded_at: Optional[float] = None
+        self.stats = {'rewritten': 0, 'rewritten_filtered': 0, 'skipped_filtered': 0}
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.view_columns)
+
+    def load(self, connection):
+        """Load view columns if the alias table exists (no-op otherwise)"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) AS t", (ALIAS_TABLE,))
+            row = cursor.fetchone()
+            exists = (row['t'] if isinstance(row, dict) else row[0]) is not None
+            if not exists:
+                self.view_columns, self.customer_column = {}, {}
+                connection.commit()
+                logger.info("Customer alias table not built yet - SQL rewriting disabled")
+                return
+
+            cursor.execute("""
+                SELECT c.table_name, c.column_name
+                FROM information_schema.columns c
+                WHERE c.table_schema = current_schema()
+                  AND c.table_name IN (
+                      SELECT table_name FROM information_schema.columns
+                      WHERE table_schema = current_schema()
+                        AND table_name LIKE 'v\\_%%' AND column_name IN %s
+                  )
+                ORDER BY c.table_name, c.ordinal_position
+            """, (CUSTOMER_COLUMNS,))
+            view_columns: Dict[str, List[str]] = defaultdict(list)
+            for row in cursor.fetchall():
+                view, column = CustomerAliasBuilder._pair(row)
+                view_columns[view].append(column)
+        connection.commit()
+
+        self.view_columns = dict(view_columns)
+        self.customer_column = {
+            view: next(c for c in CUSTOMER_COLUMNS if c in columns)
+            for view, columns in self.view_columns.items()
+        }
+        self.loaded_at = time.time()
+        logger.info(f"Customer alias rewriting enabled for {len(self.view_columns)} views")
+
+    def rewrite(self, sql: str) -> Tuple[str, bool]:
+        """Return (sql, rewritten)"""
+        if not self.ready:
+            return sql, False
+
+        masked = mask_sql(sql)
+        froms = self._from_matches(masked)
+        sources = [m for m in froms if m.group(1).lower() in self.view_columns]
+        if not sources:
+            return sql, False
+
+        columns = {self.customer_column[m.group(1).lower()] for m in sources}
+        if not self._groups_by(sql, masked, columns):
+            return sql, False
+
+        filters = self._column_refs(sql, masked, r'\bWHERE\b', columns)
+        if ((filters and not self._single_source(masked, froms, sources))
+                or self._column_refs(sql, masked, r'\bHAVING\b', columns)):
+            self.stats['skipped_filtered'] += 1
+            return sql, False
+
+        # (start, end, replacement), applied back to front
+        edits = [(start, end, masked[start:end] + self.RAW_SUFFIX) for start, end in filters]
+        for match in sources:
+            view = match.group(1).lower()
+            alias = match.group(2)
+            if alias and alias.lower() in self._NOT_ALIAS:
+                alias = None
+            end = match.end() if alias else match.end(1)
+            source = self._canonical_source(view, alias or match.group(1), raw=bool(filters))
+            edits.append((match.start(), end, f"FROM {source}"))
+
+        rewritten = sql
+        for start, end, replacement in sorted(edits, reverse=True):
+            rewritten = rewritten[:start] + replacement + rewritten[end:]
+
+        self.stats['rewritten_filtered' if filters else 'rewritten'] += 1
+        return rewritten, True
+
+    def is_rewritten(self, sql: Optional[str]) -> bool:
+        """True when sql reads customer names through the alias table"""
+        return bool(sql) and f'LEFT JOIN {ALIAS_TABLE} ca' in sql
+    
+    def _canonical_source(self, view: str, alias: str, raw: bool = False) -> str:
+        """Subquery with canonical names; raw=True also exposes the raw spelling as <column>_raw"""
+        customer = self.customer_column[view]
+        select_list = ', '.join(
+            f'COALESCE(ca.canonical_name, v."{customer}") AS "{customer}"' if column == customer
+            else f'v."{column}"'
+            for column in self.view_columns[view]
+        )
+        if raw:
+            select_list += f', v."{customer}" AS "{customer}{self.RAW_SUFFIX}"'
+        return (
+            f'(SELECT {select_list} FROM {view} v '
+            f'LEFT JOIN {ALIAS_TABLE} ca ON ca.raw_name = v."{customer}") AS {alias}'
+        )
+
+    def _column_refs(self, sql: str, masked: str, keyword: str, columns: set) -> List[Tuple[int, int]]:
+        """Spans of customer column references inside every keyword clause (any depth)"""
+        refs = set()
+        for start, end in clause_spans(sql, keyword):
+            for column in columns:
+                refs.update(
+                    (start + m.start(), start + m.end())
+                    for m in re.finditer(rf'\b{column}\b', masked[start:end], re.IGNORECASE)
+                )
+        return sorted(refs)
+
+    def _groups_by(self, sql: str, masked: str, columns: set) -> bool:
+        return bool(self._column_refs(sql, masked, r'\bGROUP\s+BY\b', columns))
+
+    def _from_matches(self, masked: str) -> List[re.Match]:
+        """FROM <table> [alias], skipping the FROM inside EXTRACT(... FROM ...) and similar calls"""
+        calls, stack = [], []
+        for i, ch in enumerate(masked):
+            if ch == '(':
+                stack.append(i)
+            elif ch == ')' and stack:
+                start = stack.pop()
+                if _FROM_CALL.search(masked[max(start - 12, 0):start]):
+                    calls.append((start, i))
+        return [
+            m for m in re.finditer(r'\bFROM\s+([A-Za-z_]\w*)\b(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?', masked, re.IGNORECASE)
+            if not any(start < m.start() < end for start, end in calls)
+        ]
+
+    def _single_source(self, masked: str, froms: List[re.Match], sources: List[re.Match]) -> bool:
+        """Every FROM reads an alias view and nothing is joined, so the customer column is unambiguous"""
+        return (len(froms) == len(sources)
+                and not re.search(r'\bJOIN\b', masked, re.IGNORECASE)
+                and not any(re.match(r'\s*,', masked[m.end():]) for m in froms))
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'ready': self.ready,
+            'views': sorted(self.view_columns),
+            'loaded_at': self.loaded_at
+        }
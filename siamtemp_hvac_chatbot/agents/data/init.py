@@ -1,5 +1,11 @@
 """Data processing and cleaning modules."""
 
 from .cleaner import DataCleaningEngine
+from .analytics import ResultColumns
+from .result_snapshot import ResultSnapshot, SnapshotQueryEngine
+from .customer_alias import CustomerAliasBuilder, CustomerAliasRewriter
 
-__all__ = ['DataCleaningEngine']
\ No newline at end of file
+__all__ = [
+    'DataCleaningEngine', 'ResultColumns', 'ResultSnapshot', 'SnapshotQueryEngine',
+    'CustomerAliasBuilder', 'CustomerAliasRewriter'
+]
\ No newline at end of file
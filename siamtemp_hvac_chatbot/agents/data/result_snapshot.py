@@ -0,0 +1,367 @@
+# agents/data/result_snapshot.py
+"""
+Result Snapshot - last result set kept per conversation (columnar, compressed)
+plus a small local operator engine so follow-ups like "อันดับแรก",
+"5 อันดับแรก" or "รวมทั้งหมดนั้น" are answered without Ollama or Postgres
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import heapq
+import base64
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_SNAPSHOT_ROWS = int(os.getenv('RESULT_SNAPSHOT_MAX_ROWS', '5000'))
+
+_NUMERIC_TEXT = re.compile(r'^-?[\d,]+(?:\.\d+)?$')
+
+# Columns that are numeric but never a metric
+_NON_METRIC = {'year', 'year_label', 'month', 'day', 'id', 'turn_id'}
+_PREFERRED_METRIC = ('total', 'revenue', 'amount', 'sum', 'value', 'price', 'balance')
+
+# =============================================================================
+# COLUMNAR SNAPSHOT
+# =============================================================================
+
+def _encode(value: Any) -> Any:
+    """JSON-safe scalar (Decimal → float, dates → ISO)"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _as_number(values: List[Any]) -> Optional[List[Optional[float]]]:
+    """Numeric view of a column, or None if any non-null value is not numeric"""
+    numbers = []
+    seen = False
+    for value in values:
+        if value is None or value == '':
+            numbers.append(None)
+        elif isinstance(value, bool):
+            return None
+        elif isinstance(value, (int, float)):
+            numbers.append(value)
+            seen = True
+        elif isinstance(value, str) and _NUMERIC_TEXT.match(value.strip()):
+            numbers.append(float(value.strip().replace(',', '')))
+            seen = True
+        else:
+            return None
+    return numbers if seen else None
+
+class ResultSnapshot:
+    """
+    Immutable columnar copy of one result set
+    Each column is a separately zlib-compressed JSON array, so an operator
+    only inflates the columns it touches
+    """
+    __slots__ = ('columns', 'kinds', 'row_count', 'question', 'intent',
+                 'created_at', '_blobs', 'compressed_bytes')
+
+    def __init__(self, rows: List[Dict], question: str = '', intent: Optional[str] = None):
+        self.columns: List[str] = list(rows[0].keys()) if rows else []
+        self.row_count = len(rows)
+        self.question = question
+        self.intent = intent
+        self.created_at = time.time()
+        self.kinds: Dict[str, str] = {}
+        self._blobs: Dict[str, bytes] = {}
+
+        for column in self.columns:
+            values = [_encode(row.get(column)) for row in rows]
+            numbers = _as_number(values)
+            if numbers is not None:
+                values = numbers
+                self.kinds[column] = 'number'
+            else:
+                self.kinds[column] = 'text'
+            payload = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+            self._blobs[column] = zlib.compress(payload.encode('utf-8'), 6)
+
+        self.compressed_bytes = sum(len(b) for b in self._blobs.values())
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], question: str = '',
+                  intent: Optional[str] = None) -> Optional['ResultSnapshot']:
+        """Snapshot rows, or None when the result is empty or too large to keep"""
+        if not rows or len(rows) > MAX_SNAPSHOT_ROWS:
+            return None
+        return cls(rows, question, intent)
+
+    def column(self, name: str) -> List[Any]:
+        return json.loads(zlib.decompress(self._blobs[name]).decode('utf-8'))
+
+    def numeric_columns(self) -> List[str]:
+        return [c for c in self.columns if self.kinds[c] == 'number']
+
+    def text_columns(self) -> List[str]:
+        return [c for c in self.columns if self.kinds[c] == 'text']
+
+    def rows(self, indices: Optional[List[int]] = None) -> List[Dict]:
+        """Rebuild row dicts (all rows, or the given indices in order)"""
+        data = {c: self.column(c) for c in self.columns}
+        if indices is None:
+            indices = range(self.row_count)
+        return [{c: data[c][i] for c in self.columns} for i in indices]
+
+    def is_expired(self, ttl_seconds: int) -> bool:
+        return time.time() - self.created_at > ttl_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe form; columns stay compressed (base64)"""
+        return {
+            'columns': self.columns,
+            'kinds': self.kinds,
+            'row_count': self.row_count,
+            'question': self.question,
+            'intent': self.intent,
+            'created_at': self.created_at,
+            'blobs': {c: base64.b64encode(blob).decode('ascii') for c, blob in self._blobs.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ResultSnapshot':
+        snapshot = cls.__new__(cls)
+        snapshot.columns = list(data['columns'])
+        snapshot.kinds = dict(data['kinds'])
+        snapshot.row_count = data['row_count']
+        snapshot.question = data.get('question', '')
+        snapshot.intent = data.get('intent')
+        snapshot.created_at = data['created_at']
+        snapshot._blobs = {c: base64.b64decode(blob) for c, blob in data['blobs'].items()}
+        snapshot.compressed_bytes = sum(len(b) for b in snapshot._blobs.values())
+        return snapshot
+
+# =============================================================================
+# OPERATORS
+# =============================================================================
+
+_AGGREGATES: Dict[str, Callable[[List[float]], float]] = {
+    'sum': sum,
+    'avg': lambda xs: sum(xs) / len(xs),
+    'min': min,
+    'max': max,
+    'count': len
+}
+
+def filter_indices(snapshot: ResultSnapshot, column: str, op: str, value: float,
+                   indices: Optional[List[int]] = None) -> List[int]:
+    """Indices whose numeric column value satisfies op value"""
+    compare = {
+        '>': lambda x: x > value, '>=': lambda x: x >= value,
+        '<': lambda x: x < value, '<=': lambda x: x <= value,
+        '==': lambda x: x == value
+    }[op]
+    values = snapshot.column(column)
+    candidates = range(snapshot.row_count) if indices is None else indices
+    return [i for i in candidates if values[i] is not None and compare(values[i])]
+
+def sort_indices(snapshot: ResultSnapshot, column: str, descending: bool = True,
+                 indices: Optional[List[int]] = None) -> List[int]:
+    """Indices ordered by column (nulls last)"""
+    values = snapshot.column(column)
+    candidates = list(range(snapshot.row_count) if indices is None else indices)
+    present = [i for i in candidates if values[i] is not None]
+    missing = [i for i in candidates if values[i] is None]
+    return sorted(present, key=lambda i: values[i], reverse=descending) + missing
+
+def top_k(snapshot: ResultSnapshot, column: str, k: int, descending: bool = True,
+          indices: Optional[List[int]] = None) -> List[int]:
+    """Indices of the k largest (or smallest) values"""
+    values = snapshot.column(column)
+    candidates = [i for i in (range(snapshot.row_count) if indices is None else indices)
+                  if values[i] is not None]
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    return pick(k, candidates, key=lambda i: values[i])
+
+def aggregate(snapshot: ResultSnapshot, column: str, func: str,
+              indices: Optional[List[int]] = None) -> Optional[float]:
+    """sum / avg / min / max / count over a numeric column"""
+    values = snapshot.column(column)
+    candidates = range(snapshot.row_count) if indices is None else indices
+    numbers = [values[i] for i in candidates if values[i] is not None]
+    if not numbers:
+        return None
+    return _AGGREGATES[func](numbers)
+
+def group_by(snapshot: ResultSnapshot, key: str, column: str, func: str = 'sum',
+             indices: Optional[List[int]] = None) -> List[Dict]:
+    """Aggregate column per key value, largest first"""
+    keys = snapshot.column(key)
+    values = snapshot.column(column)
+    groups: Dict[Any, List[float]] = {}
+    for i in (range(snapshot.row_count) if indices is None else indices):
+        if values[i] is not None:
+            groups.setdefault(keys[i], []).append(values[i])
+    label = f'{func}_{column}'
+    rows = [{key: k, label: _AGGREGATES[func](v)} for k, v in groups.items()]
+    return sorted(rows, key=lambda r: r[label], reverse=True)
+
+# =============================================================================
+# FOLLOW-UP INTERPRETER
+# =============================================================================
+
+@dataclass
+class LocalAnswer:
+    """Answer computed from a snapshot"""
+    operation: str
+    description: str
+    rows: Optional[List[Dict]] = None
+    value: Optional[float] = None
+
+class SnapshotQueryEngine:
+    """Map a short follow-up question onto snapshot operators"""
+
+    def __init__(self, header_names: Optional[Callable[[List[str]], List[str]]] = None):
+        # header_names: column → display name (Thai) used to match mentions
+        self.header_names = header_names or (lambda columns: columns)
+
+        self.aggregate_words = {
+            'avg': ['เฉลี่ย', 'average', 'avg', 'mean'],
+            'max': ['สูงสุด', 'มากที่สุด', 'max'],
+            'min': ['ต่ำสุด', 'น้อยที่สุด', 'min'],
+            'count': ['กี่รายการ', 'จำนวนรายการ', 'count'],
+            'sum': ['รวม', 'sum', 'total']
+        }
+        self.aggregate_labels = {
+            'sum': 'ยอดรวม', 'avg': 'ค่าเฉลี่ย', 'max': 'ค่าสูงสุด',
+            'min': 'ค่าต่ำสุด', 'count': 'จำนวนรายการ'
+        }
+        self.sort_words = ['เรียง', 'sort', 'order']
+        self.ascending_words = ['น้อยไปมาก', 'ต่ำไปสูง', 'asc', 'จากน้อย']
+        self.group_pattern = re.compile(r'(?:แยกตาม|ตาม|group by|by)\s*(\S+)', re.IGNORECASE)
+        self.top_pattern = re.compile(r'top\s*(\d+)|(\d+)\s*อันดับ', re.IGNORECASE)
+        self.filter_pattern = re.compile(
+            r'(มากกว่า|เกิน|>=|>|น้อยกว่า|ต่ำกว่า|<=|<)\s*([\d,]+(?:\.\d+)?)'
+        )
+        self.filter_ops = {
+            'มากกว่า': '>', 'เกิน': '>', '>': '>', '>=': '>=',
+            'น้อยกว่า': '<', 'ต่ำกว่า': '<', '<': '<', '<=': '<='
+        }
+
+    def answer(self, snapshot: ResultSnapshot, question: str,
+               ref_type: Optional[str] = None) -> Optional[LocalAnswer]:
+        """Compute a LocalAnswer, or None if the question needs a fresh query"""
+        q = question.lower()
+        metric = self._pick_metric(snapshot, q)
+        if metric:
+            # "รายได้รวม" names a column - its "รวม" is not a sum request
+            q = q.replace(self.header_names([metric])[0].lower(), ' ')
+        limit = self._top_n(q, ref_type)
+        indices: Optional[List[int]] = None
+        notes = []
+
+        # Numeric filter ("มากกว่า 1,000,000")
+        match = self.filter_pattern.search(q)
+        if match and metric:
+            op = self.filter_ops[match.group(1)]
+            value = float(match.group(2).replace(',', ''))
+            indices = filter_indices(snapshot, metric, op, value)
+            notes.append(f"{self._label(metric)} {op} {value:,.0f}")
+
+        # Group-by
+        group_key = self._pick_group_key(snapshot, q)
+        if group_key and metric:
+            func = self._aggregate_func(q) or 'sum'
+            if func == 'count':
+                func = 'sum'
+            rows = group_by(snapshot, group_key, metric, func, indices)
+            if limit:
+                rows = rows[:limit]
+            return LocalAnswer('group_by', self._describe(f"{self.aggregate_labels[func]} {self._label(metric)} แยกตาม {self._label(group_key)}", notes), rows=rows)
+
+        # Scalar aggregate (over the top-n rows when a rank is given)
+        func = self._aggregate_func(q)
+        if func == 'count':
+            count = snapshot.row_count if indices is None else len(indices)
+            return LocalAnswer('count', self._describe('จำนวนรายการ', notes), value=count)
+        if func and metric:
+            if limit:
+                indices = top_k(snapshot, metric, limit, True, indices)
+                notes.append(f"{limit} อันดับแรก")
+            value = aggregate(snapshot, metric, func, indices)
+            if value is None:
+                return None
+            return LocalAnswer(func, self._describe(f"{self.aggregate_labels[func]} {self._label(metric)}", notes), value=value)
+
+        # Ranking
+        if limit:
+            if ref_type == 'first_item' or not metric:
+                picked = list(range(snapshot.row_count) if indices is None else indices)[:limit]
+            else:
+                picked = top_k(snapshot, metric, limit, True, indices)
+            return LocalAnswer('top_k', self._describe(f"{limit} อันดับแรก", notes), rows=snapshot.rows(picked))
+
+        # Sort
+        if metric and any(w in q for w in self.sort_words):
+            descending = not any(w in q for w in self.ascending_words)
+            ordered = sort_indices(snapshot, metric, descending, indices)
+            direction = 'มากไปน้อย' if descending else 'น้อยไปมาก'
+            return LocalAnswer('sort', self._describe(f"เรียงตาม {self._label(metric)} ({direction})", notes), rows=snapshot.rows(ordered))
+
+        # Plain filter or "ทั้งหมดนั้น"
+        if indices is not None:
+            return LocalAnswer('filter', self._describe(f"{len(indices):,} รายการ", notes), rows=snapshot.rows(indices))
+        if ref_type == 'all_results' and 'นั้น' in q:
+            return LocalAnswer('all', self._describe(f"{snapshot.row_count:,} รายการ", notes), rows=snapshot.rows())
+
+        return None
+
+    # -------------------------------------------------------------------------
+
+    def _label(self, column: str) -> str:
+        return self.header_names([column])[0]
+
+    def _mentioned(self, snapshot: ResultSnapshot, columns: List[str], q: str) -> List[str]:
+        names = dict(zip(columns, self.header_names(columns)))
+        return [c for c in columns if c.lower() in q or names[c].lower() in q]
+
+    def _pick_metric(self, snapshot: ResultSnapshot, q: str) -> Optional[str]:
+        candidates = [c for c in snapshot.numeric_columns() if c.lower() not in _NON_METRIC]
+        if not candidates:
+            return None
+        mentioned = self._mentioned(snapshot, candidates, q)
+        if mentioned:
+            return mentioned[0]
+        for column in candidates:
+            if any(p in column.lower() for p in _PREFERRED_METRIC):
+                return column
+        return candidates[0]
+
+    def _pick_group_key(self, snapshot: ResultSnapshot, q: str) -> Optional[str]:
+        match = self.group_pattern.search(q)
+        if not match:
+            return None
+        word = match.group(1)
+        names = dict(zip(snapshot.columns, self.header_names(snapshot.columns)))
+        for column in snapshot.text_columns() + [c for c in snapshot.numeric_columns() if c.lower() in _NON_METRIC]:
+            if word in (column.lower(), names[column].lower()) or names[column].lower() in q[match.start():]:
+                return column
+        return None
+
+    def _aggregate_func(self, q: str) -> Optional[str]:
+        for func, words in self.aggregate_words.items():
+            if any(w in q for w in words):
+                return func
+        return None
+
+    def _top_n(self, q: str, ref_type: Optional[str]) -> Optional[int]:
+        match = self.top_pattern.search(q)
+        if match:
+            return int(match.group(1) or match.group(2))
+        return {'first_item': 1, 'top_one': 1, 'top_five': 5}.get(ref_type)
+
+    def _describe(self, text: str, notes: List[str]) -> str:
+        return f"{text} ({', '.join(notes)})" if notes else text
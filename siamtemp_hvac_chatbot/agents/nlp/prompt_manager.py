@@ -8,6 +8,7 @@ from datetime import datetime, timedelta ,date
 from functools import lru_cache
 import hashlib
 from .template_config import TemplateConfig
+from ..data.analytics import ResultColumns
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +61,9 @@ class PromptManager:
         # System prompt
         self.SQL_SYSTEM_PROMPT = self._get_system_prompt()
         
+        # SQL example behind the last build_sql_prompt() (for Ollama usage reports)
+        self.last_template = 'fallback'
+        
         # Precompiled patterns for performance
         self._compile_patterns()
         
@@ -2413,6 +2417,8 @@ class PromptManager:
     def build_sql_prompt(self, question: str, intent: str, entities: Dict,
                         context: Dict = None, examples_override: List[str] = None) -> str:
         """Build SQL generation prompt with centralized template configuration"""
+        # Name of the SQL example the prompt is built from (Ollama usage attribution)
+        self.last_template = 'fallback'
         
         try:
             # ============================================
@@ -2442,6 +2448,7 @@ class PromptManager:
             if intent == 'parts_price' and entities.get('products'):
                 products = entities['products']
                 logger.info(f"🎯 Parts price query with products: {products}")
+                self.last_template = 'parts_price'
                 
                 where_conditions = []
                 for product in products:
@@ -2522,6 +2529,7 @@ class PromptManager:
                 example_name = self._get_example_name(example)
             
             logger.info(f"Selected SQL example: {example_name} for table {target_table}")
+            self.last_template = example_name if example else 'fallback'
             
             if not example:
                 logger.warning("No example found, using fallback")
@@ -2838,6 +2846,7 @@ class PromptManager:
         except Exception as e:
             logger.error(f"Error building SQL prompt: {e}")
             logger.error(f"Question: {question}, Intent: {intent}, Entities: {entities}")
+            self.last_template = 'fallback'
             return self._get_fallback_prompt(question)
     
     # ============================================
@@ -5484,38 +5493,26 @@ class PromptManager:
         stats = []
         
         try:
+            columns = ResultColumns(results)
+            
             # Check for revenue fields
-            revenue_fields = ['total_revenue', 'total', 'overhaul', 'total_value']
-            for field in revenue_fields:
-                if field in results[0]:
-                    total = 0
-                    for r in results:
-                        try:
-                            value = r.get(field, 0) or 0
-                            if isinstance(value, (int, float)):
-                                total += value
-                            elif isinstance(value, str):
-                                cleaned = re.sub(r'[^0-9.-]', '', value)
-                                if cleaned:
-                                    total += float(cleaned)
-                        except:
-                            continue
-                    
-                    if total > 0:
-                        stats.append(f"ยอดรวม ({field}): {total:,.0f} บาท")
-                    break
+            field = columns.first_present('total_revenue', 'total', 'overhaul', 'total_value')
+            if field:
+                total = columns.total(field, parse_strings=True)
+                if total > 0:
+                    stats.append(f"ยอดรวม ({field}): {total:,.0f} บาท")
             
             # Check for year
-            if 'year' in results[0] or 'year_label' in results[0]:
-                field = 'year' if 'year' in results[0] else 'year_label'
-                years = set(r.get(field) for r in results if r.get(field))
+            field = columns.first_present('year', 'year_label')
+            if field:
+                years = columns.distinct(field)
                 if years:
                     stats.append(f"ปีที่มีข้อมูล: {', '.join(sorted(str(y) for y in years))}")
             
             # Check for customer count
-            if 'customer_name' in results[0] or 'customer' in results[0]:
-                field = 'customer_name' if 'customer_name' in results[0] else 'customer'
-                customers = set(r.get(field) for r in results if r.get(field))
+            field = columns.first_present('customer_name', 'customer')
+            if field:
+                customers = columns.distinct(field)
                 if customers:
                     stats.append(f"จำนวนลูกค้า: {len(customers)} ราย")
             
@@ -0,0 +1,119 @@
+# agents/sql/clauses.py
+"""
+Lightweight top-level clause scanning for generated SQL
+Finds LIMIT / ORDER BY / UNION at parenthesis depth 0 without a full parser
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+# =============================================================================
+# MASKING
+# =============================================================================
+
+_MASKABLE = re.compile(
+    r"'(?:[^']|'')*'"          # string literals
+    r'|"(?:[^"]|"")*"'         # quoted identifiers
+    r"|--[^\n]*"               # line comments
+    r"|/\*.*?\*/",             # block comments
+    re.DOTALL
+)
+
+def mask_sql(sql: str) -> str:
+    """Blank out literals and comments (same length) so keywords inside them are ignored"""
+    return _MASKABLE.sub(lambda m: ' ' * len(m.group()), sql)
+
+def _depths(masked: str) -> List[int]:
+    """Parenthesis depth at every character position"""
+    depths = []
+    depth = 0
+    for ch in masked:
+        if ch == '(':
+            depths.append(depth)
+            depth += 1
+        elif ch == ')':
+            depth = max(depth - 1, 0)
+            depths.append(depth)
+        else:
+            depths.append(depth)
+    return depths
+
+# =============================================================================
+# TOP-LEVEL SEARCH
+# =============================================================================
+
+def find_top_level(sql: str, pattern: str, flags: int = re.IGNORECASE) -> List[re.Match]:
+    """Return matches of pattern that start at depth 0 (outside literals and comments)"""
+    masked = mask_sql(sql)
+    depths = _depths(masked)
+    return [
+        m for m in re.finditer(pattern, masked, flags)
+        if depths[m.start()] == 0
+    ]
+
+def strip_trailing_semicolon(sql: str) -> str:
+    """Remove trailing semicolons and whitespace"""
+    return sql.rstrip().rstrip(';').rstrip()
+
+def top_level_limit(sql: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Find the outermost LIMIT clause
+    Returns (limit_value, start, end) or None
+    """
+    matches = find_top_level(sql, r'\bLIMIT\s+(\d+)')
+    if not matches:
+        return None
+    last = matches[-1]
+    return int(last.group(1)), last.start(), last.end()
+
+def top_level_order_by(sql: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Find the outermost ORDER BY clause
+    Returns (clause_body, start, end) or None
+    """
+    matches = find_top_level(sql, r'\bORDER\s+BY\b')
+    if not matches:
+        return None
+    last = matches[-1]
+    masked = mask_sql(sql)
+    tail = re.search(r'\b(LIMIT|OFFSET|FETCH|FOR)\b|;|$', masked[last.end():], re.IGNORECASE)
+    end = last.end() + tail.start()
+    return sql[last.end():end].strip(), last.start(), end
+
+_CLAUSE_END = re.compile(
+    r'\b(?:GROUP\s+BY|ORDER\s+BY|HAVING|WINDOW|LIMIT|OFFSET|FETCH|UNION|INTERSECT|EXCEPT)\b|;',
+    re.IGNORECASE
+)
+
+def clause_spans(sql: str, pattern: str, flags: int = re.IGNORECASE) -> List[Tuple[int, int]]:
+    """
+    (start, end) of the body of every pattern clause, at any depth
+    A body ends at the next clause keyword at its own depth or where its
+    enclosing parenthesis closes; function calls and subqueries stay inside
+    """
+    masked = mask_sql(sql)
+    depths = _depths(masked)
+    ends = {m.start() for m in _CLAUSE_END.finditer(masked)}
+    spans = []
+    for match in re.finditer(pattern, masked, flags):
+        depth = depths[match.start()]
+        end = len(masked)
+        for i in range(match.end(), len(masked)):
+            if (masked[i] == ')' and depths[i] < depth) or (i in ends and depths[i] == depth):
+                end = i
+                break
+        spans.append((match.end(), end))
+    return spans
+
+def split_top_level(sql: str, separator: str = ',') -> List[str]:
+    """Split on a separator that occurs at depth 0"""
+    masked = mask_sql(sql)
+    depths = _depths(masked)
+    parts = []
+    start = 0
+    for i, ch in enumerate(masked):
+        if ch == separator and depths[i] == 0:
+            parts.append(sql[start:i].strip())
+            start = i + 1
+    parts.append(sql[start:].strip())
+    return [p for p in parts if p]
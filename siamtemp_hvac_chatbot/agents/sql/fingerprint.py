@@ -0,0 +1,38 @@
+# agents/sql/fingerprint.py
+"""
+SQL fingerprinting - normalize generated SQL so queries that differ only in
+literals (year, customer name, limits) share one key
+"""
+
+import re
+import hashlib
+from functools import lru_cache
+
+# Precompiled normalization steps (order matters)
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_YEAR_VIEWS = re.compile(r'\b(v_[a-z_]+?)(?:19|20)\d{2}\b', re.IGNORECASE)
+_NUMBERS = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """
+    Strip comments and literals from SQL
+    v_sales2024 WHERE customer_name LIKE '%STANLEY%' LIMIT 10
+    -> v_sales? where customer_name like ? limit ?
+    """
+    if not sql:
+        return ''
+    normalized = _COMMENTS.sub(' ', sql)
+    normalized = _STRINGS.sub('?', normalized)
+    normalized = _YEAR_VIEWS.sub(r'\1?', normalized)
+    normalized = _NUMBERS.sub('?', normalized)
+    normalized = _IN_LISTS.sub('(?+)', normalized)
+    normalized = _WHITESPACE.sub(' ', normalized).strip().rstrip(';').strip()
+    return normalized.lower()
+
+def fingerprint_sql(sql: str) -> str:
+    """Short stable id for the normalized form of a query"""
+    return hashlib.md5(normalize_sql(sql).encode('utf-8')).hexdigest()[:16]
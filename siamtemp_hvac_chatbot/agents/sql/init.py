@@ -1,5 +1,7 @@
 """SQL generation and validation modules."""
 
 from .validator import SQLValidator
+from .fingerprint import fingerprint_sql, normalize_sql
+from .pagination import ResultCursor, plan_keyset
 
-__all__ = ['SQLValidator']
\ No newline at end of file
+__all__ = ['SQLValidator', 'fingerprint_sql', 'normalize_sql', 'ResultCursor', 'plan_keyset']
\ No newline at end of file
@@ -0,0 +1,236 @@
+# agents/sql/pagination.py
+"""
+Keyset pagination over already-executed SQL
+A ResultCursor remembers the executed query and the last row shown, so a
+"show more" request can fetch the next page without going back to the LLM
+"""
+
+import re
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from .clauses import (
+    strip_trailing_semicolon, top_level_limit, top_level_order_by,
+    split_top_level, find_top_level
+)
+
+_ORDER_ITEM = re.compile(
+    r'^(?P<expr>.+?)(?:\s+(?P<dir>ASC|DESC))?(?P<nulls>\s+NULLS\s+(?:FIRST|LAST))?$',
+    re.IGNORECASE | re.DOTALL
+)
+_IDENTIFIER = re.compile(r'^(?:[A-Za-z_]\w*\.)?(?P<name>"[^"]+"|[A-Za-z_]\w*)$')
+
+# =============================================================================
+# KEYSET PLANNING
+# =============================================================================
+
+@dataclass
+class KeysetPlan:
+    """How to page through a query"""
+    base_sql: str                      # query without outer LIMIT / semicolon
+    keys: List[str] = field(default_factory=list)  # empty → OFFSET paging
+    descending: bool = False
+    base_limit: Optional[int] = None   # original LIMIT (total cap)
+
+    @property
+    def uses_keyset(self) -> bool:
+        return bool(self.keys)
+
+def plan_keyset(sql: str, columns: List[str]) -> KeysetPlan:
+    """
+    Derive keyset keys from the outer ORDER BY
+    Keyset is used when every ORDER BY item is a selected column with one
+    shared direction and no NULLS clause; otherwise paging falls back to OFFSET
+    """
+    body = strip_trailing_semicolon(sql)
+    base_limit = None
+
+    limit = top_level_limit(body)
+    if limit and not find_top_level(body, r'\bOFFSET\b'):
+        base_limit = limit[0]
+        body = (body[:limit[1]] + body[limit[2]:]).rstrip()
+
+    plan = KeysetPlan(base_sql=body, base_limit=base_limit)
+
+    order = top_level_order_by(body)
+    if not order:
+        return plan
+
+    keys = []
+    directions = set()
+    for item in split_top_level(order[0]):
+        match = _ORDER_ITEM.match(item.strip())
+        if not match or match.group('nulls'):
+            return plan
+        expr = match.group('expr').strip()
+        directions.add((match.group('dir') or 'ASC').upper())
+
+        if expr.isdigit():
+            index = int(expr) - 1
+            if not 0 <= index < len(columns):
+                return plan
+            keys.append(columns[index])
+            continue
+
+        ident = _IDENTIFIER.match(expr)
+        if not ident:
+            return plan
+        name = ident.group('name').strip('"')
+        if name not in columns:
+            return plan
+        keys.append(name)
+
+    if len(directions) != 1:
+        return plan
+
+    plan.keys = keys
+    plan.descending = directions == {'DESC'}
+    return plan
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _encode_key(value: Any) -> Any:
+    """JSON form of a keyset value that keeps its SQL type (Decimal, date, timestamp)"""
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+def _decode_key(value: Any) -> Any:
+    if isinstance(value, dict):
+        if '$decimal' in value:
+            return Decimal(value['$decimal'])
+        if '$datetime' in value:
+            return datetime.fromisoformat(value['$datetime'])
+        if '$date' in value:
+            return date.fromisoformat(value['$date'])
+    return value
+
+# =============================================================================
+# RESULT CURSOR
+# =============================================================================
+
+@dataclass
+class ResultCursor:
+    """Position inside an executed result set"""
+    plan: KeysetPlan
+    page_size: int
+    question: str = ''
+    intent: Optional[str] = None
+    cursor_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    fetched: int = 0
+    last_key: Optional[Tuple] = None
+    ties: int = 0                      # rows at the page end sharing last_key
+    page: int = 1
+    total_rows: Optional[int] = None   # size of the first full execution
+    exhausted: bool = False
+    created_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def after_first_page(cls, sql: str, rows: List[Dict], page_size: int,
+                         question: str = '', intent: Optional[str] = None) -> 'ResultCursor':
+        """Cursor positioned after rows[:page_size] (rows = raw DB rows)"""
+        columns = list(rows[0].keys()) if rows else []
+        cursor = cls(plan_keyset(sql, columns), page_size, question, intent, total_rows=len(rows))
+        cursor.advance(rows[:page_size])
+        return cursor
+
+    def remaining_limit(self) -> int:
+        """Rows still allowed by the original LIMIT"""
+        if self.plan.base_limit is None:
+            return self.page_size
+        return max(min(self.page_size, self.plan.base_limit - self.fetched), 0)
+
+    def next_page_query(self) -> Tuple[str, Optional[tuple]]:
+        """SQL + params for the next page"""
+        limit = self.remaining_limit()
+
+        if not self.plan.uses_keyset or self.last_key is None or None in self.last_key:
+            return (
+                f"SELECT * FROM (\n{self.plan.base_sql}\n) AS page_src "
+                f"LIMIT {limit} OFFSET {self.fetched};",
+                None
+            )
+
+        # psycopg2 interpolates %s, so literal % in the base query must be doubled
+        base = self.plan.base_sql.replace('%', '%%')
+        condition, params = self._keyset_condition()
+        direction = ' DESC' if self.plan.descending else ''
+        order = ', '.join(_quote(k) + direction for k in self.plan.keys)
+
+        return (
+            f"SELECT * FROM (\n{base}\n) AS page_src "
+            f"WHERE {condition} "
+            f"ORDER BY {order} LIMIT {limit} OFFSET {self.ties};",
+            params
+        )
+
+    def _keyset_condition(self) -> Tuple[str, tuple]:
+        """
+        Rows at or after last_key in the query's order (last_key has no NULLs)
+        Postgres sorts NULL last in ASC, so ASC keys also admit NULL - a row
+        comparison would drop those rows; in DESC NULLs come first and are
+        already behind the cursor
+        """
+        strict, inclusive = ('<', '<=') if self.plan.descending else ('>', '>=')
+        condition, params = '', ()
+        for key, value in reversed(list(zip(self.plan.keys, self.last_key))):
+            column = _quote(key)
+            if not condition:
+                part, part_params = f"{column} {inclusive} %s", (value,)
+            else:
+                part, part_params = f"{column} {strict} %s", (value,)
+            if not self.plan.descending:
+                part = f"{part} OR {column} IS NULL"
+            if condition:
+                part = f"{part} OR ({column} = %s AND {condition})"
+                part_params = (value, value) + params
+            condition, params = f"({part})", part_params
+        return condition, params
+
+    def advance(self, rows: List[Dict]):
+        """Move the cursor past rows (raw DB rows, before cleaning)"""
+        if rows:
+            self.fetched += len(rows)
+            if self.plan.uses_keyset:
+                key = tuple(rows[-1].get(k) for k in self.plan.keys)
+                same = 0
+                for row in reversed(rows):
+                    if tuple(row.get(k) for k in self.plan.keys) != key:
+                        break
+                    same += 1
+                # Ties continue across pages when the whole page shares the key
+                self.ties = self.ties + same if key == self.last_key and same == len(rows) else same
+                self.last_key = key
+
+        if (len(rows) < self.page_size or self.remaining_limit() == 0
+                or (self.total_rows is not None and self.fetched >= self.total_rows)):
+            self.exhausted = True
+
+    def is_expired(self, ttl_seconds: int) -> bool:
+        return time.time() - self.created_at > ttl_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-safe form (shared conversation state)"""
+        data = asdict(self)
+        if self.last_key is not None:
+            data['last_key'] = [_encode_key(value) for value in self.last_key]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ResultCursor':
+        data = dict(data)
+        data['plan'] = KeysetPlan(**data['plan'])
+        if data.get('last_key') is not None:
+            data['last_key'] = tuple(_decode_key(value) for value in data['last_key'])
+        return cls(**data)
@@ -0,0 +1,457 @@
+# agents/storage/admission.py
+"""
+Admission control for the chat endpoints
+- Token buckets per tenant and per user (Redis, shared by all workers;
+  in-process buckets while Redis is unavailable)
+- Per-tenant in-flight caps and a worker-wide slot pool; when the pool is
+  full, waiting requests are served by weighted fair queueing between
+  tenants, so one tenant's batch report cannot starve the others
+- Rejections carry a retry hint (AdmissionRejected.retry_after) that the
+  ASGI middleware turns into a standard 429 with Retry-After
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from .memory import BoundedStateStore
+from .redis_memory import RedisConfig, get_async_pool
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+@dataclass
+class TenantLimits:
+    """Admission limits for a tenant (in-flight caps are per worker)"""
+    requests_per_minute: float = float(os.getenv('MAX_REQUESTS_PER_MINUTE', '600'))
+    burst: int = int(os.getenv('TENANT_BURST', '100'))
+    user_requests_per_minute: float = float(os.getenv('USER_REQUESTS_PER_MINUTE', '30'))
+    user_burst: int = int(os.getenv('USER_BURST', '10'))
+    max_in_flight: int = int(os.getenv('TENANT_MAX_IN_FLIGHT', '8'))
+    weight: float = 1.0
+
+def _load_tenant_limits() -> Dict[str, TenantLimits]:
+    """Per-tenant overrides from TENANT_LIMITS (JSON: {"company-b": {"max_in_flight": 2, "weight": 0.5}})"""
+    raw = os.getenv('TENANT_LIMITS', '')
+    if not raw:
+        return {}
+    try:
+        return {tenant: TenantLimits(**limits) for tenant, limits in json.loads(raw).items()}
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid TENANT_LIMITS: {e}")
+        return {}
+
+class AdmissionRejected(Exception):
+    """Request not admitted; retry_after is the hint in seconds"""
+
+    def __init__(self, scope: str, retry_after: float, message: str):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+# =============================================================================
+# TOKEN BUCKETS
+# =============================================================================
+
+# KEYS: bucket keys; ARGV: rate (tokens/s) and burst per key
+# Takes one token from every bucket or from none; returns {allowed, wait, index of the empty bucket}
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local wait, blocked = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < 1 and (1 - tokens) / rate > wait then
+        wait = (1 - tokens) / rate
+        blocked = i
+    end
+end
+if blocked > 0 then
+    return {0, tostring(wait), blocked}
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 60)
+end
+return {1, '0', 0}
+"""
+
+class TokenBuckets:
+    """
+    take(buckets) with buckets = [(key, rate_per_second, burst), ...]
+    Returns (allowed, wait_seconds, index of the bucket that was empty)
+    """
+
+    KEY_PREFIX = "ratelimit"
+
+    def __init__(self, redis_client: Optional[aioredis.Redis] = None, use_redis: bool = True,
+                 max_local_buckets: int = 50000, retry_redis_after: float = 30.0):
+        self.redis_client = None
+        if use_redis:
+            self.redis_client = redis_client or aioredis.Redis(connection_pool=get_async_pool(RedisConfig()))
+        self._script = self.redis_client.register_script(TOKEN_BUCKET_SCRIPT) if self.redis_client else None
+        # Idle buckets refill completely, so forgetting them is harmless
+        self._local = BoundedStateStore(max_local_buckets, idle_ttl=3600)
+        self.retry_redis_after = retry_redis_after
+        self._redis_down_until = 0.0
+        self.stats = {'redis_checks': 0, 'local_checks': 0, 'redis_errors': 0}
+
+    async def take(self, buckets: List[Tuple[str, float, int]]) -> Tuple[bool, float, int]:
+        if self._script is not None and time.monotonic() >= self._redis_down_until:
+            try:
+                allowed, wait, blocked = await self._script(
+                    keys=[f"{self.KEY_PREFIX}:{key}" for key, _, _ in buckets],
+                    args=[value for _, rate, burst in buckets for value in (rate, burst)]
+                )
+                self.stats['redis_checks'] += 1
+                return bool(int(allowed)), float(wait), int(blocked) - 1
+            except Exception as e:
+                self.stats['redis_errors'] += 1
+                self._redis_down_until = time.monotonic() + self.retry_redis_after
+                logger.warning(f"Rate limit store unavailable, using per-worker buckets for "
+                               f"{self.retry_redis_after:.0f}s: {e}")
+        return self._take_local(buckets)
+
+    def _take_local(self, buckets: List[Tuple[str, float, int]]) -> Tuple[bool, float, int]:
+        self.stats['local_checks'] += 1
+        now = time.monotonic()
+        levels = []
+        wait, blocked = 0.0, -1
+        for i, (key, rate, burst) in enumerate(buckets):
+            state = self._local.get(key)
+            tokens = burst if state is None else min(burst, state[0] + (now - state[1]) * rate)
+            levels.append(tokens)
+            if tokens < 1 and (1 - tokens) / rate > wait:
+                wait, blocked = (1 - tokens) / rate, i
+        if blocked >= 0:
+            return False, wait, blocked
+        for (key, _, _), tokens in zip(buckets, levels):
+            self._local.set(key, (tokens - 1, now))
+        return True, 0.0, -1
+
+# =============================================================================
+# FAIR SCHEDULER
+# =============================================================================
+
+class _Waiter:
+    __slots__ = ('tenant', 'tag', 'future')
+
+    def __init__(self, tenant: str, tag: float, future: asyncio.Future):
+        self.tenant = tenant
+        self.tag = tag
+        self.future = future
+
+class FairScheduler:
+    """
+    Worker-wide in-flight slots with per-tenant caps
+    Each request gets a virtual finish tag (start-time fair queueing):
+    tag = max(virtual time, tenant's last tag) + 1 / weight. A freed slot
+    goes to the waiting request with the smallest tag among tenants below
+    their cap, so tenants share a saturated worker by weight
+    """
+
+    def __init__(self, capacity: int, limits_for: Callable[[str], TenantLimits]):
+        self.capacity = capacity
+        self.limits_for = limits_for
+        self.in_flight: Dict[str, int] = {}
+        self.total_in_flight = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {}
+        self.virtual_time = 0.0
+        self._last_tag: Dict[str, float] = {}
+        # EWMA of slot hold time per tenant, for retry hints
+        self.hold_seconds: Dict[str, float] = {}
+
+    def queued(self, tenant: Optional[str] = None) -> int:
+        if tenant is not None:
+            return len(self.queues.get(tenant, ()))
+        return sum(len(q) for q in self.queues.values())
+
+    def _tag(self, tenant: str) -> float:
+        weight = max(self.limits_for(tenant).weight, 1e-3)
+        tag = max(self.virtual_time, self._last_tag.get(tenant, 0.0)) + 1.0 / weight
+        self._last_tag[tenant] = tag
+        return tag
+
+    def _has_room(self, tenant: str) -> bool:
+        return (self.total_in_flight < self.capacity
+                and self.in_flight.get(tenant, 0) < self.limits_for(tenant).max_in_flight)
+
+    def _grant(self, tenant: str, tag: float):
+        self.in_flight[tenant] = self.in_flight.get(tenant, 0) + 1
+        self.total_in_flight += 1
+        self.virtual_time = max(self.virtual_time, tag - 1.0 / max(self.limits_for(tenant).weight, 1e-3))
+
+    async def acquire(self, tenant: str, timeout: float, max_queue: int):
+        """Wait for a slot; raises AdmissionRejected when the queue is full or on timeout"""
+        tag = self._tag(tenant)
+        if self._has_room(tenant) and not self.queued():
+            self._grant(tenant, tag)
+            return
+        if self.queued(tenant) >= max_queue:
+            raise AdmissionRejected('concurrency', self.retry_hint(tenant), f"Too many queued requests for {tenant}")
+
+        waiter = _Waiter(tenant, tag, asyncio.get_running_loop().create_future())
+        self.queues.setdefault(tenant, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._remove(waiter)
+                raise AdmissionRejected('concurrency', self.retry_hint(tenant),
+                                        f"No capacity for {tenant} within {timeout:g}s")
+        except asyncio.CancelledError:
+            # Client went away: give the slot back if it was granted meanwhile
+            if waiter.future.done():
+                self.release(tenant, 0.0)
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self, tenant: str, held_seconds: float):
+        self.in_flight[tenant] = max(0, self.in_flight.get(tenant, 0) - 1)
+        self.total_in_flight = max(0, self.total_in_flight - 1)
+        if held_seconds:
+            previous = self.hold_seconds.get(tenant, held_seconds)
+            self.hold_seconds[tenant] = 0.8 * previous + 0.2 * held_seconds
+        self._dispatch()
+
+    def retry_hint(self, tenant: str) -> float:
+        """About one slot hold time per request queued ahead"""
+        per_request = self.hold_seconds.get(tenant, 1.0)
+        slots = max(1, self.limits_for(tenant).max_in_flight)
+        return max(1.0, per_request * (self.queued(tenant) + 1) / slots)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self.queues.get(waiter.tenant)
+        if queue is not None:
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                pass
+            if not queue:
+                del self.queues[waiter.tenant]
+
+    def _dispatch(self):
+        while self.total_in_flight < self.capacity:
+            eligible = [q for tenant, q in self.queues.items() if self._has_room(tenant)]
+            if not eligible:
+                return
+            queue = min(eligible, key=lambda q: q[0].tag)
+            waiter = queue.popleft()
+            if not queue:
+                del self.queues[waiter.tenant]
+            if waiter.future.done():
+                continue
+            self._grant(waiter.tenant, waiter.tag)
+            waiter.future.set_result(True)
+
+# =============================================================================
+# CONTROLLER
+# =============================================================================
+
+class AdmissionController:
+    """
+    admit(tenant, user) checks the token buckets and waits for a slot;
+    release(ticket) when the request has finished (including streaming)
+    observe(tenant, outcome, wait_seconds, in_flight) feeds metrics
+    """
+
+    def __init__(self, default_limits: Optional[TenantLimits] = None,
+                 tenant_limits: Optional[Dict[str, TenantLimits]] = None,
+                 buckets: Optional[TokenBuckets] = None,
+                 observe: Optional[Callable[[str, str, float, int], None]] = None):
+        self.default_limits = default_limits or TenantLimits()
+        self.tenant_limits = tenant_limits if tenant_limits is not None else _load_tenant_limits()
+        self.buckets = buckets or TokenBuckets()
+        self.scheduler = FairScheduler(int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '16')), self.limits_for)
+        self.queue_timeout = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '30'))
+        self.max_queue = int(os.getenv('ADMISSION_MAX_QUEUE', '50'))
+        self.observe = observe
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def limits_for(self, tenant_id: str) -> TenantLimits:
+        return self.tenant_limits.get(tenant_id, self.default_limits)
+
+    def _record(self, tenant: str, outcome: str, wait_seconds: float = 0.0):
+        tenant_stats = self.stats.setdefault(tenant, {})
+        tenant_stats[outcome] = tenant_stats.get(outcome, 0) + 1
+        if self.observe:
+            self.observe(tenant, outcome, wait_seconds, self.scheduler.in_flight.get(tenant, 0))
+
+    async def admit(self, tenant_id: str, user_id: Optional[str]) -> Tuple[str, float]:
+        """
+        Ticket for release(); raises AdmissionRejected
+        user_id None (no real user id) → tenant bucket only, so anonymous
+        requests don't share one user bucket that caps the whole tenant
+        """
+        limits = self.limits_for(tenant_id)
+        buckets = [(f"tenant:{tenant_id}", limits.requests_per_minute / 60.0, limits.burst)]
+        if user_id is not None:
+            buckets.append((f"user:{tenant_id}:{user_id}", limits.user_requests_per_minute / 60.0, limits.user_burst))
+        allowed, wait, blocked = await self.buckets.take(buckets)
+        if not allowed:
+            scope = 'tenant' if blocked == 0 else 'user'
+            self._record(tenant_id, f"throttled_{scope}")
+            raise AdmissionRejected(scope, wait, f"Rate limit exceeded for {scope} {tenant_id if blocked == 0 else user_id}")
+
+        start = time.monotonic()
+        try:
+            await self.scheduler.acquire(tenant_id, self.queue_timeout, self.max_queue)
+        except AdmissionRejected:
+            self._record(tenant_id, 'rejected_concurrency', time.monotonic() - start)
+            raise
+        waited = time.monotonic() - start
+        self._record(tenant_id, 'admitted', waited)
+        return tenant_id, time.monotonic()
+
+    def release(self, ticket: Tuple[str, float]):
+        tenant_id, started = ticket
+        self.scheduler.release(tenant_id, time.monotonic() - started)
+        if self.observe:
+            self.observe(tenant_id, 'released', 0.0, self.scheduler.in_flight.get(tenant_id, 0))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'tenants': {
+                tenant: {**counts,
+                         'in_flight': self.scheduler.in_flight.get(tenant, 0),
+                         'queued': self.scheduler.queued(tenant)}
+                for tenant, counts in self.stats.items()
+            },
+            'in_flight': self.scheduler.total_in_flight,
+            'capacity': self.scheduler.capacity,
+            'queued': self.scheduler.queued(),
+            'buckets': self.buckets.stats
+        }
+
+# =============================================================================
+# ASGI MIDDLEWARE
+# =============================================================================
+
+# Fallback ids sent when the caller has no user (not a real user)
+ANONYMOUS_USER_IDS = frozenset({'default', 'openwebui_user', 'anonymous'})
+
+def resolve_user_id(headers: Dict[str, str], payload: Dict[str, Any]) -> Optional[str]:
+    """
+    Real user id from X-User-Id, OpenWebUI's forwarded X-OpenWebUI-User-Id
+    (ENABLE_FORWARD_USER_INFO_HEADERS), or the body (user_id / OpenAI "user");
+    None when only a placeholder is present
+    """
+    for value in (headers.get('x-user-id'), headers.get('x-openwebui-user-id'),
+                  payload.get('user_id'), payload.get('user')):
+        if value and str(value) not in ANONYMOUS_USER_IDS:
+            return str(value)
+    return None
+
+class AdmissionMiddleware:
+    """
+    Admission for POST requests to `paths`
+    Tenant / user come from X-Tenant-Id / X-User-Id (or X-OpenWebUI-User-Id)
+    or the JSON body (tenant_id, user_id); the body is read once and replayed
+    to the app. Requests without a real user id only use the tenant bucket.
+    skip(body) lets cheap requests through (e.g. OpenWebUI background prompts)
+    """
+
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str],
+                 resolve_tenant: Callable[[Optional[str]], str],
+                 skip: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+        self.resolve_tenant = resolve_tenant
+        self.skip = skip
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        messages, body = await _read_body(receive, self.MAX_BODY)
+        payload = _json_object(body)
+        if self.skip is not None and self.skip(payload):
+            return await self.app(scope, _replay(messages, receive), send)
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', ())}
+        tenant_id = self.resolve_tenant(headers.get('x-tenant-id') or payload.get('tenant_id'))
+        user_id = resolve_user_id(headers, payload)
+
+        try:
+            ticket = await self.controller.admit(tenant_id, user_id)
+        except AdmissionRejected as e:
+            return await _send_429(send, e)
+        try:
+            await self.app(scope, _replay(messages, receive), send)
+        finally:
+            self.controller.release(ticket)
+
+async def _read_body(receive, limit: int) -> Tuple[List[Dict], bytes]:
+    messages, chunks, size = [], [], 0
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message['type'] != 'http.request':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size <= limit:
+            chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return messages, b''.join(chunks) if size <= limit else b''
+
+def _json_object(body: bytes) -> Dict[str, Any]:
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+def _replay(messages: List[Dict], receive):
+    pending = deque(messages)
+
+    async def replay():
+        if pending:
+            return pending.popleft()
+        return await receive()
+    return replay
+
+async def _send_429(send, rejection: AdmissionRejected):
+    retry_after = max(1, math.ceil(rejection.retry_after))
+    body = json.dumps({
+        'detail': str(rejection),
+        'scope': rejection.scope,
+        'retry_after': retry_after
+    }, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 429,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(retry_after).encode()),
+            (b'x-ratelimit-scope', rejection.scope.encode())
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -5,7 +5,8 @@ import asyncio
 import time
 import logging
 import hashlib
-from typing import Dict, List, Any, Optional, Tuple, Union
+import uuid
+from typing import Dict, List, Any, Optional, Tuple, Union, AsyncIterator
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from collections import deque, defaultdict
@@ -14,12 +15,15 @@ import psycopg2
 from textwrap import dedent
 from psycopg2.extras import RealDictCursor
 from collections import Counter, defaultdict
+from .query_guard import QueryCostGuard, QueryCostExceededError
+from .query_stats import QueryStatsRegistry
+from ..sql.clauses import strip_trailing_semicolon
 logger = logging.getLogger(__name__)
 
 class SimplifiedDatabaseHandler:
     """
     SimplifiedDatabaseHandler - เพิ่ม query optimization
-    - Query plan analysis
+    - Cost-based admission (EXPLAIN + plan cache)
     - Connection pooling simulation
     - Better error handling
     """
@@ -27,22 +31,32 @@ class SimplifiedDatabaseHandler:
     def __init__(self):
         self.connection = None
         self.query_cache = {}
-        self.stats = defaultdict(lambda: {'count': 0, 'total_time': 0})
+        self.query_stats = QueryStatsRegistry()
+        self.cost_guard = QueryCostGuard()
         self._connect()
     
+    def _db_config(self) -> Dict:
+        return {
+            'host': os.getenv('DB_HOST', 'postgres-company-a'),
+            'port': os.getenv('DB_PORT', '5432'),
+            'database': os.getenv('DB_NAME', 'siamtemp_company_a'),
+            'user': os.getenv('DB_USER', 'postgres'),
+            'password': os.getenv('DB_PASSWORD', 'password123')
+        }
+    
+    def open_connection(self, statement_timeout_ms: int = 600000):
+        """Separate connection for maintenance jobs (caller closes it)"""
+        return psycopg2.connect(
+            **self._db_config(),
+            cursor_factory=RealDictCursor,
+            options=f'-c statement_timeout={statement_timeout_ms}'
+        )
+    
     def _connect(self):
         """สร้างการเชื่อมต่อกับ PostgreSQL"""
         try:
-            db_config = {
-                'host': os.getenv('DB_HOST', 'postgres-company-a'),
-                'port': os.getenv('DB_PORT', '5432'),
-                'database': os.getenv('DB_NAME', 'siamtemp_company_a'),
-                'user': os.getenv('DB_USER', 'postgres'),
-                'password': os.getenv('DB_PASSWORD', 'password123')
-            }
-            
             self.connection = psycopg2.connect(
-                **db_config,
+                **self._db_config(),
                 cursor_factory=RealDictCursor,
                 # Connection optimization
                 options='-c statement_timeout=60000 -c work_mem=256MB'
@@ -61,8 +75,12 @@ class SimplifiedDatabaseHandler:
             logger.error(f"❌ Database connection failed: {e}")
             self.connection = None
     
-    async def execute_query(self, sql: str) -> List[Dict]:
-        """Execute SQL with optimization hints"""
+    async def execute_query(self, sql: str, tenant_id: Optional[str] = None,
+                            params: Optional[tuple] = None) -> List[Dict]:
+        """
+        Execute SQL with optimization hints and cost-based admission
+        With params, literal % in sql must already be escaped as %%
+        """
         if not self.connection:
             self._connect()
             if not self.connection:
@@ -75,31 +93,108 @@ class SimplifiedDatabaseHandler:
             start_time = datetime.now()
             
             with self.connection.cursor() as cursor:
-                # Log query plan for slow queries
-                if self._is_complex_query(sql):
-                    self._log_query_plan(cursor, optimized_sql)
+                # Plan first - runaway queries are rejected or capped here
+                optimized_sql, estimate = self.cost_guard.admit(cursor, optimized_sql, tenant_id, params)
                 
-                cursor.execute(optimized_sql)
+                cursor.execute(optimized_sql, params)
                 results = cursor.fetchall()
                 
                 # Track statistics
                 elapsed = (datetime.now() - start_time).total_seconds()
                 self._update_stats(sql, elapsed, len(results))
+                self.cost_guard.record_actual(estimate, len(results))
                 
                 return [dict(row) for row in results]
                 
+        except QueryCostExceededError:
+            self.connection.rollback()
+            self.query_stats.record_error(sql)
+            raise
+            
         except psycopg2.errors.InFailedSqlTransaction:
             self.connection.rollback()
+            self.query_stats.record_error(sql)
             logger.warning("Transaction failed, reconnecting...")
             self._connect()  # Reconnect แทนการ retry
             return [] 
             
         except Exception as e:
             self.connection.rollback()
+            self.query_stats.record_error(sql)
             logger.error(f"Query execution error: {e}")
             logger.error(f"SQL: {optimized_sql[:500]}")
             raise
     
+    def admit_query(self, sql: str, tenant_id: Optional[str] = None) -> Tuple[str, Any]:
+        """
+        Cost-guard admission without executing (for queries run elsewhere,
+        e.g. fan-out partitions). Returns (sql_to_execute, estimate)
+        """
+        if not self.connection:
+            self._connect()
+            if not self.connection:
+                raise ConnectionError("Cannot connect to database")
+        try:
+            with self.connection.cursor() as cursor:
+                return self.cost_guard.admit(cursor, sql, tenant_id)
+        except QueryCostExceededError:
+            self.connection.rollback()
+            self.query_stats.record_error(sql)
+            raise
+    
+    async def stream_query(self, sql: str, tenant_id: Optional[str] = None,
+                           batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        """
+        Execute SQL through a server-side (named) cursor and yield row batches
+        Peak memory is bounded by batch_size instead of result size
+        """
+        if not self.connection:
+            self._connect()
+            if not self.connection:
+                raise ConnectionError("Cannot connect to database")
+        
+        optimized_sql = self._optimize_query(sql)
+        start_time = datetime.now()
+        row_count = 0
+        
+        try:
+            # Admission runs on a regular cursor (EXPLAIN can't go through DECLARE)
+            with self.connection.cursor() as cursor:
+                optimized_sql, estimate = self.cost_guard.admit(cursor, optimized_sql, tenant_id)
+            
+            with self.connection.cursor(name=f"stream_{uuid.uuid4().hex[:12]}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(strip_trailing_semicolon(optimized_sql))
+                
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    row_count += len(batch)
+                    yield batch
+                    # Let other requests run between batches
+                    await asyncio.sleep(0)
+            
+            # Named cursors live inside a transaction - end it
+            self.connection.commit()
+            
+            elapsed = (datetime.now() - start_time).total_seconds()
+            self._update_stats(sql, elapsed, row_count)
+            self.cost_guard.record_actual(estimate, row_count)
+            
+        except GeneratorExit:
+            # Consumer stopped early - drop the open portal
+            self.connection.rollback()
+            raise
+            
+        except Exception as e:
+            self.connection.rollback()
+            self.query_stats.record_error(sql)
+            if not isinstance(e, QueryCostExceededError):
+                logger.error(f"Streaming query error: {e}")
+                logger.error(f"SQL: {optimized_sql[:500]}")
+            raise
+    
     def _optimize_query(self, sql: str) -> str:
         """Add optimization hints based on query patterns"""
         optimized = sql
@@ -126,50 +221,24 @@ class SimplifiedDatabaseHandler:
         
         return optimized
     
-    def _is_complex_query(self, sql: str) -> bool:
-        """Determine if query is complex enough to log plan"""
-        complexity_indicators = [
-            sql.upper().count('JOIN') > 1,
-            sql.upper().count('GROUP BY') > 0,
-            sql.upper().count('UNION') > 0,
-            'WITH' in sql.upper(),
-            len(sql) > 1000
-        ]
-        return sum(complexity_indicators) >= 2
-    
-    def _log_query_plan(self, cursor, sql: str):
-        """Log query execution plan for analysis"""
-        try:
-            cursor.execute(f"EXPLAIN (ANALYZE false, FORMAT JSON) {sql}")
-            plan = cursor.fetchone()
-            if plan:
-                logger.debug(f"Query plan: {json.dumps(plan, indent=2)[:500]}")
-        except Exception as e:
-            logger.debug(f"Could not get query plan: {e}")
-    
     def _update_stats(self, sql: str, elapsed: float, row_count: int):
-        """Track query performance statistics"""
-        # Normalize SQL for statistics
-        normalized = re.sub(r'\s+', ' ', sql[:100]).strip()
-        
-        self.stats[normalized]['count'] += 1
-        self.stats[normalized]['total_time'] += elapsed
-        self.stats[normalized]['last_row_count'] = row_count
+        """Track query performance statistics per literal-stripped fingerprint"""
+        self.query_stats.record(sql, elapsed, row_count)
         
         # Log slow queries
         if elapsed > 5:
+            normalized = re.sub(r'\s+', ' ', sql[:100]).strip()
             logger.warning(f"Slow query ({elapsed:.2f}s): {normalized}")
     
     def get_performance_stats(self) -> Dict:
         """Get query performance statistics"""
         return {
-            'total_queries': sum(s['count'] for s in self.stats.values()),
-            'unique_queries': len(self.stats),
-            'slowest_queries': sorted(
-                [(k, v['total_time']/v['count']) for k, v in self.stats.items()],
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]
+            **self.query_stats.summary(),
+            'slowest_queries': [
+                (q['query'][:100], q['mean_time'])
+                for q in self.query_stats.top(5, order_by='mean_time')
+            ],
+            'cost_guard': self.cost_guard.get_stats(limit=5)
         }
     
     def close_connections(self):
@@ -0,0 +1,476 @@
+# agents/storage/fanout.py
+"""
+Per-year fan-out execution for multi-year comparison queries
+Splits UNION ALL queries over v_sales2023 / v_sales2024 / ... into independent
+partitions, runs them concurrently under one exported snapshot and merges
+(re-aggregates) the partial results in Python
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Tuple
+
+from .scalable_database import ScalableDatabaseHandler, DatabaseConfig
+from ..sql.clauses import (
+    mask_sql, _depths, find_top_level, strip_trailing_semicolon,
+    top_level_limit, top_level_order_by, split_top_level
+)
+
+logger = logging.getLogger(__name__)
+
+# Aggregates that can be recombined from partial results
+_MERGEABLE = {'SUM': 'sum', 'COUNT': 'sum', 'MIN': 'min', 'MAX': 'max'}
+_AGGREGATE_CALL = re.compile(r'\b(SUM|COUNT|MIN|MAX|AVG|STRING_AGG|ARRAY_AGG|BOOL_AND|BOOL_OR|STDDEV\w*|VARIANCE|PERCENTILE_\w+)\s*\(', re.IGNORECASE)
+_SELECT_ITEM = re.compile(r'^(?P<expr>.+?)(?:\s+(?:AS\s+)?(?P<alias>"[^"]+"|[A-Za-z_]\w*))?$', re.IGNORECASE | re.DOTALL)
+_COLUMN_REF = re.compile(r'^(?:[A-Za-z_]\w*\.)?(?P<name>"[^"]+"|[A-Za-z_]\w*)$')
+_ORDER_ITEM = re.compile(
+    r'^(?P<expr>.+?)(?:\s+(?P<dir>ASC|DESC))?(?:\s+NULLS\s+(?P<nulls>FIRST|LAST))?$',
+    re.IGNORECASE | re.DOTALL
+)
+_RESERVED_ALIASES = {'from', 'where', 'group', 'order', 'limit', 'desc', 'asc', 'end'}
+
+# =============================================================================
+# PLAN
+# =============================================================================
+
+@dataclass
+class FanoutPlan:
+    """Partition queries plus how to merge their results"""
+    partials: List[str]
+    group_keys: Optional[List[str]] = None         # None → plain concatenation
+    aggregates: Dict[str, str] = field(default_factory=dict)  # output column → sum/min/max
+    order_by: List[Tuple[str, bool, bool]] = field(default_factory=list)  # (column, desc, nulls_first)
+    limit: Optional[int] = None
+    columns: Optional[List[str]] = None             # UNION output names (first branch)
+
+    def merge(self, partial_results: List[List[Dict]]) -> List[Dict]:
+        """Combine partition results into the rows the original query returns"""
+        if self.columns is not None:
+            # Later UNION branches carry their own column names - rename by position
+            rows = [dict(zip(self.columns, row.values())) for rows in partial_results for row in rows]
+        elif self.group_keys is None:
+            rows = [row for rows in partial_results for row in rows]
+        else:
+            rows = self._reaggregate(partial_results)
+
+        for column, descending, nulls_first in reversed(self.order_by):
+            rows = _sorted(rows, column, descending, nulls_first)
+
+        return rows[:self.limit] if self.limit is not None else rows
+
+    def _reaggregate(self, partial_results: List[List[Dict]]) -> List[Dict]:
+        groups: 'OrderedDict[tuple, Dict]' = OrderedDict()
+        for rows in partial_results:
+            for row in rows:
+                key = tuple(row.get(k) for k in self.group_keys)
+                merged = groups.get(key)
+                if merged is None:
+                    groups[key] = dict(row)
+                    continue
+                for column, func in self.aggregates.items():
+                    merged[column] = _combine(merged.get(column), row.get(column), func)
+        return list(groups.values())
+
+def _combine(a: Any, b: Any, func: str) -> Any:
+    """Merge two partial aggregate values (NULL-aware like SQL)"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if func == 'sum':
+        return a + b
+    return min(a, b) if func == 'min' else max(a, b)
+
+def _sorted(rows: List[Dict], column: str, descending: bool, nulls_first: bool) -> List[Dict]:
+    """Stable sort on one column with PostgreSQL NULL placement"""
+    def value(row):
+        return row.get(column)
+    present = [r for r in rows if value(r) is not None]
+    missing = [r for r in rows if value(r) is None]
+    present.sort(key=value, reverse=descending)
+    return missing + present if nulls_first else present + missing
+
+def _split_union_all(sql: str) -> Optional[List[str]]:
+    """Split on top-level UNION ALL (None if plain UNION / other set ops are present)"""
+    if find_top_level(sql, r'\bUNION\b(?!\s+ALL\b)|\bINTERSECT\b|\bEXCEPT\b'):
+        return None
+    matches = find_top_level(sql, r'\bUNION\s+ALL\b')
+    if not matches:
+        return None
+    parts, start = [], 0
+    for match in matches:
+        parts.append(sql[start:match.start()].strip())
+        start = match.end()
+    parts.append(sql[start:].strip())
+    return parts if all(parts) else None
+
+def _tail_start(sql: str) -> int:
+    """Where the outer ORDER BY / LIMIT tail begins"""
+    starts = [len(sql)]
+    order = top_level_order_by(sql)
+    if order:
+        starts.append(order[1])
+    limit = top_level_limit(sql)
+    if limit:
+        starts.append(limit[1])
+    return min(starts)
+
+def _parse_order(sql: str, outputs: List[Tuple[str, str]]) -> Optional[List[Tuple[str, bool, bool]]]:
+    """ORDER BY items as (output column, desc, nulls_first); None if not evaluable in Python"""
+    order = top_level_order_by(sql)
+    if not order:
+        return []
+    names = [name for name, _ in outputs]
+    expressions = {re.sub(r'\s+', '', expr).lower(): name for name, expr in outputs}
+    items = []
+    for item in split_top_level(order[0]):
+        match = _ORDER_ITEM.match(item.strip())
+        if not match:
+            return None
+        expr = match.group('expr').strip()
+        descending = (match.group('dir') or 'ASC').upper() == 'DESC'
+        nulls = match.group('nulls')
+        nulls_first = nulls.upper() == 'FIRST' if nulls else descending
+
+        if expr.isdigit():
+            index = int(expr) - 1
+            if not 0 <= index < len(outputs):
+                return None
+            column = names[index]
+        else:
+            ref = _COLUMN_REF.match(expr)
+            name = ref.group('name').strip('"') if ref else None
+            if name not in names:
+                name = expressions.get(re.sub(r'\s+', '', expr).lower())
+            if name is None:
+                return None
+            column = name
+        items.append((column, descending, nulls_first))
+    return items
+
+def _output_name(expr: str, alias: Optional[str]) -> Optional[str]:
+    """Column name PostgreSQL gives a select item (None if engine-defined)"""
+    if alias:
+        return alias.strip('"')
+    ref = _COLUMN_REF.match(expr)
+    if ref:
+        return ref.group('name').strip('"')
+    call = re.match(r'^([A-Za-z_]\w*)\s*\(', expr)
+    if call and expr.rstrip().endswith(')'):
+        depths = _depths(mask_sql(expr.rstrip()))
+        if not any(d == 0 for d in depths[call.end():-1]):
+            return call.group(1).lower()
+    return None
+
+def _split_select_item(item: str) -> Tuple[str, Optional[str]]:
+    """(expression, alias) of one select-list item"""
+    match = _SELECT_ITEM.match(item.strip())
+    expr, alias = match.group('expr').strip(), match.group('alias')
+    if alias and alias.lower() in _RESERVED_ALIASES:
+        return item.strip(), None
+    return expr, alias
+
+def _branch_columns(branch: str) -> Optional[List[str]]:
+    """Output names of a SELECT branch (None if any are engine-defined)"""
+    branch = branch.strip()
+    while branch.startswith('(') and branch.endswith(')'):
+        branch = branch[1:-1].strip()
+    select = re.match(r'^SELECT\s+', mask_sql(branch), re.IGNORECASE)
+    froms = find_top_level(branch, r'\bFROM\b')
+    if not select or re.match(r'DISTINCT\b', branch[select.end():], re.IGNORECASE):
+        return None
+    select_list = branch[select.end():froms[0].start()] if froms else branch[select.end():]
+    names = [_output_name(*_split_select_item(item)) for item in split_top_level(select_list)]
+    return None if None in names or len(set(names)) != len(names) else names
+
+def _parse_select_list(select_list: str) -> Optional[Tuple[List[Tuple[str, str]], Dict[str, str]]]:
+    """
+    Output columns of the outer SELECT and mergeable aggregates
+    Returns ([(output_name, expr)], {output_name: merge_func}) or None
+    """
+    outputs, aggregates = [], {}
+    for item in split_top_level(select_list):
+        expr, alias = _split_select_item(item)
+        masked = mask_sql(expr)
+
+        calls = list(_AGGREGATE_CALL.finditer(masked))
+        if calls:
+            func = calls[0].group(1).upper()
+            # Exactly one mergeable call spanning the whole expression
+            if len(calls) != 1 or calls[0].start() != 0 or func not in _MERGEABLE:
+                return None
+            if not masked.rstrip().endswith(')') or _depths(masked)[-1] != 0:
+                return None
+            if re.search(r'\(\s*DISTINCT\b', masked, re.IGNORECASE):
+                return None
+            depths = _depths(masked)
+            if any(d == 0 for d in depths[calls[0].end():len(masked.rstrip()) - 1]):
+                return None  # e.g. SUM(a) + SUM(b)
+            name = (alias or func.lower()).strip('"')
+            aggregates[name] = _MERGEABLE[func]
+        else:
+            name = _output_name(expr, alias)
+            if name is None:
+                return None  # unnamed expression - output name is engine-defined
+        outputs.append((name, expr))
+    return outputs, aggregates
+
+def _parse_group_by(sql: str, outputs: List[Tuple[str, str]]) -> Optional[List[str]]:
+    """GROUP BY items as output column names; None if any is not a plain output"""
+    group = find_top_level(sql, r'\bGROUP\s+BY\b')
+    if not group:
+        return []
+    end = find_top_level(sql[group[0].end():], r'\bORDER\s+BY\b|\bLIMIT\b')
+    group_list = sql[group[0].end():group[0].end() + end[0].start()] if end else sql[group[0].end():]
+
+    names = [name for name, _ in outputs]
+    # A bare name means the input column first (PostgreSQL rules), then the output alias
+    expressions = {re.sub(r'\s+', '', expr).lower(): name for name, expr in outputs}
+    keys = []
+    for item in split_top_level(group_list):
+        expr = item.strip()
+        if expr.isdigit():
+            index = int(expr) - 1
+            if not 0 <= index < len(outputs):
+                return None
+            keys.append(names[index])
+            continue
+        name = expressions.get(re.sub(r'\s+', '', expr).lower())
+        if name is None:
+            ref = _COLUMN_REF.match(expr)
+            name = ref.group('name').strip('"') if ref else None
+            if name not in names:
+                return None
+        keys.append(name)
+    return keys if len(set(keys)) == len(keys) else None
+
+def plan_fanout(sql: str, min_partitions: int = 2) -> Optional[FanoutPlan]:
+    """
+    Build a fan-out plan for
+    A) SELECT ... UNION ALL SELECT ... [ORDER BY] [LIMIT]
+    B) SELECT keys, SUM/COUNT/MIN/MAX(...) FROM (... UNION ALL ...) t
+       [WHERE] [GROUP BY keys] [ORDER BY] [LIMIT]
+    Returns None for anything else (AVG, DISTINCT, HAVING, joins ...)
+    """
+    body = strip_trailing_semicolon(sql)
+    if not re.match(r'^\s*\(?\s*SELECT\b', mask_sql(body), re.IGNORECASE):
+        return None
+    limit = top_level_limit(body)
+    if find_top_level(body, r'\bOFFSET\b|\bFETCH\b|\bFOR\s+UPDATE\b'):
+        return None
+
+    # Shape A: the statement itself is a UNION ALL
+    parts = _split_union_all(body[:_tail_start(body)])
+    if parts:
+        columns = _branch_columns(parts[0])
+        if len(parts) < min_partitions or columns is None:
+            return None
+        order = _parse_order(body, [(name, name) for name in columns])
+        if order is None:
+            return None
+        return FanoutPlan(partials=parts, order_by=order, columns=columns,
+                          limit=limit[0] if limit else None)
+
+    # Shape B: outer query over a UNION ALL derived table
+    masked = mask_sql(body)
+    froms = find_top_level(body, r'\bFROM\s*\(')
+    select = re.match(r'^\s*SELECT\s+', masked, re.IGNORECASE)
+    if len(froms) != 1 or not select or re.match(r'DISTINCT\b', masked[select.end():], re.IGNORECASE):
+        return None
+
+    open_at = froms[0].end() - 1
+    depths = _depths(masked)
+    close_at = next((i for i in range(open_at + 1, len(masked))
+                     if masked[i] == ')' and depths[i] == 0), None)
+    if close_at is None:
+        return None
+
+    parts = _split_union_all(body[open_at + 1:close_at])
+    if not parts or len(parts) < min_partitions:
+        return None
+
+    rest = body[close_at + 1:]
+    clauses = find_top_level(rest, r'\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b')
+    from_tail = rest[:clauses[0].start()] if clauses else rest
+    if ',' in mask_sql(from_tail) or find_top_level(rest, r'\bHAVING\b|\bWINDOW\b|\bJOIN\b|\bOVER\b'):
+        return None  # more FROM items, joins or post-aggregation filters
+
+    parsed = _parse_select_list(body[select.end():froms[0].start()])
+    if parsed is None:
+        return None
+    outputs, aggregates = parsed
+    if find_top_level(body[select.end():froms[0].start()], r'\bOVER\b'):
+        return None
+
+    group = find_top_level(rest, r'\bGROUP\s+BY\b')
+    if aggregates or group:
+        # Every non-aggregate output is a grouping key, and the GROUP BY must be
+        # exactly those keys - extra keys make each partition return finer
+        # groups than the merge would re-aggregate
+        group_keys = [name for name, _ in outputs if name not in aggregates]
+        if group and not group_keys:
+            return None
+        grouped_by = _parse_group_by(rest, outputs) if group else []
+        if grouped_by is None or sorted(grouped_by) != sorted(group_keys):
+            return None
+    else:
+        group_keys = None
+
+    order = _parse_order(rest, outputs)
+    if order is None:
+        return None
+
+    select_list = body[select.end():froms[0].start()].strip()
+    head = rest[:_tail_start(rest)].rstrip()
+    partials = [f"SELECT {select_list} FROM (\n{part}\n){head}" for part in parts]
+
+    return FanoutPlan(
+        partials=partials,
+        group_keys=group_keys,
+        aggregates=aggregates,
+        order_by=order,
+        limit=limit[0] if limit else None
+    )
+
+# =============================================================================
+# EXECUTOR
+# =============================================================================
+
+class FanoutExecutor:
+    """
+    Runs FanoutPlans on the asyncpg pool of a ScalableDatabaseHandler
+    All partitions import one exported snapshot, so the merged result is as
+    consistent as the original single statement
+    A fan-out holds 1 + partitions pool connections at once; they are reserved
+    together from a budget of the pool size, so concurrent fan-outs queue
+    instead of each holding a snapshot connection while waiting for the rest
+    """
+
+    def __init__(self, db: Optional[ScalableDatabaseHandler] = None,
+                 query_stats=None, min_partitions: int = 2,
+                 retry_interval: float = float(os.getenv('FANOUT_RETRY_SECONDS', '60'))):
+        self.db = db or ScalableDatabaseHandler(DatabaseConfig.from_env())
+        self.query_stats = query_stats
+        self.min_partitions = min_partitions
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0
+        self._init_lock: Optional[asyncio.Lock] = None
+        self._reserve_lock: Optional[asyncio.Lock] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {
+            'fanouts': 0,
+            'partitions': 0,
+            'failures': 0,
+            'busy_fallbacks': 0,
+            'total_time': 0.0
+        }
+
+    @property
+    def available(self) -> bool:
+        return self.db.pool is not None or time.monotonic() >= self._retry_at
+
+    def plan(self, sql: str) -> Optional[FanoutPlan]:
+        return plan_fanout(sql, self.min_partitions)
+
+    async def _ensure_pool(self) -> bool:
+        """Create the asyncpg pool on first use (retried every retry_interval after a failure)"""
+        if self.db.pool is not None:
+            return True
+        if not self.available:
+            return False
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.db.pool is None:
+                try:
+                    await self.db.initialize_async()
+                except Exception as e:
+                    logger.warning(f"Fan-out unavailable for {self.retry_interval:.0f}s, pool failed: {e}")
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    return False
+                self._reserve_lock = asyncio.Lock()
+                self._slots = asyncio.Semaphore(self.db.config.max_connections)
+        return True
+
+    async def _reserve(self, connections: int) -> bool:
+        """Take `connections` pool slots together; False after the acquire timeout"""
+        taken = 0
+
+        async def take():
+            nonlocal taken
+            async with self._reserve_lock:
+                while taken < connections:
+                    await self._slots.acquire()
+                    taken += 1
+
+        try:
+            await asyncio.wait_for(take(), self.db.config.acquire_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._release(taken)
+            return False
+        except BaseException:
+            self._release(taken)
+            raise
+
+    def _release(self, connections: int):
+        for _ in range(connections):
+            self._slots.release()
+
+    async def execute(self, sql: str, plan: Optional[FanoutPlan] = None) -> Optional[List[Dict]]:
+        """
+        Execute sql as concurrent partitions
+        Returns None when the query can't be fanned out (caller runs it serially)
+        """
+        plan = plan or self.plan(sql)
+        if plan is None or not await self._ensure_pool():
+            return None
+
+        connections = len(plan.partials) + 1  # + the snapshot holder
+        if connections > self.db.config.max_connections:
+            return None
+        start_time = time.time()
+        if not await self._reserve(connections):
+            self.stats['busy_fallbacks'] += 1
+            logger.warning(f"Fan-out pool busy, running {len(plan.partials)} partitions serially")
+            return None
+        try:
+            async with self.db.export_snapshot() as snapshot_id:
+                partial_results = await self.db.execute_batch(
+                    [(partial, None) for partial in plan.partials],
+                    snapshot_id=snapshot_id,
+                    raise_on_error=True
+                )
+        except Exception:
+            self.stats['failures'] += 1
+            if self.query_stats:
+                self.query_stats.record_error(sql)
+            raise
+        finally:
+            self._release(connections)
+
+        rows = plan.merge(partial_results)
+        elapsed = time.time() - start_time
+
+        self.stats['fanouts'] += 1
+        self.stats['partitions'] += len(plan.partials)
+        self.stats['total_time'] += elapsed
+        if self.query_stats:
+            self.query_stats.record(sql, elapsed, len(rows))
+
+        logger.info(
+            f"⚡ Fan-out: {len(plan.partials)} partitions, "
+            f"{sum(len(r) for r in partial_results)} partial rows → {len(rows)} rows in {elapsed:.3f}s"
+        )
+        return rows
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'available': self.available}
+
+    async def close(self):
+        await self.db.close()
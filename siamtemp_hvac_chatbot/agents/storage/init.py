@@ -1,9 +1,31 @@
 """Storage and database handling modules."""
 
 from .database import SimplifiedDatabaseHandler
-from .memory import ConversationMemory
+from .memory import ConversationMemory, BoundedStateStore, ConversationMemoryCollector
+from .query_guard import QueryCostGuard, QueryCostExceededError, CostThresholds
+from .query_stats import QueryStatsRegistry, QueryStatsCollector
+from .fanout import FanoutExecutor, plan_fanout
+from .result_export import ResultExportStore, ExportInfo
+from .shared_state import SharedState
+from .admission import AdmissionController, AdmissionMiddleware, AdmissionRejected, TenantLimits
 
 __all__ = [
     'SimplifiedDatabaseHandler',
     'ConversationMemory',
+    'BoundedStateStore',
+    'ConversationMemoryCollector',
+    'QueryCostGuard',
+    'QueryCostExceededError',
+    'CostThresholds',
+    'QueryStatsRegistry',
+    'QueryStatsCollector',
+    'FanoutExecutor',
+    'plan_fanout',
+    'ResultExportStore',
+    'ExportInfo',
+    'SharedState',
+    'AdmissionController',
+    'AdmissionMiddleware',
+    'AdmissionRejected',
+    'TenantLimits',
 ]
\ No newline at end of file
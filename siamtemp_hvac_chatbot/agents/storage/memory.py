@@ -1,14 +1,15 @@
 import os
+import sys
 import re
 import json
 import asyncio
 import time
 import logging
 import hashlib
-from typing import Dict, List, Any, Optional, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple, Union
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 import aiohttp
 import psycopg2
 from textwrap import dedent
@@ -16,54 +17,262 @@ from psycopg2.extras import RealDictCursor
 from collections import Counter, defaultdict
 logger = logging.getLogger(__name__)
 
+# =============================================================================
+# BOUNDED STATE STORE
+# =============================================================================
+
+class BoundedStateStore:
+    """
+    Per-user state with a global LRU cap and an idle TTL
+    Items are kept in last-used order, so expiry only ever pops from the
+    front: prune() is O(expired items), never a scan
+    """
+
+    def __init__(self, max_items: int, idle_ttl: float,
+                 on_evict: Optional[Callable[[str, Any], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_items = max_items
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self._items: 'OrderedDict[str, list]' = OrderedDict()   # key -> [value, last_used]
+        self.evictions = {'lru': 0, 'idle': 0}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Value for key (touching it), or default if absent/idle-expired"""
+        item = self._items.get(key)
+        if item is None:
+            return default
+        now = self.clock()
+        if now - item[1] > self.idle_ttl:
+            self._evict(key, 'idle')
+            return default
+        item[1] = now
+        self._items.move_to_end(key)
+        return item[0]
+
+    def set(self, key: str, value: Any):
+        item = self._items.get(key)
+        if item is not None:
+            if self.on_evict and item[0] is not value:
+                self.on_evict(key, item[0])
+            item[0], item[1] = value, self.clock()
+            self._items.move_to_end(key)
+            return
+        self._items[key] = [value, self.clock()]
+        self.prune()
+        while len(self._items) > self.max_items:
+            self._evict(next(iter(self._items)), 'lru')
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        item = self._items.pop(key, None)
+        if item is None:
+            return default
+        if self.on_evict:
+            self.on_evict(key, item[0])
+        return item[0]
+
+    def prune(self) -> int:
+        """Drop items idle longer than idle_ttl"""
+        cutoff = self.clock() - self.idle_ttl
+        removed = 0
+        while self._items:
+            key, item = next(iter(self._items.items()))
+            if item[1] >= cutoff:
+                break
+            self._evict(key, 'idle')
+            removed += 1
+        return removed
+
+    def _evict(self, key: str, reason: str):
+        value, _ = self._items.pop(key)
+        self.evictions[reason] += 1
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def clear(self):
+        for key in list(self._items):
+            self.pop(key)
+
+    def values(self) -> Iterator[Any]:
+        return (item[0] for item in self._items.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+# =============================================================================
+# CONVERSATION MEMORY
+# =============================================================================
+
+class TurnRecord:
+    """One stored turn - slotted, timestamp kept as a float"""
+    __slots__ = ('timestamp', 'query', 'intent', 'entities', 'success',
+                 'sql_query', 'results_count', 'processing_time', 'size')
+
+    # Object header + one pointer per slot
+    BASE_SIZE = sys.getsizeof(object()) + 9 * 8
+
+    def __init__(self, query: str, response: Dict[str, Any]):
+        self.timestamp = time.time()
+        self.query = query
+        self.intent = response.get('intent', 'unknown')
+        self.entities = response.get('entities') or {}
+        self.success = response.get('success', False)
+        self.sql_query = response.get('sql_query')
+        self.results_count = response.get('results_count', 0)
+        self.processing_time = response.get('processing_time', 0)
+        self.size = (self.BASE_SIZE + sys.getsizeof(query)
+                     + (sys.getsizeof(self.sql_query) if self.sql_query else 0)
+                     + sys.getsizeof(self.entities))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'query': self.query,
+            'intent': self.intent,
+            'entities': self.entities,
+            'success': self.success,
+            'sql_query': self.sql_query,
+            'results_count': self.results_count,
+            'processing_time': self.processing_time
+        }
+
 class ConversationMemory:
     """
     ระบบจดจำบทสนทนา - เก็บประวัติการสนทนาและ context
+    Bounded: LRU over users (MAX_MEMORY_USERS) with an idle TTL
+    (STATE_IDLE_TTL), capped history per user and capped pattern lists
     """
-    def __init__(self, max_history: int = 20):
-        self.conversations = defaultdict(lambda: deque(maxlen=max_history))
-        self.user_preferences = defaultdict(dict)
-        self.successful_patterns = defaultdict(list)
+    def __init__(self, max_history: int = 20, max_users: Optional[int] = None,
+                 idle_ttl: Optional[float] = None, max_patterns: int = 1000,
+                 max_sql_per_pattern: int = 5, clock: Callable[[], float] = time.monotonic):
+        self.max_history = max_history
+        self.max_sql_per_pattern = max_sql_per_pattern
+        self.estimated_bytes = 0
+        self.conversations = BoundedStateStore(
+            max_users or int(os.getenv('MAX_MEMORY_USERS', '10000')),
+            idle_ttl or float(os.getenv('STATE_IDLE_TTL', '86400')),
+            on_evict=self._release_history,
+            clock=clock
+        )
+        # pattern_key -> recent successful SQL, LRU capped
+        self.successful_patterns: 'OrderedDict[str, deque]' = OrderedDict()
+        self.max_patterns = max_patterns
     
     def add_conversation(self, user_id: str, query: str, response: Dict[str, Any]):
         """บันทึกบทสนทนา"""
-        entry = {
-            'timestamp': datetime.now().isoformat(),
-            'query': query,
-            'intent': response.get('intent', 'unknown'),
-            'entities': response.get('entities', {}),
-            'success': response.get('success', False),
-            'sql_query': response.get('sql_query'),
-            'results_count': response.get('results_count', 0)
-        }
-        self.conversations[user_id].append(entry)
+        turn = TurnRecord(query, response)
+        history = self.conversations.get(user_id)
+        if history is None:
+            history = deque(maxlen=self.max_history)
+            self.conversations.set(user_id, history)
+        if len(history) == self.max_history:
+            self.estimated_bytes -= history[0].size
+        history.append(turn)
+        self.estimated_bytes += turn.size
         
         # Track successful patterns
-        if entry['success'] and entry['sql_query']:
-            pattern_key = f"{entry['intent']}_{json.dumps(entry['entities'], sort_keys=True)}"
-            self.successful_patterns[pattern_key].append(entry['sql_query'])
+        if turn.success and turn.sql_query:
+            pattern_key = f"{turn.intent}_{json.dumps(turn.entities, sort_keys=True, default=str)}"
+            queries = self.successful_patterns.get(pattern_key)
+            if queries is None:
+                queries = deque(maxlen=self.max_sql_per_pattern)
+                self.successful_patterns[pattern_key] = queries
+                while len(self.successful_patterns) > self.max_patterns:
+                    self.successful_patterns.popitem(last=False)
+            else:
+                self.successful_patterns.move_to_end(pattern_key)
+            queries.append(turn.sql_query)
     
     def get_context(self, user_id: str, current_query: str) -> Dict[str, Any]:
         """ดึง context จากประวัติ"""
-        recent = list(self.conversations[user_id])[-5:]
+        history = self.conversations.get(user_id) or ()
+        recent = list(history)[-5:]
         
         context = {
-            'conversation_count': len(self.conversations[user_id]),
-            'recent_queries': [c['query'] for c in recent],
-            'recent_intents': [c['intent'] for c in recent],
+            'conversation_count': len(history),
+            'recent_queries': [c.query for c in recent],
+            'recent_intents': [c.intent for c in recent],
             'recent_entities': self._merge_recent_entities(recent),
             'has_history': len(recent) > 0
         }
         
         return context
     
-    def _merge_recent_entities(self, conversations: List[Dict]) -> Dict:
+    def get_history(self, user_id: str, limit: int = 20) -> Tuple[List[Dict], int]:
+        """(last `limit` entries oldest first, total stored)"""
+        history = self.conversations.get(user_id) or ()
+        entries = list(history)[-limit:] if limit > 0 else []
+        return [turn.to_dict() for turn in entries], len(history)
+    
+    def clear_user(self, user_id: str) -> bool:
+        return bool(self.conversations.pop(user_id))
+    
+    def _release_history(self, user_id: str, history: deque):
+        self.estimated_bytes -= sum(turn.size for turn in history)
+    
+    def _merge_recent_entities(self, conversations: List[TurnRecord]) -> Dict:
         """รวม entities จากบทสนทนาล่าสุด"""
         merged = defaultdict(set)
         for conv in conversations:
-            for key, value in conv.get('entities', {}).items():
+            for key, value in conv.entities.items():
                 if isinstance(value, list):
                     merged[key].update(value)
                 else:
                     merged[key].add(value)
         return {k: list(v) for k, v in merged.items()}
+    
+    def get_stats(self) -> Dict[str, Any]:
+        self.conversations.prune()
+        return {
+            'users': len(self.conversations),
+            'turns': sum(len(history) for history in self.conversations.values()),
+            'patterns': len(self.successful_patterns),
+            'estimated_bytes': self.estimated_bytes,
+            'evictions': dict(self.conversations.evictions)
+        }
+
+class ConversationMemoryCollector:
+    """
+    Prometheus collector for in-process per-user state: the fallback
+    conversation memory (when Redis is unavailable) and the orchestrator's
+    conversation states
+    """
+
+    def __init__(self, memory: Optional[ConversationMemory] = None,
+                 states: Optional[BoundedStateStore] = None):
+        self.memory = memory
+        self.states = states
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+        evictions = CounterMetricFamily('chatbot_memory_evictions', 'Per-user state evicted from memory',
+                                        labels=['store', 'reason'])
+        if self.memory is not None:
+            stats = self.memory.get_stats()
+            yield GaugeMetricFamily('chatbot_memory_users', 'Users held in in-process conversation memory',
+                                    value=stats['users'])
+            yield GaugeMetricFamily('chatbot_memory_turns', 'Turns held in in-process conversation memory',
+                                    value=stats['turns'])
+            yield GaugeMetricFamily('chatbot_memory_patterns', 'Successful SQL patterns held in memory',
+                                    value=stats['patterns'])
+            yield GaugeMetricFamily('chatbot_memory_estimated_bytes',
+                                    'Estimated size of in-process conversation memory',
+                                    value=stats['estimated_bytes'])
+            for reason, count in stats['evictions'].items():
+                evictions.add_metric(['conversations', reason], count)
+        if self.states is not None:
+            self.states.prune()
+            yield GaugeMetricFamily('chatbot_conversation_states', 'Users with cursor/snapshot state in memory',
+                                    value=len(self.states))
+            for reason, count in self.states.evictions.items():
+                evictions.add_metric(['conversation_states', reason], count)
+        yield evictions
+
+    def describe(self):
+        # Empty describe avoids a collect() call at registration time
+        return []
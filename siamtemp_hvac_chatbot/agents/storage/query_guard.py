@@ -0,0 +1,266 @@
+# agents/storage/query_guard.py
+"""
+EXPLAIN-based cost guard for LLM-generated SQL
+Plans each query once per fingerprint and rejects or rewrites runaway
+queries before they hold a connection until statement_timeout
+"""
+
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Tuple
+
+from ..sql.fingerprint import fingerprint_sql
+from ..sql.clauses import top_level_limit, strip_trailing_semicolon
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+@dataclass
+class CostThresholds:
+    """Admission limits for a tenant"""
+    max_cost: float = float(os.getenv('QUERY_MAX_COST', '5000000'))
+    max_rows: int = int(os.getenv('QUERY_MAX_ROWS', '200000'))
+    rewrite_limit: int = int(os.getenv('QUERY_REWRITE_LIMIT', '1000'))
+
+def _load_tenant_thresholds() -> Dict[str, CostThresholds]:
+    """Per-tenant overrides from QUERY_COST_LIMITS (JSON: {"company-b": {"max_cost": 1e6}})"""
+    raw = os.getenv('QUERY_COST_LIMITS', '')
+    if not raw:
+        return {}
+    try:
+        return {
+            tenant: CostThresholds(**limits)
+            for tenant, limits in json.loads(raw).items()
+        }
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid QUERY_COST_LIMITS: {e}")
+        return {}
+
+class QueryCostExceededError(Exception):
+    """Raised when a query's estimated cost is over the tenant threshold"""
+
+    def __init__(self, message: str, estimate: 'PlanEstimate'):
+        super().__init__(message)
+        self.estimate = estimate
+
+# =============================================================================
+# PLAN CACHE ENTRY
+# =============================================================================
+
+@dataclass
+class PlanEstimate:
+    """
+    Planner estimate for one SQL fingerprint (tenant independent - admission
+    decisions are made per call against the caller's thresholds)
+    """
+    fingerprint: str
+    total_cost: float
+    plan_rows: int
+    node_type: str = ''
+    planned_at: float = field(default_factory=time.time)
+    hits: int = 0
+    executions: int = 0
+    last_actual_rows: Optional[int] = None
+    # Planned cost of the query wrapped in LIMIT n, per n (None: EXPLAIN failed)
+    rewrite_costs: Dict[int, Optional[float]] = field(default_factory=dict)
+    rewrites: int = 0
+    rejections: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'total_cost': self.total_cost,
+            'estimated_rows': self.plan_rows,
+            'actual_rows': self.last_actual_rows,
+            'node_type': self.node_type,
+            'hits': self.hits,
+            'executions': self.executions,
+            'rewrites': self.rewrites,
+            'rejections': self.rejections
+        }
+
+# =============================================================================
+# COST GUARD
+# =============================================================================
+
+class QueryCostGuard:
+    """
+    Cost-based admission stage
+    - EXPLAIN once per fingerprint (cached with TTL, LRU bounded)
+    - Over the row threshold: wrap in a LIMIT and re-plan
+    - Over the cost threshold: reject without executing
+    - Track estimated vs actual rows
+    """
+
+    def __init__(self, default_thresholds: Optional[CostThresholds] = None,
+                 tenant_thresholds: Optional[Dict[str, CostThresholds]] = None,
+                 max_plans: int = 500, plan_ttl: int = 600):
+        self.default_thresholds = default_thresholds or CostThresholds()
+        self.tenant_thresholds = tenant_thresholds if tenant_thresholds is not None else _load_tenant_thresholds()
+        self.max_plans = max_plans
+        self.plan_ttl = plan_ttl
+        self.plans: 'OrderedDict[str, PlanEstimate]' = OrderedDict()
+        self.stats = {
+            'planned': 0,
+            'cache_hits': 0,
+            'rewritten': 0,
+            'rejected': 0,
+            'explain_failures': 0
+        }
+
+    def thresholds_for(self, tenant_id: Optional[str]) -> CostThresholds:
+        """Get thresholds for a tenant (falls back to defaults)"""
+        return self.tenant_thresholds.get(tenant_id, self.default_thresholds)
+
+    # =========================================================================
+    # ADMISSION
+    # =========================================================================
+
+    def admit(self, cursor, sql: str, tenant_id: Optional[str] = None,
+              params: Optional[tuple] = None) -> Tuple[str, Optional[PlanEstimate]]:
+        """
+        Decide whether sql may run
+        Returns (sql_to_execute, estimate); raises QueryCostExceededError
+        """
+        estimate = self._get_estimate(cursor, sql, params)
+        if estimate is None:
+            # Planner failed - let execution surface the real error
+            return sql, None
+
+        limits = self.thresholds_for(tenant_id)
+
+        if estimate.total_cost <= limits.max_cost and estimate.plan_rows <= limits.max_rows:
+            return sql, estimate
+
+        # Too many rows but cost is acceptable or reducible → try this tenant's LIMIT
+        rewritten = self._rewrite_with_limit(sql, limits.rewrite_limit)
+        if rewritten:
+            if limits.rewrite_limit not in estimate.rewrite_costs:
+                rewritten_estimate = self._explain(cursor, rewritten, params)
+                estimate.rewrite_costs[limits.rewrite_limit] = (
+                    rewritten_estimate.total_cost if rewritten_estimate else None
+                )
+                logger.warning(
+                    f"Cost guard rewrites query {estimate.fingerprint}: "
+                    f"rows {estimate.plan_rows:,} → LIMIT {limits.rewrite_limit}"
+                )
+            rewritten_cost = estimate.rewrite_costs[limits.rewrite_limit]
+            if rewritten_cost is not None and rewritten_cost <= limits.max_cost:
+                estimate.rewrites += 1
+                self.stats['rewritten'] += 1
+                return rewritten, estimate
+
+        estimate.rejections += 1
+        raise self._rejection(estimate, limits)
+
+    def record_actual(self, estimate: Optional[PlanEstimate], actual_rows: int):
+        """Record actual row count next to the planner estimate"""
+        if estimate is None:
+            return
+        estimate.executions += 1
+        estimate.last_actual_rows = actual_rows
+
+        expected = max(estimate.plan_rows, 1)
+        # A result that reached a rewrite LIMIT says nothing about the estimate
+        capped = any(actual_rows >= limit for limit in estimate.rewrite_costs)
+        if not capped and (actual_rows > expected * 10 or expected > max(actual_rows, 1) * 10):
+            logger.info(
+                f"Row estimate off for {estimate.fingerprint}: "
+                f"estimated {estimate.plan_rows:,}, actual {actual_rows:,}"
+            )
+
+    # =========================================================================
+    # PLANNING
+    # =========================================================================
+
+    def _get_estimate(self, cursor, sql: str, params: Optional[tuple]) -> Optional[PlanEstimate]:
+        """Cached estimate for the fingerprint, planning on miss"""
+        fingerprint = fingerprint_sql(sql)
+        cached = self.plans.get(fingerprint)
+
+        if cached and time.time() - cached.planned_at < self.plan_ttl:
+            cached.hits += 1
+            self.plans.move_to_end(fingerprint)
+            self.stats['cache_hits'] += 1
+            return cached
+
+        estimate = self._explain(cursor, sql, params)
+        if estimate is None:
+            return None
+
+        self.plans[fingerprint] = estimate
+        self.plans.move_to_end(fingerprint)
+        while len(self.plans) > self.max_plans:
+            self.plans.popitem(last=False)
+        return estimate
+
+    def _explain(self, cursor, sql: str, params: Optional[tuple]) -> Optional[PlanEstimate]:
+        """Run EXPLAIN (no ANALYZE) and extract the top node estimates"""
+        try:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {strip_trailing_semicolon(sql)}", params)
+            row = cursor.fetchone()
+            self.stats['planned'] += 1
+        except Exception as e:
+            # A failed EXPLAIN aborts the transaction; reset so execution can run
+            self.stats['explain_failures'] += 1
+            logger.debug(f"Could not get query plan: {e}")
+            cursor.connection.rollback()
+            return None
+
+        plan_json = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+        if isinstance(plan_json, str):
+            plan_json = json.loads(plan_json)
+        plan = plan_json[0]['Plan']
+
+        logger.debug(f"Query plan: {json.dumps(plan)[:500]}")
+
+        return PlanEstimate(
+            fingerprint=fingerprint_sql(sql),
+            total_cost=float(plan.get('Total Cost', 0)),
+            plan_rows=int(plan.get('Plan Rows', 0)),
+            node_type=plan.get('Node Type', '')
+        )
+
+    # =========================================================================
+    # REWRITING
+    # =========================================================================
+
+    def _rewrite_with_limit(self, sql: str, limit: int) -> Optional[str]:
+        """Cap the outermost result at limit rows (None if already capped lower)"""
+        existing = top_level_limit(sql)
+        if existing and existing[0] <= limit:
+            return None
+        return f"SELECT * FROM (\n{strip_trailing_semicolon(sql)}\n) AS cost_guarded LIMIT {limit};"
+
+    def _rejection(self, estimate: PlanEstimate, limits: CostThresholds) -> QueryCostExceededError:
+        self.stats['rejected'] += 1
+        logger.warning(
+            f"Cost guard rejected query {estimate.fingerprint}: "
+            f"cost {estimate.total_cost:,.0f} (max {limits.max_cost:,.0f}), "
+            f"rows {estimate.plan_rows:,} (max {limits.max_rows:,})"
+        )
+        return QueryCostExceededError(
+            f"Query too expensive: estimated cost {estimate.total_cost:,.0f}, "
+            f"estimated rows {estimate.plan_rows:,}",
+            estimate
+        )
+
+    # =========================================================================
+    # STATISTICS
+    # =========================================================================
+
+    def get_stats(self, limit: int = 10) -> Dict[str, Any]:
+        """Guard counters plus the most expensive cached plans"""
+        top_plans = sorted(self.plans.values(), key=lambda p: p.total_cost, reverse=True)[:limit]
+        return {
+            **self.stats,
+            'cached_plans': len(self.plans),
+            'most_expensive': [p.to_dict() for p in top_plans]
+        }
@@ -0,0 +1,229 @@
+# agents/storage/query_stats.py
+"""
+Application-side pg_stat_statements
+Per-fingerprint latency / row-count histograms with bounded memory
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+from ..sql.fingerprint import fingerprint_sql, normalize_sql
+
+logger = logging.getLogger(__name__)
+
+# Prometheus bucket boundaries used when exporting
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+# =============================================================================
+# HDR-STYLE HISTOGRAM
+# =============================================================================
+
+class LogLinearHistogram:
+    """
+    HDR-style histogram: 2^sub_bucket_bits linear buckets per power of two
+    Relative error ~ 1/2^sub_bucket_bits, memory bounded by value range
+    """
+    __slots__ = ('sub_bucket_bits', 'unit', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, sub_bucket_bits: int = 4, unit: float = 1.0):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.unit = unit
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _width(self, units: int) -> int:
+        """Bucket width (integer units) for a value of this magnitude"""
+        return 1 << max(units.bit_length() - (self.sub_bucket_bits + 1), 0)
+
+    def record(self, value: float):
+        units = max(int(value / self.unit), 0)
+        width = self._width(units)
+        lower = units - units % width
+        self.counts[lower] = self.counts.get(lower, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def buckets(self) -> Iterable[Tuple[float, float, int]]:
+        """Yield (lower, upper, count) in value units, ascending"""
+        for lower in sorted(self.counts):
+            yield lower * self.unit, (lower + self._width(lower)) * self.unit, self.counts[lower]
+
+    def percentile(self, p: float) -> float:
+        """Approximate percentile (0-100), bucket midpoint"""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for lower, upper, count in self.buckets():
+            seen += count
+            if seen >= target:
+                return min((lower + upper) / 2, self.max)
+        return self.max
+
+    def cumulative(self, bounds: Iterable[float]) -> List[Tuple[str, int]]:
+        """Prometheus-style cumulative buckets (assigned by bucket midpoint)"""
+        ordered = list(self.buckets())
+        result = []
+        for bound in bounds:
+            total = sum(c for lower, upper, c in ordered if (lower + upper) / 2 <= bound)
+            result.append((str(bound), total))
+        result.append(('+Inf', self.count))
+        return result
+
+# =============================================================================
+# PER-FINGERPRINT ENTRY
+# =============================================================================
+
+class FingerprintStats:
+    """Statistics for one SQL fingerprint"""
+    __slots__ = ('fingerprint', 'query', 'calls', 'errors', 'total_time',
+                 'latency', 'rows', 'first_seen', 'last_seen')
+
+    def __init__(self, fingerprint: str, query: str):
+        self.fingerprint = fingerprint
+        self.query = query
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.latency = LogLinearHistogram(unit=1e-6)  # microsecond resolution
+        self.rows = LogLinearHistogram(unit=1)
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'query': self.query,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': round(self.total_time, 4),
+            'mean_time': round(self.total_time / self.calls, 4) if self.calls else 0,
+            'p50_time': round(self.latency.percentile(50), 4),
+            'p95_time': round(self.latency.percentile(95), 4),
+            'p99_time': round(self.latency.percentile(99), 4),
+            'max_time': round(self.latency.max or 0, 4),
+            'mean_rows': round(self.rows.total / self.rows.count, 1) if self.rows.count else 0,
+            'p95_rows': int(self.rows.percentile(95)),
+            'last_seen': self.last_seen
+        }
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+class QueryStatsRegistry:
+    """
+    Bounded map fingerprint -> FingerprintStats
+    Least recently seen fingerprints are evicted past max_fingerprints
+    """
+
+    ORDER_FIELDS = {'total_time', 'calls', 'mean_time', 'p95_time', 'p99_time', 'errors', 'mean_rows'}
+
+    def __init__(self, max_fingerprints: Optional[int] = None):
+        self.max_fingerprints = max_fingerprints or int(os.getenv('QUERY_STATS_MAX_FINGERPRINTS', '500'))
+        self.entries: 'OrderedDict[str, FingerprintStats]' = OrderedDict()
+        self.evicted = 0
+
+    def _entry(self, sql: str) -> FingerprintStats:
+        fingerprint = fingerprint_sql(sql)
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            entry = FingerprintStats(fingerprint, normalize_sql(sql)[:300])
+            self.entries[fingerprint] = entry
+            while len(self.entries) > self.max_fingerprints:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.entries.move_to_end(fingerprint)
+        return entry
+
+    def record(self, sql: str, elapsed: float, row_count: int):
+        """Record a successful execution"""
+        entry = self._entry(sql)
+        entry.calls += 1
+        entry.total_time += elapsed
+        entry.latency.record(elapsed)
+        entry.rows.record(row_count)
+        entry.last_seen = time.time()
+
+    def record_error(self, sql: str):
+        """Record a failed execution"""
+        entry = self._entry(sql)
+        entry.errors += 1
+        entry.last_seen = time.time()
+
+    def top(self, limit: int = 10, order_by: str = 'total_time') -> List[Dict[str, Any]]:
+        """Top fingerprints ordered by a to_dict field"""
+        if order_by not in self.ORDER_FIELDS:
+            order_by = 'total_time'
+        rows = [e.to_dict() for e in self.entries.values()]
+        return sorted(rows, key=lambda r: r[order_by], reverse=True)[:limit]
+
+    def summary(self) -> Dict[str, Any]:
+        calls = sum(e.calls for e in self.entries.values())
+        return {
+            'total_queries': calls,
+            'total_errors': sum(e.errors for e in self.entries.values()),
+            'unique_queries': len(self.entries),
+            'evicted_fingerprints': self.evicted,
+            'total_time': round(sum(e.total_time for e in self.entries.values()), 4)
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.evicted = 0
+
+# =============================================================================
+# PROMETHEUS EXPORT
+# =============================================================================
+
+class QueryStatsCollector:
+    """
+    Custom Prometheus collector - label sets follow the bounded registry,
+    so evicted fingerprints disappear from /metrics instead of piling up
+    """
+
+    def __init__(self, registry: QueryStatsRegistry):
+        self.registry = registry
+
+    def collect(self):
+        from prometheus_client.core import HistogramMetricFamily, CounterMetricFamily
+
+        latency = HistogramMetricFamily(
+            'chatbot_db_query_duration_seconds',
+            'Query latency per SQL fingerprint',
+            labels=['fingerprint']
+        )
+        rows = HistogramMetricFamily(
+            'chatbot_db_query_rows',
+            'Rows returned per SQL fingerprint',
+            labels=['fingerprint']
+        )
+        errors = CounterMetricFamily(
+            'chatbot_db_query_errors',
+            'Failed executions per SQL fingerprint',
+            labels=['fingerprint']
+        )
+
+        for entry in list(self.registry.entries.values()):
+            labels = [entry.fingerprint]
+            latency.add_metric(labels, entry.latency.cumulative(LATENCY_BUCKETS), entry.latency.total)
+            rows.add_metric(labels, entry.rows.cumulative(ROW_BUCKETS), entry.rows.total)
+            errors.add_metric(labels, entry.errors)
+
+        yield latency
+        yield rows
+        yield errors
+
+    def describe(self):
+        # Empty describe avoids a collect() call at registration time
+        return []
@@ -2,18 +2,26 @@
 """
 Redis-based conversation memory for scalability
 Data persists across restarts and can be shared across instances
+All storage paths use redis.asyncio on one shared pool per worker;
+SyncRedisWrapper is a thin blocking facade for scripts
 """
 
 import json
 import os
-import redis
-import pickle
+import time
+import uuid
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta , time
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime
+from dataclasses import dataclass, field
+from collections import deque
 import asyncio
 
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from .memory import BoundedStateStore
+
 logger = logging.getLogger(__name__)
 
 # =============================================================================
@@ -23,15 +31,61 @@ logger = logging.getLogger(__name__)
 @dataclass
 class RedisConfig:
     """Redis configuration"""
-    host: str = os.getenv('REDIS_HOST', 'redis') 
-    port: int = int(os.getenv('REDIS_PORT', '6379'))
-    port: int = 6379
+    host: str = field(default_factory=lambda: os.getenv('REDIS_HOST', 'redis'))
+    port: int = field(default_factory=lambda: int(os.getenv('REDIS_PORT', '6379')))
     db: int = 0
-    password: Optional[str] = None
+    password: Optional[str] = field(default_factory=lambda: os.getenv('REDIS_PASSWORD') or None)
     decode_responses: bool = False
-    max_connections: int = 50
-    socket_timeout: int = 5
-    connection_pool_class: str = "redis.BlockingConnectionPool"
+    # One connection per concurrent request the worker may serve
+    max_connections: int = field(default_factory=lambda: int(
+        os.getenv('REDIS_MAX_CONNECTIONS', os.getenv('WORKER_CONCURRENCY', '64'))
+    ))
+    socket_timeout: float = 5
+    pool_timeout: float = 2   # wait for a free connection before failing
+
+# =============================================================================
+# SHARED CONNECTION POOL
+# =============================================================================
+
+_pools: Dict[Tuple, aioredis.BlockingConnectionPool] = {}
+
+def get_async_pool(config: RedisConfig) -> aioredis.BlockingConnectionPool:
+    """Pool shared by every store in this worker (one per host/port/db)"""
+    key = (config.host, config.port, config.db, config.decode_responses)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = aioredis.BlockingConnectionPool(
+            host=config.host,
+            port=config.port,
+            db=config.db,
+            password=config.password,
+            max_connections=config.max_connections,
+            timeout=config.pool_timeout,
+            socket_timeout=config.socket_timeout,
+            decode_responses=config.decode_responses
+        )
+        _pools[key] = pool
+    return pool
+
+async def close_async_pools():
+    """Disconnect all shared pools (service shutdown)"""
+    for pool in list(_pools.values()):
+        await pool.disconnect()
+    _pools.clear()
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+async def pubsub_messages(pubsub, poll_seconds: float = 1.0):
+    """
+    Published messages of a subscribed PubSub
+    Polls with a short timeout: listen() blocks on a read that hits the
+    pool's socket_timeout whenever the channel is idle
+    """
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=poll_seconds)
+        if message is not None and message.get('type') == 'message':
+            yield message
 
 # =============================================================================
 # REDIS-BASED CONVERSATION MEMORY
@@ -46,100 +100,116 @@ class ScalableConversationMemory:
     - TTL for automatic cleanup
     - Supports clustering
     """
-    
-    def __init__(self, config: Optional[RedisConfig] = None):
+
+    def __init__(self, config: Optional[RedisConfig] = None,
+                 redis_client: Optional[aioredis.Redis] = None):
         self.config = config or RedisConfig()
-        self.redis_client = self._create_redis_client()
+        self.redis_client = redis_client or self._create_redis_client()
         self.ttl_seconds = 86400 * 7  # 7 days default TTL
-        
+        self.max_history = 100        # entries kept per user
+        self.context_size = 5         # entries read for context
+        self.max_patterns = 1000      # top patterns kept per intent
+        self.active_window_seconds = int(os.getenv('ACTIVE_USER_WINDOW', '900'))
+
         logger.info("✅ Scalable Redis memory initialized")
-    
-    def _create_redis_client(self) -> redis.Redis:
-        """Create Redis client with connection pooling"""
-        pool = redis.ConnectionPool(
-            host=self.config.host,
-            port=self.config.port,
-            db=self.config.db,
-            password=self.config.password,
-            max_connections=self.config.max_connections,
-            socket_timeout=self.config.socket_timeout,
-            decode_responses=self.config.decode_responses
-        )
-        return redis.Redis(connection_pool=pool)
-    
+
+    def _create_redis_client(self) -> aioredis.Redis:
+        """Async client on the worker's shared pool"""
+        return aioredis.Redis(connection_pool=get_async_pool(self.config))
+
     # =========================================================================
     # CONVERSATION MANAGEMENT
     # =========================================================================
-    
-    def add_conversation(self, user_id: str, query: str, response: Dict[str, Any]):
-        """Add conversation to Redis with TTL"""
+
+    # Indexes (no KEYS scans):
+    #   patterns:{intent} - sorted set, member = entities JSON, score = successes
+    #   active_users      - sorted set, member = user_id, score = last seen (unix time)
+    ACTIVE_USERS_KEY = "active_users"
+
+    def _history_key(self, user_id: str) -> str:
+        return f"conv_history:{user_id}"
+
+    def _patterns_key(self, intent: str) -> str:
+        return f"patterns:{intent}"
+
+    @staticmethod
+    def build_entry(query: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """History entry as stored in conv_history"""
+        return {
+            'id': uuid.uuid4().hex[:16],   # de-duplicates L1 merges (TwoTierConversationMemory)
+            'timestamp': datetime.now().isoformat(),
+            'query': query,
+            'intent': response.get('intent', 'unknown'),
+            'entities': response.get('entities', {}),
+            'success': response.get('success', False),
+            'processing_time': response.get('processing_time', 0)
+        }
+
+    async def add_conversation(self, user_id: str, query: str, response: Dict[str, Any]):
+        """
+        Append to the user's capped history in one MULTI/EXEC round trip
+        Layout: conv_history:{user_id} = list of JSON entries, newest first
+        """
         try:
-            # Create conversation entry
-            entry = {
-                'timestamp': datetime.now().isoformat(),
-                'query': query,
-                'intent': response.get('intent', 'unknown'),
-                'entities': response.get('entities', {}),
-                'success': response.get('success', False),
-                'processing_time': response.get('processing_time', 0)
-            }
-            
-            # Key pattern: conv:user_id:timestamp
-            key = f"conv:{user_id}:{datetime.now().timestamp()}"
-            
-            # Store in Redis with TTL
-            self.redis_client.setex(
-                key,
-                self.ttl_seconds,
-                json.dumps(entry)
-            )
-            
-            # Add to user's conversation list
-            list_key = f"conv_list:{user_id}"
-            self.redis_client.lpush(list_key, key)
-            self.redis_client.ltrim(list_key, 0, 99)  # Keep last 100
-            self.redis_client.expire(list_key, self.ttl_seconds)
-            
-            # Update successful patterns
-            if entry['success']:
-                self._update_successful_pattern(entry['intent'], entry['entities'])
-            
+            await self.add_entries([(user_id, self.build_entry(query, response))])
             logger.debug(f"Conversation added for user {user_id}")
-            
+
         except Exception as e:
             logger.error(f"Failed to add conversation: {e}")
-    
-    def get_context(self, user_id: str, current_query: str) -> Dict[str, Any]:
-        """Get conversation context from Redis"""
+
+    async def add_entries(self, entries: List[Tuple[str, Dict[str, Any]]]):
+        """Write a batch of (user_id, entry) in one MULTI/EXEC (raises on Redis errors)"""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            for user_id, entry in entries:
+                list_key = self._history_key(user_id)
+                pipe.lpush(list_key, json.dumps(entry, ensure_ascii=False, default=str))
+                pipe.ltrim(list_key, 0, self.max_history - 1)
+                pipe.expire(list_key, self.ttl_seconds)
+                self._queue_activity_update(pipe, user_id)
+
+                # Update successful patterns in the same transaction
+                if entry['success']:
+                    self._queue_pattern_update(pipe, entry['intent'], entry['entities'])
+
+            await pipe.execute()
+
+    async def get_recent(self, user_id: str) -> Tuple[List[Dict], int]:
+        """(last context_size entries newest first, total stored) in one round trip"""
+        list_key = self._history_key(user_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(list_key, 0, self.context_size - 1)
+            pipe.llen(list_key)
+            raw_entries, conversation_count = await pipe.execute()
+        return [json.loads(raw) for raw in raw_entries], conversation_count
+
+    def build_context(self, recent: List[Dict], conversation_count: int) -> Dict[str, Any]:
+        """Context dict from recent entries (newest first)"""
+        return {
+            'conversation_count': conversation_count,
+            'recent_queries': [c['query'] for c in recent],
+            'recent_intents': [c['intent'] for c in recent],
+            'recent_entities': self._merge_entities(recent),
+            'has_history': len(recent) > 0
+        }
+
+    async def get_context(self, user_id: str, current_query: str) -> Dict[str, Any]:
+        """Get conversation context in one pipelined round trip"""
         try:
-            list_key = f"conv_list:{user_id}"
-            conversation_keys = self.redis_client.lrange(list_key, 0, 4)  # Last 5
-            
-            recent = []
-            for key in conversation_keys:
-                if isinstance(key, bytes):
-                    key = key.decode('utf-8')
-                    
-                conv_data = self.redis_client.get(key)
-                if conv_data:
-                    if isinstance(conv_data, bytes):
-                        conv_data = conv_data.decode('utf-8')
-                    recent.append(json.loads(conv_data))
-            
-            context = {
-                'conversation_count': self.redis_client.llen(list_key),
-                'recent_queries': [c['query'] for c in recent],
-                'recent_intents': [c['intent'] for c in recent],
-                'recent_entities': self._merge_entities(recent),
-                'has_history': len(recent) > 0
-            }
-            
-            return context
-            
+            return self.build_context(*await self.get_recent(user_id))
+
         except Exception as e:
             logger.error(f"Failed to get context: {e}")
             return {'conversation_count': 0, 'has_history': False}
-    
+
+    async def get_history(self, user_id: str, limit: int = 20) -> Tuple[List[Dict], int]:
+        """(last `limit` entries oldest first, total stored)"""
+        list_key = self._history_key(user_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(list_key, 0, max(limit, 1) - 1)
+            pipe.llen(list_key)
+            raw_entries, total = await pipe.execute()
+        return [json.loads(raw) for raw in reversed(raw_entries)], total
+
     def _merge_entities(self, conversations: List[Dict]) -> Dict:
         """Merge entities from recent conversations"""
         merged = {}
@@ -151,74 +221,72 @@ class ScalableConversationMemory:
                     merged[key].update(value)
                 else:
                     merged[key].add(value)
-        
+
         return {k: list(v) for k, v in merged.items()}
-    
-    def _update_successful_pattern(self, intent: str, entities: Dict):
-        """Track successful query patterns"""
-        try:
-            pattern_key = f"pattern:{intent}:{json.dumps(entities, sort_keys=True)}"
-            self.redis_client.incr(f"pattern_count:{pattern_key}")
-            self.redis_client.expire(f"pattern_count:{pattern_key}", self.ttl_seconds)
-        except Exception as e:
-            logger.error(f"Failed to update pattern: {e}")
-    
-    def get_successful_patterns(self, intent: str, limit: int = 5) -> List[Dict]:
-        """Get top successful patterns for an intent"""
+
+    def _queue_pattern_update(self, pipe, intent: str, entities: Dict):
+        """Track successful query patterns (queued on the caller's pipeline)"""
+        patterns_key = self._patterns_key(intent)
+        pipe.zincrby(patterns_key, 1, json.dumps(entities, sort_keys=True, ensure_ascii=False, default=str))
+        # Keep the top max_patterns only - O(log N) per write, bounded memory
+        pipe.zremrangebyrank(patterns_key, 0, -self.max_patterns - 1)
+        pipe.expire(patterns_key, self.ttl_seconds)
+
+    async def get_successful_patterns(self, intent: str, limit: int = 5) -> List[Dict]:
+        """Top successful patterns for an intent - one ZREVRANGE, O(log N + limit)"""
         try:
-            pattern = f"pattern_count:pattern:{intent}:*"
-            keys = self.redis_client.keys(pattern)
-            
-            patterns = []
-            for key in keys[:limit]:
-                if isinstance(key, bytes):
-                    key = key.decode('utf-8')
-                count = self.redis_client.get(key)
-                if count:
-                    patterns.append({
-                        'pattern': key,
-                        'count': int(count)
-                    })
-            
-            return sorted(patterns, key=lambda x: x['count'], reverse=True)
-            
+            top = await self.redis_client.zrevrange(
+                self._patterns_key(intent), 0, limit - 1, withscores=True
+            )
+            return [
+                {
+                    'pattern': f"pattern:{intent}:{_text(member)}",
+                    'entities': json.loads(member),
+                    'count': int(score)
+                }
+                for member, score in top
+            ]
+
         except Exception as e:
             logger.error(f"Failed to get patterns: {e}")
             return []
-    
+
     # =========================================================================
     # USER SESSION MANAGEMENT
     # =========================================================================
-    
-    def get_active_users(self) -> int:
-        """Get count of active users"""
+
+    def _queue_activity_update(self, pipe, user_id: str):
+        """Record the user as seen now and drop users idle longer than the history TTL"""
+        now = time.time()
+        pipe.zadd(self.ACTIVE_USERS_KEY, {user_id: now})
+        pipe.zremrangebyscore(self.ACTIVE_USERS_KEY, '-inf', now - self.ttl_seconds)
+
+    async def get_active_users(self, window_seconds: Optional[int] = None) -> int:
+        """Users seen within the window (default ACTIVE_USER_WINDOW) - one ZCOUNT, O(log N)"""
         try:
-            pattern = "conv_list:*"
-            return len(self.redis_client.keys(pattern))
+            window = window_seconds or self.active_window_seconds
+            return await self.redis_client.zcount(self.ACTIVE_USERS_KEY, time.time() - window, '+inf')
         except Exception as e:
             logger.error(f"Failed to get active users: {e}")
             return 0
-    
-    def clear_user_history(self, user_id: str):
-        """Clear user's conversation history"""
+
+    async def clear_user_history(self, user_id: str) -> bool:
+        """Clear user's conversation history (True if anything was deleted)"""
         try:
-            # Get all conversation keys
-            list_key = f"conv_list:{user_id}"
-            conversation_keys = self.redis_client.lrange(list_key, 0, -1)
-            
-            # Delete each conversation
-            for key in conversation_keys:
-                if isinstance(key, bytes):
-                    key = key.decode('utf-8')
-                self.redis_client.delete(key)
-            
-            # Delete the list
-            self.redis_client.delete(list_key)
-            
+            # Entries written before the single-list layout live under conv_list + conv:* keys
+            legacy_list = f"conv_list:{user_id}"
+            legacy_keys = await self.redis_client.lrange(legacy_list, 0, -1)
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(self._history_key(user_id), legacy_list, *legacy_keys)
+                pipe.zrem(self.ACTIVE_USERS_KEY, user_id)
+                deleted, _ = await pipe.execute()
+
             logger.info(f"Cleared history for user {user_id}")
-            
+            return deleted > 0
+
         except Exception as e:
             logger.error(f"Failed to clear history: {e}")
+            return False
 
 # =============================================================================
 # SQL CACHE WITH REDIS
@@ -229,60 +297,51 @@ class ScalableSQLCache:
     Redis-based SQL cache for query optimization
     Shared across all instances
     """
-    
-    def __init__(self, redis_client: Optional[redis.Redis] = None):
+
+    def __init__(self, redis_client: Optional[aioredis.Redis] = None):
         self.redis_client = redis_client or self._create_default_client()
         self.cache_ttl = 3600  # 1 hour default
         self.stats_key = "sql_cache:stats"
-        
-    def _create_default_client(self) -> redis.Redis:
+
+    def _create_default_client(self) -> aioredis.Redis:
         """Create default Redis client"""
-        return redis.Redis(host='localhost', port=6379, db=1)
-    
-    def get_cached_result(self, sql_hash: str) -> Optional[List[Dict]]:
+        return aioredis.Redis(connection_pool=get_async_pool(RedisConfig(db=1)))
+
+    async def get_cached_result(self, sql_hash: str) -> Optional[List[Dict]]:
         """Get cached SQL result"""
         try:
             cache_key = f"sql_cache:{sql_hash}"
-            cached = self.redis_client.get(cache_key)
-            
-            if cached:
-                # Update hit counter
-                self.redis_client.hincrby(self.stats_key, "hits", 1)
-                
-                # Deserialize result
-                if isinstance(cached, bytes):
-                    cached = cached.decode('utf-8')
-                return json.loads(cached)
-            else:
-                # Update miss counter
-                self.redis_client.hincrby(self.stats_key, "misses", 1)
-                return None
-                
+            cached = await self.redis_client.get(cache_key)
+
+            # Update hit/miss counter
+            await self.redis_client.hincrby(self.stats_key, "hits" if cached else "misses", 1)
+            return json.loads(cached) if cached else None
+
         except Exception as e:
             logger.error(f"Cache get failed: {e}")
             return None
-    
-    def cache_result(self, sql_hash: str, results: List[Dict]):
+
+    async def cache_result(self, sql_hash: str, results: List[Dict]):
         """Cache SQL result with TTL"""
         try:
             cache_key = f"sql_cache:{sql_hash}"
             serialized = json.dumps(results, default=str)
-            
-            self.redis_client.setex(
+
+            await self.redis_client.setex(
                 cache_key,
                 self.cache_ttl,
                 serialized
             )
-            
+
             logger.debug(f"Cached SQL result: {sql_hash[:8]}...")
-            
+
         except Exception as e:
             logger.error(f"Cache set failed: {e}")
-    
-    def get_cache_stats(self) -> Dict[str, int]:
+
+    async def get_cache_stats(self) -> Dict[str, int]:
         """Get cache statistics"""
         try:
-            stats = self.redis_client.hgetall(self.stats_key)
+            stats = await self.redis_client.hgetall(self.stats_key)
             return {
                 'hits': int(stats.get(b'hits', 0)),
                 'misses': int(stats.get(b'misses', 0)),
@@ -291,7 +350,7 @@ class ScalableSQLCache:
         except Exception as e:
             logger.error(f"Failed to get stats: {e}")
             return {'hits': 0, 'misses': 0, 'hit_rate': 0}
-    
+
     def _calculate_hit_rate(self, stats: Dict) -> float:
         """Calculate cache hit rate"""
         hits = int(stats.get(b'hits', 0))
@@ -306,44 +365,258 @@ class ScalableSQLCache:
 class DistributedLock:
     """
     Redis-based distributed lock for concurrent access control
+    Usage: async with DistributedLock(client, 'key'): ...
+    """
+
+    # Delete only if the caller still owns the lock (atomic on the server)
+    RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
     """
-    
-    def __init__(self, redis_client: redis.Redis, key: str, timeout: int = 10):
+
+    def __init__(self, redis_client: aioredis.Redis, key: str, timeout: int = 10,
+                 wait_timeout: Optional[float] = None):
         self.redis_client = redis_client
         self.key = f"lock:{key}"
-        self.timeout = timeout
+        self.timeout = timeout                    # lock expiry (seconds)
+        self.wait_timeout = timeout if wait_timeout is None else wait_timeout
         self.identifier = None
-    
+
     async def acquire(self) -> bool:
-        """Acquire lock with timeout"""
-        import uuid
-        self.identifier = str(uuid.uuid4())
-        
-        end = time.time() + self.timeout
-        while time.time() < end:
-            if self.redis_client.set(self.key, self.identifier, nx=True, ex=self.timeout):
+        """Acquire lock, backing off between attempts until wait_timeout"""
+        identifier = str(uuid.uuid4())
+        delay = 0.005
+        end = time.monotonic() + self.wait_timeout
+        while True:
+            if await self.redis_client.set(self.key, identifier, nx=True, ex=self.timeout):
+                self.identifier = identifier
                 return True
-            await asyncio.sleep(0.001)
-        
-        return False
-    
-    def release(self):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.2)
+
+    async def release(self) -> bool:
         """Release lock if we own it"""
-        if self.identifier:
-            pipe = self.redis_client.pipeline(True)
-            while True:
+        if not self.identifier:
+            return False
+        released = await self.redis_client.eval(self.RELEASE_SCRIPT, 1, self.key, self.identifier)
+        self.identifier = None
+        return bool(released)
+
+    async def __aenter__(self):
+        if not await self.acquire():
+            raise TimeoutError(f"Could not acquire {self.key}")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+# =============================================================================
+# TWO-TIER MEMORY: LOCAL L1 + WRITE-BEHIND TO REDIS
+# =============================================================================
+
+class _CachedHistory:
+    """L1 copy of one user's recent entries"""
+    __slots__ = ('recent', 'count', 'loaded_at')
+
+    def __init__(self, recent: List[Dict], count: int, size: int):
+        self.recent = deque(reversed(recent), maxlen=size)   # oldest → newest
+        self.count = count
+        self.loaded_at = time.monotonic()
+
+class TwoTierConversationMemory:
+    """
+    Per-worker L1 cache of each user's recent turns in front of Redis
+    - Context reads for cached users never touch Redis
+    - Writes update L1 immediately and are flushed to Redis in batches
+      (one MULTI per batch) every WRITE_BEHIND_INTERVAL_MS, off the request path
+    - After each flush the written user ids are published on
+      conv_invalidate; other workers drop their L1 copies. L1_MAX_AGE bounds
+      staleness if a message is missed
+    """
+
+    INVALIDATE_CHANNEL = "conv_invalidate"
+
+    def __init__(self, store: ScalableConversationMemory):
+        self.store = store
+        self.instance_id = uuid.uuid4().hex
+        self.max_age = float(os.getenv('L1_MAX_AGE', '300'))
+        self.flush_interval = int(os.getenv('WRITE_BEHIND_INTERVAL_MS', '50')) / 1000
+        self.batch_size = int(os.getenv('WRITE_BEHIND_BATCH', '200'))
+        self.max_pending = 10000   # entries kept for retry while Redis is down
+        self.l1 = BoundedStateStore(
+            int(os.getenv('L1_MAX_USERS', '10000')),
+            float(os.getenv('STATE_IDLE_TTL', '86400'))
+        )
+        self._pending: List[Tuple[str, Dict]] = []
+        self._flushing: List[Tuple[str, Dict]] = []
+        self._flush_generation = 0   # completed flushes (a load overlapping one re-reads)
+        self._flush_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {'l1_hits': 0, 'l1_misses': 0, 'flushes': 0, 'entries_flushed': 0,
+                      'flush_failures': 0, 'entries_dropped': 0, 'invalidations': 0}
+
+    def start(self):
+        """Start the flusher and invalidation listener (idempotent, needs a running loop)"""
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._flush_loop()), loop.create_task(self._listen_invalidations())]
+
+    def after_fork(self):
+        """Forked worker: own identity (else workers ignore each other's invalidations)"""
+        self.instance_id = uuid.uuid4().hex
+        self._pending = []
+        self._tasks = []
+
+    # =========================================================================
+    # READ / WRITE
+    # =========================================================================
+
+    def add_conversation(self, user_id: str, query: str, response: Dict[str, Any]):
+        """Record a turn: L1 now, Redis on the next flush"""
+        entry = self.store.build_entry(query, response)
+        cached = self.l1.get(user_id)
+        if cached is not None:
+            cached.recent.append(entry)
+            cached.count = min(cached.count + 1, self.store.max_history)
+        self._pending.append((user_id, entry))
+        self.start()
+        if len(self._pending) >= self.batch_size:
+            asyncio.get_running_loop().create_task(self.flush_pending())
+
+    async def get_context(self, user_id: str, current_query: str) -> Dict[str, Any]:
+        cached = self.l1.get(user_id)
+        if cached is not None and time.monotonic() - cached.loaded_at <= self.max_age:
+            self.stats['l1_hits'] += 1
+        else:
+            self.stats['l1_misses'] += 1
+            cached = await self._load(user_id)
+        return self.store.build_context(list(reversed(cached.recent)), cached.count)
+
+    async def _load(self, user_id: str, attempts: int = 3) -> _CachedHistory:
+        """
+        Fill L1 from Redis, plus turns still waiting to be flushed
+        A flush completing during the read may have moved turns into Redis
+        after they were read, so the read is retried; turns of a flush still
+        in progress may or may not be in the read and are merged by id
+        """
+        for _ in range(attempts):
+            generation = self._flush_generation
+            recent, count = await self.store.get_recent(user_id)
+            if generation == self._flush_generation:
+                break
+        cached = _CachedHistory(recent, count, self.store.context_size)
+        stored = {entry.get('id') for entry in recent if entry.get('id')}
+        for pending_user, entry in self._flushing + self._pending:
+            if pending_user == user_id and entry.get('id') not in stored:
+                cached.recent.append(entry)
+                cached.count = min(cached.count + 1, self.store.max_history)
+        self.l1.set(user_id, cached)
+        return cached
+
+    def forget(self, user_id: str):
+        """Drop a user from L1 and from the write-behind queue"""
+        self.l1.pop(user_id)
+        self._pending = [(u, e) for u, e in self._pending if u != user_id]
+
+    # =========================================================================
+    # WRITE-BEHIND
+    # =========================================================================
+
+    async def flush_pending(self):
+        """Write queued turns to Redis in one transaction and publish invalidations"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, []
+            try:
+                await self.store.add_entries(self._flushing)
+            except Exception as e:
+                self.stats['flush_failures'] += 1
+                logger.warning(f"Write-behind flush failed ({len(self._flushing)} entries): {e}")
+                # Keep for the next flush, oldest dropped past max_pending
+                retry = self._flushing + self._pending
+                dropped = max(len(retry) - self.max_pending, 0)
+                self.stats['entries_dropped'] += dropped
+                self._pending = retry[dropped:]
+                self._flushing = []
+                return
+            # In Redis now - loads must not merge them again
+            flushed, self._flushing = self._flushing, []
+            self._flush_generation += 1
+            self.stats['flushes'] += 1
+            self.stats['entries_flushed'] += len(flushed)
+            try:
+                await self._publish_invalidations({user_id for user_id, _ in flushed})
+            except Exception as e:
+                logger.warning(f"Failed to publish invalidations: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_pending()
+
+    async def invalidate_others(self, user_id: str):
+        """Tell other workers to drop their L1 copy of a user"""
+        try:
+            await self._publish_invalidations({user_id})
+        except Exception as e:
+            logger.warning(f"Failed to publish invalidation: {e}")
+
+    async def _publish_invalidations(self, users):
+        message = json.dumps({'from': self.instance_id, 'users': sorted(users)}, ensure_ascii=False)
+        await self.store.redis_client.publish(self.INVALIDATE_CHANNEL, message)
+
+    async def _listen_invalidations(self):
+        """Drop L1 copies of users written by other workers (reconnects with backoff)"""
+        delay = 0.5
+        while True:
+            pubsub = self.store.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(self.INVALIDATE_CHANNEL)
+                delay = 0.5
+                async for message in pubsub_messages(pubsub):
+                    data = json.loads(message['data'])
+                    if data.get('from') == self.instance_id:
+                        continue
+                    for user_id in data.get('users', []):
+                        if self.l1.pop(user_id) is not None:
+                            self.stats['invalidations'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation listener error: {e}, retrying in {delay:.1f}s")
+                # Anything published meanwhile was missed
+                self.l1.clear()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
                 try:
-                    pipe.watch(self.key)
-                    if pipe.get(self.key) == self.identifier:
-                        pipe.multi()
-                        pipe.delete(self.key)
-                        pipe.execute()
-                        return True
-                    pipe.unwatch()
-                    break
-                except redis.WatchError:
+                    await pubsub.aclose()
+                except Exception:
                     pass
-        return False
+
+    async def close(self):
+        """Stop background tasks and flush what is queued (shutdown)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['l1_hits'] + self.stats['l1_misses']
+        return {
+            **self.stats,
+            'l1_users': len(self.l1),
+            'l1_hit_rate': self.stats['l1_hits'] / lookups * 100 if lookups else 0,
+            'pending': len(self._pending)
+        }
 
 # =============================================================================
 # INTEGRATION WITH MAIN SYSTEM
@@ -352,29 +625,63 @@ class DistributedLock:
 class ScalableStorageAdapter:
     """
     Adapter to integrate Redis storage with existing system
-    Drop-in replacement for in-memory storage
+    Drop-in replacement for in-memory storage; reads are awaited, history
+    writes are scheduled on the event loop so responses never wait on Redis
+    With MEMORY_L1=true (default) context is served from a per-worker L1
+    and writes are batched to Redis (TwoTierConversationMemory)
     """
-    
-    def __init__(self, redis_config: Optional[RedisConfig] = None):
+
+    def __init__(self, redis_config: Optional[RedisConfig] = None, use_redis: bool = True):
+        self._pending_writes = set()
+        self.tiered: Optional[TwoTierConversationMemory] = None
         try:
+            if not use_redis:
+                raise RedisError("Redis disabled")
             self.memory = ScalableConversationMemory(redis_config)
             self.sql_cache = ScalableSQLCache(self.memory.redis_client)
             self.redis_available = True
-        except:
+            if os.getenv('MEMORY_L1', 'true').lower() == 'true':
+                self.tiered = TwoTierConversationMemory(self.memory)
+        except Exception:
             # Fallback to in-memory if Redis unavailable
             from ..storage.memory import ConversationMemory
             self.memory = ConversationMemory()
             self.sql_cache = {}
             self.redis_available = False
             logger.warning("Redis unavailable, using in-memory storage")
-        
+
+    def start(self):
+        """Start L1 write-behind / invalidation tasks (service startup)"""
+        if self.tiered is not None:
+            self.tiered.start()
+
+    def after_fork(self):
+        self._pending_writes = set()
+        if self.tiered is not None:
+            self.tiered.after_fork()
+
     # Implement same interface as original ConversationMemory
     def add_conversation(self, user_id: str, query: str, response: Dict):
-        return self.memory.add_conversation(user_id, query, response)
-    
-    def get_context(self, user_id: str, query: str) -> Dict:
+        if not self.redis_available:
+            return self.memory.add_conversation(user_id, query, response)
         try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("add_conversation called outside the event loop - use SyncRedisWrapper")
+            return None
+        if self.tiered is not None:
+            return self.tiered.add_conversation(user_id, query, response)
+        task = loop.create_task(self.memory.add_conversation(user_id, query, response))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def get_context(self, user_id: str, query: str) -> Dict:
+        if not self.redis_available:
             return self.memory.get_context(user_id, query)
+        try:
+            if self.tiered is not None:
+                return await self.tiered.get_context(user_id, query)
+            return await self.memory.get_context(user_id, query)
         except Exception as e:
             logger.warning(f"Redis unavailable: {e}")
             # Return empty context if Redis fails
@@ -384,13 +691,71 @@ class ScalableStorageAdapter:
                 'recent_queries': [],
                 'recent_intents': []
             }
-    
-    @property
-    def conversations(self):
-        """Compatibility property"""
-        # Return a dict-like interface for backward compatibility
-        return self
-    
-    def __getitem__(self, user_id: str):
-        """Support dict-like access"""
-        return self.memory.get_context(user_id, "")['recent_queries']
\ No newline at end of file
+
+    async def get_history(self, user_id: str, limit: int = 20) -> Tuple[List[Dict], int]:
+        """(entries oldest first, total stored) for the history endpoint"""
+        if not self.redis_available:
+            return self.memory.get_history(user_id, limit)
+        if self.tiered is not None:
+            await self.tiered.flush_pending()
+        return await self.memory.get_history(user_id, limit)
+
+    async def clear_history(self, user_id: str) -> bool:
+        if not self.redis_available:
+            return self.memory.clear_user(user_id)
+        if self.tiered is not None:
+            self.tiered.forget(user_id)
+            cleared = await self.memory.clear_user_history(user_id)
+            await self.tiered.invalidate_others(user_id)
+            return cleared
+        return await self.memory.clear_user_history(user_id)
+
+    async def get_active_users(self, window_seconds: Optional[int] = None) -> int:
+        if not self.redis_available:
+            self.memory.conversations.prune()
+            return len(self.memory.conversations)
+        return await self.memory.get_active_users(window_seconds)
+
+    async def flush(self):
+        """Wait for scheduled history writes (shutdown)"""
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+        if self.tiered is not None:
+            await self.tiered.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.redis_available:
+            return {'backend': 'memory', **self.memory.get_stats()}
+        if self.tiered is not None:
+            return {'backend': 'redis+l1', **self.tiered.get_stats()}
+        return {'backend': 'redis'}
+
+# =============================================================================
+# SYNC FACADE FOR SCRIPTS
+# =============================================================================
+
+class SyncRedisWrapper:
+    """
+    Blocking facade over any of the async stores, for scripts and shells
+    Runs coroutines on a private event loop; not for use inside the service
+    Example: SyncRedisWrapper(ScalableConversationMemory(redis_client=client)).get_context('u', '')
+    """
+
+    def __init__(self, target: Any):
+        self._target = target
+        self._loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._loop.run_until_complete(attr(*args, **kwargs))
+        return call
+
+    def close(self):
+        client = getattr(self._target, 'redis_client', None)
+        if client is not None:
+            self._loop.run_until_complete(client.aclose() if hasattr(client, 'aclose') else client.close())
+        self._loop.close()
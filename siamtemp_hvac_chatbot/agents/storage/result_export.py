@@ -0,0 +1,367 @@
+# agents/storage/result_export.py
+"""
+Result export store
+Large results are written once, batch by batch, to CSV / JSON Lines /
+Parquet and served by id from /v1/results/{id}; files expire after a TTL
+"""
+
+import os
+import csv
+import json
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+EXPORT_MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+_RESULT_ID_LENGTH = 32
+
+def _json_default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def parse_byte_range(header: Optional[str], size: int):
+    """
+    Single 'bytes=' range → (start, end) inclusive
+    None = serve the whole file, False = unsatisfiable (416)
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file"""
+    remaining = end - start + 1
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# =============================================================================
+# DATA MODELS
+# =============================================================================
+
+@dataclass
+class ExportInfo:
+    """Metadata for one exported result (stored next to the file)"""
+    result_id: str
+    format: str
+    filename: str
+    rows: int
+    size_bytes: int
+    created_at: float
+    expires_at: float
+    question: str = ''
+    tenant_id: str = ''
+
+    @property
+    def media_type(self) -> str:
+        return EXPORT_MEDIA_TYPES[self.format]
+
+    def is_expired(self) -> bool:
+        return time.time() > self.expires_at
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+# =============================================================================
+# FORMAT WRITERS
+# =============================================================================
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        # utf-8-sig so Excel opens Thai text correctly
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = None
+
+    def write(self, rows: List[Dict]):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(rows[0].keys()), extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class _JsonLinesWriter:
+    def __init__(self, path: str):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: List[Dict]):
+        self.file.writelines(
+            json.dumps(row, ensure_ascii=False, default=_json_default) + '\n' for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+class _ParquetWriter:
+    """
+    The Parquet schema is fixed when the file opens, so batches are held
+    back while a column has only NULLs (pyarrow would type it `null` and
+    reject later values). Columns still all-NULL after MAX_PENDING_ROWS
+    are written as text
+    """
+
+    MAX_PENDING_ROWS = 50000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = None
+        self.pending: List[Dict] = []
+        self.types: Dict[str, Any] = {}     # column -> inferred type (null until a value appears)
+        self.as_text: set = set()
+
+    def write(self, rows: List[Dict]):
+        rows = [self._convert(row) for row in rows]
+        if self.writer is not None:
+            self.writer.write_table(pa.Table.from_pylist(rows, schema=self.writer.schema))
+            return
+
+        for field in pa.Table.from_pylist(rows).schema:
+            if pa.types.is_null(self.types.get(field.name, pa.null())):
+                self.types[field.name] = field.type
+        self.pending.extend(rows)
+        if len(self.pending) >= self.MAX_PENDING_ROWS or not any(pa.types.is_null(t) for t in self.types.values()):
+            self._open(final=False)
+
+    def _convert(self, row: Dict) -> Dict:
+        row = {k: float(v) if isinstance(v, Decimal) else v for k, v in row.items()}
+        for column in self.as_text:
+            if row.get(column) is not None:
+                row[column] = str(row[column])
+        return row
+
+    def _open(self, final: bool):
+        """Open the file with the inferred schema and write the held-back rows"""
+        if not final:
+            self.as_text = {name for name, t in self.types.items() if pa.types.is_null(t)}
+        schema = pa.schema([
+            (name, pa.string() if name in self.as_text else t) for name, t in self.types.items()
+        ])
+        self.writer = pq.ParquetWriter(self.path, schema, compression='zstd')
+        pending, self.pending = self.pending, []
+        self.writer.write_table(pa.Table.from_pylist(pending, schema=schema))
+
+    def close(self):
+        if self.writer is None and self.pending:
+            self._open(final=True)
+        if self.writer is not None:
+            self.writer.close()
+
+_WRITERS = {'csv': _CsvWriter, 'jsonl': _JsonLinesWriter, 'parquet': _ParquetWriter}
+
+# =============================================================================
+# EXPORT STORE
+# =============================================================================
+
+class ResultExportStore:
+    """
+    File-backed export store
+    Metadata lives in <id>.json beside the data file, so any worker sharing
+    the directory can serve a download
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl_seconds: Optional[int] = None,
+                 default_format: Optional[str] = None):
+        self.directory = directory or os.getenv('RESULT_EXPORT_DIR', '/tmp/siamtemp_exports')
+        self.ttl_seconds = ttl_seconds or int(os.getenv('RESULT_EXPORT_TTL', '3600'))
+        self.default_format = self._supported(default_format or os.getenv('RESULT_EXPORT_FORMAT', 'csv'))
+        self.batch_size = 1000
+        self.stats = {'exports': 0, 'rows_exported': 0, 'bytes_written': 0, 'expired_removed': 0}
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def available_formats() -> List[str]:
+        return [fmt for fmt in _WRITERS if fmt != 'parquet' or PARQUET_AVAILABLE]
+
+    def _supported(self, fmt: str) -> str:
+        fmt = (fmt or 'csv').lower()
+        if fmt not in self.available_formats():
+            logger.warning(f"Export format '{fmt}' unavailable, using csv")
+            return 'csv'
+        return fmt
+
+    # =========================================================================
+    # WRITE
+    # =========================================================================
+
+    def write(self, rows: Iterable[Dict], fmt: Optional[str] = None,
+              question: str = '', tenant_id: str = '') -> Optional[ExportInfo]:
+        """
+        Write rows (list or iterator) batch by batch; returns None for no rows
+        The file appears atomically once complete
+        """
+        fmt = self._supported(fmt or self.default_format)
+        result_id = uuid.uuid4().hex
+        filename = f"{result_id}.{fmt}"
+        path = os.path.join(self.directory, filename)
+        partial = path + '.part'
+
+        writer = _WRITERS[fmt](partial)
+        row_count = 0
+        try:
+            for batch in self._batches(rows):
+                writer.write(batch)
+                row_count += len(batch)
+        except Exception:
+            writer.close()
+            self._remove(partial)
+            raise
+        writer.close()
+
+        if not row_count:
+            self._remove(partial)
+            return None
+
+        os.replace(partial, path)
+        now = time.time()
+        info = ExportInfo(
+            result_id=result_id, format=fmt, filename=filename, rows=row_count,
+            size_bytes=os.path.getsize(path), created_at=now, expires_at=now + self.ttl_seconds,
+            question=question, tenant_id=tenant_id
+        )
+        with open(self._meta_path(result_id), 'w', encoding='utf-8') as f:
+            json.dump(info.to_dict(), f, ensure_ascii=False)
+
+        self.stats['exports'] += 1
+        self.stats['rows_exported'] += row_count
+        self.stats['bytes_written'] += info.size_bytes
+        logger.info(f"📦 Exported {row_count} rows as {fmt} ({info.size_bytes:,} bytes): {result_id}")
+        return info
+
+    def _batches(self, rows: Iterable[Dict]) -> Iterator[List[Dict]]:
+        if isinstance(rows, list):
+            for start in range(0, len(rows), self.batch_size):
+                yield rows[start:start + self.batch_size]
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # =========================================================================
+    # READ
+    # =========================================================================
+
+    def get(self, result_id: str) -> Optional[ExportInfo]:
+        """Metadata for a live export (None if unknown or expired)"""
+        if len(result_id) != _RESULT_ID_LENGTH or not result_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(result_id), encoding='utf-8') as f:
+                info = ExportInfo(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        if info.is_expired() or not os.path.exists(self.path_for(info)):
+            self._delete(info)
+            return None
+        return info
+
+    def path_for(self, info: ExportInfo) -> str:
+        return os.path.join(self.directory, info.filename)
+
+    # =========================================================================
+    # CLEANUP
+    # =========================================================================
+
+    def cleanup(self) -> int:
+        """Remove expired exports and stale partial files"""
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json'):
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        info = ExportInfo(**json.load(f))
+                except (OSError, ValueError, TypeError):
+                    self._remove(path)
+                    continue
+                if info.is_expired():
+                    self._delete(info)
+                    removed += 1
+            elif name.endswith('.part'):
+                try:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        self._remove(path)
+                except OSError:
+                    pass
+        if removed:
+            self.stats['expired_removed'] += removed
+            logger.info(f"🧹 Removed {removed} expired exports")
+        return removed
+
+    async def run_cleanup(self, interval_seconds: int = 300):
+        """Periodic cleanup loop (started from the service lifespan)"""
+        while True:
+            try:
+                await asyncio.to_thread(self.cleanup)
+            except Exception as e:
+                logger.warning(f"Export cleanup failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def _delete(self, info: ExportInfo):
+        self._remove(self.path_for(info))
+        self._remove(self._meta_path(info.result_id))
+
+    def _meta_path(self, result_id: str) -> str:
+        return os.path.join(self.directory, f"{result_id}.json")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'directory': self.directory,
+            'default_format': self.default_format,
+            'formats': self.available_formats(),
+            'ttl_seconds': self.ttl_seconds
+        }
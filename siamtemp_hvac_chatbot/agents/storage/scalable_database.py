@@ -4,16 +4,21 @@ Scalable Database Handler with connection pooling and async support
 Handles high concurrent loads efficiently
 """
 
+import os
+import re
 import asyncio
 import asyncpg
 import psycopg2
 from psycopg2 import pool
 from contextlib import asynccontextmanager
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import logging
 import time
 from dataclasses import dataclass
 
+# pg_export_snapshot() ids look like 00000003-0000001B-1
+_SNAPSHOT_ID = re.compile(r'^[0-9A-F]+-[0-9A-F]+(?:-\d+)?$')
+
 logger = logging.getLogger(__name__)
 
 # =============================================================================
@@ -31,8 +36,24 @@ class DatabaseConfig:
     min_connections: int = 5
     max_connections: int = 20
     command_timeout: int = 60
+    acquire_timeout: float = 10.0
     max_queries: int = 50000
     max_inactive_connection_lifetime: float = 300.0
+    
+    @classmethod
+    def from_env(cls) -> 'DatabaseConfig':
+        """Same DB_* variables as SimplifiedDatabaseHandler"""
+        return cls(
+            host=os.getenv('DB_HOST', 'postgres-company-a'),
+            port=int(os.getenv('DB_PORT', '5432')),
+            database=os.getenv('DB_NAME', 'siamtemp_company_a'),
+            user=os.getenv('DB_USER', 'postgres'),
+            password=os.getenv('DB_PASSWORD', 'password123'),
+            min_connections=int(os.getenv('DB_POOL_MIN', str(cls.min_connections))),
+            max_connections=int(os.getenv('DB_POOL_MAX', str(cls.max_connections))),
+            command_timeout=int(os.getenv('DB_COMMAND_TIMEOUT', str(cls.command_timeout))),
+            acquire_timeout=float(os.getenv('DB_ACQUIRE_TIMEOUT', str(cls.acquire_timeout)))
+        )
 
 # =============================================================================
 # ASYNC DATABASE HANDLER WITH CONNECTION POOLING
@@ -172,16 +193,32 @@ class ScalableDatabaseHandler:
     # BATCH OPERATIONS FOR HIGH THROUGHPUT
     # =========================================================================
     
-    async def execute_batch(self, queries: List[tuple]) -> List[List[Dict]]:
+    async def execute_batch(self, queries: List[tuple],
+                            snapshot_id: Optional[str] = None,
+                            raise_on_error: bool = False) -> List[List[Dict]]:
         """
         Execute multiple queries in parallel for high throughput
         queries: List of (sql, params) tuples
+        snapshot_id: run every query under this exported snapshot (see export_snapshot)
+        raise_on_error: cancel the batch and raise instead of returning [] for failures
         """
         tasks = []
         for sql, params in queries:
-            task = asyncio.create_task(self.execute_query(sql, params))
+            if snapshot_id:
+                task = asyncio.create_task(self._execute_in_snapshot(sql, params, snapshot_id))
+            else:
+                task = asyncio.create_task(self.execute_query(sql, params))
             tasks.append(task)
         
+        if raise_on_error:
+            try:
+                return list(await asyncio.gather(*tasks))
+            except Exception:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
         # Process results
@@ -195,6 +232,57 @@ class ScalableDatabaseHandler:
         
         return processed
     
+    # =========================================================================
+    # CONSISTENT SNAPSHOTS FOR PARALLEL READS
+    # =========================================================================
+    
+    @asynccontextmanager
+    async def export_snapshot(self) -> AsyncIterator[str]:
+        """
+        Hold a REPEATABLE READ transaction open and yield its exported snapshot id
+        Queries run with that id see exactly the same data, on any connection
+        """
+        if not self.circuit_breaker.can_execute():
+            raise Exception("Circuit breaker is open - too many failures")
+        
+        async with self.pool.acquire(timeout=self.config.acquire_timeout) as connection:
+            transaction = connection.transaction(isolation='repeatable_read', readonly=True)
+            await transaction.start()
+            try:
+                snapshot_id = await connection.fetchval("SELECT pg_export_snapshot()")
+                yield snapshot_id
+            finally:
+                await transaction.rollback()
+    
+    async def _execute_in_snapshot(self, sql: str, params: Optional[tuple],
+                                   snapshot_id: str) -> List[Dict]:
+        """Execute a read query inside an imported snapshot"""
+        if not _SNAPSHOT_ID.match(snapshot_id):
+            raise ValueError(f"Invalid snapshot id: {snapshot_id}")
+        
+        try:
+            async with self.pool.acquire(timeout=self.config.acquire_timeout) as connection:
+                async with connection.transaction(isolation='repeatable_read', readonly=True):
+                    # Must be the first statement of the transaction
+                    await connection.execute(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'")
+                    await connection.execute("SET LOCAL work_mem = '256MB'")
+                    
+                    if params:
+                        rows = await connection.fetch(sql, *params)
+                    else:
+                        rows = await connection.fetch(sql)
+            
+            self.circuit_breaker.record_success()
+            self._track_query_stats(sql, len(rows))
+            return [dict(row) for row in rows]
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.circuit_breaker.record_failure()
+            logger.error(f"Snapshot query failed: {e}")
+            raise
+    
     # =========================================================================
     # CACHING INTEGRATION
     # =========================================================================
@@ -0,0 +1,268 @@
+# agents/storage/shared_state.py
+"""
+State shared by all worker processes of the service (through Redis)
+- Counters: each worker batches its increments and flushes them with
+  HINCRBY/HINCRBYFLOAT once a second; reads sum the shared hash
+- Feature flags: one hash, reloaded by every worker on the same tick
+- Per-user objects (conversation state): saved to Redis as JSON on change
+  (to_json / from_json convert the objects), loaded on a local miss; other
+  workers drop their copy via pub/sub. Never pickle - anyone able to write
+  to Redis could run code in every worker
+Without Redis everything stays local, as with a single worker
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import redis.asyncio as aioredis
+
+from .redis_memory import RedisConfig, get_async_pool, pubsub_messages
+
+logger = logging.getLogger(__name__)
+
+class SharedState:
+    """
+    Cross-worker counters, flags and per-user objects
+    Call start() from the worker's event loop; after_fork() in each worker
+    when the app is preloaded by gunicorn
+    """
+
+    COUNTERS_KEY = "shared:counters"
+    FLAGS_KEY = "shared:feature_flags"
+    INVALIDATE_CHANNEL = "shared:state_invalidate"
+
+    def __init__(self, namespace: str = 'orchestrator', flags: Optional[Dict[str, bool]] = None,
+                 redis_client: Optional[aioredis.Redis] = None, use_redis: bool = True,
+                 to_json: Callable[[Any], Any] = lambda obj: obj,
+                 from_json: Callable[[Any], Any] = lambda data: data):
+        self.namespace = namespace
+        self.to_json = to_json
+        self.from_json = from_json
+        self.instance_id = uuid.uuid4().hex
+        self.flush_interval = float(os.getenv('SHARED_STATE_INTERVAL', '1'))
+        self.object_ttl = int(os.getenv('SHARED_OBJECT_TTL', '3600'))
+        self.flags: Dict[str, bool] = dict(flags or {})
+        self.local_counters: Dict[str, float] = {}
+        self._deltas: Dict[str, float] = {}
+        self._dirty_objects: Dict[str, Any] = {}
+        self._object_flush: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+        self._invalidation_handlers: List[Callable[[str], None]] = []
+        self.redis_client = None
+        if use_redis and os.getenv('SHARED_STATE', 'true').lower() == 'true':
+            self.redis_client = redis_client or aioredis.Redis(connection_pool=get_async_pool(RedisConfig()))
+        self.stats = {'flushes': 0, 'flush_failures': 0, 'objects_saved': 0,
+                      'objects_loaded': 0, 'invalidations': 0}
+
+    @property
+    def shared(self) -> bool:
+        return self.redis_client is not None
+
+    @property
+    def counters_key(self) -> str:
+        return f"{self.COUNTERS_KEY}:{self.namespace}"
+
+    # =========================================================================
+    # LIFECYCLE
+    # =========================================================================
+
+    def start(self):
+        """Start the flush/reload loop and invalidation listener (idempotent)"""
+        if self._tasks or not self.shared:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._sync_loop()), loop.create_task(self._listen_invalidations())]
+
+    def after_fork(self):
+        """Give a forked worker its own identity and empty buffers"""
+        self.instance_id = uuid.uuid4().hex
+        self._deltas = {}
+        self._dirty_objects = {}
+        self._object_flush = None
+        self._tasks = []
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush_objects()
+        await self.sync()
+
+    # =========================================================================
+    # COUNTERS
+    # =========================================================================
+
+    def incr(self, name: str, amount: float = 1):
+        """Count locally now, add to the shared total on the next flush"""
+        self.local_counters[name] = self.local_counters.get(name, 0) + amount
+        if self.shared:
+            self._deltas[name] = self._deltas.get(name, 0) + amount
+
+    async def counters(self) -> Dict[str, float]:
+        """Totals over all workers (this worker's totals without Redis)"""
+        if not self.shared:
+            return dict(self.local_counters)
+        try:
+            raw = await self.redis_client.hgetall(self.counters_key)
+        except Exception as e:
+            logger.warning(f"Shared counters unavailable: {e}")
+            return dict(self.local_counters)
+        totals = {_text(k): float(v) for k, v in raw.items()}
+        # Increments not flushed yet
+        for name, amount in self._deltas.items():
+            totals[name] = totals.get(name, 0) + amount
+        return totals
+
+    # =========================================================================
+    # FEATURE FLAGS
+    # =========================================================================
+
+    async def set_flag(self, name: str, enabled: bool):
+        self.flags[name] = enabled
+        if self.shared:
+            await self.redis_client.hset(self.FLAGS_KEY, name, '1' if enabled else '0')
+
+    def _apply_flags(self, raw: Dict):
+        for name, value in raw.items():
+            self.flags[_text(name)] = _text(value) == '1'
+
+    # =========================================================================
+    # SYNC LOOP
+    # =========================================================================
+
+    async def sync(self):
+        """Flush counter deltas and reload flags in one round trip"""
+        if not self.shared:
+            return
+        deltas, self._deltas = self._deltas, {}
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for name, amount in deltas.items():
+                    if float(amount).is_integer():
+                        pipe.hincrby(self.counters_key, name, int(amount))
+                    else:
+                        pipe.hincrbyfloat(self.counters_key, name, amount)
+                pipe.hgetall(self.FLAGS_KEY)
+                results = await pipe.execute()
+            self._apply_flags(results[-1])
+            self.stats['flushes'] += 1
+        except Exception as e:
+            self.stats['flush_failures'] += 1
+            logger.warning(f"Shared state sync failed: {e}")
+            for name, amount in deltas.items():
+                self._deltas[name] = self._deltas.get(name, 0) + amount
+
+    async def _sync_loop(self):
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.flush_interval)
+
+    # =========================================================================
+    # PER-USER OBJECTS
+    # =========================================================================
+
+    def _object_key(self, key: str) -> str:
+        return f"shared:{self.namespace}:obj:{key}"
+
+    def save_later(self, key: str, obj: Any):
+        """
+        Queue an object for saving; saves queued during one request are
+        written together as soon as the request yields
+        """
+        if not self.shared:
+            return
+        self._dirty_objects[key] = obj
+        if self._object_flush is None or self._object_flush.done():
+            try:
+                self._object_flush = asyncio.get_running_loop().create_task(self.flush_objects())
+            except RuntimeError:
+                pass
+
+    async def flush_objects(self):
+        while self._dirty_objects:
+            dirty, self._dirty_objects = self._dirty_objects, {}
+            await self._save_objects(dirty)
+
+    async def _save_objects(self, dirty: Dict[str, Any]):
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for key, obj in dirty.items():
+                    if obj is None:
+                        pipe.delete(self._object_key(key))
+                    else:
+                        pipe.setex(self._object_key(key), self.object_ttl,
+                                   json.dumps(self.to_json(obj), ensure_ascii=False, default=str))
+                pipe.publish(self.INVALIDATE_CHANNEL,
+                             json.dumps({'from': self.instance_id, 'keys': list(dirty)}, ensure_ascii=False))
+                await pipe.execute()
+            self.stats['objects_saved'] += len(dirty)
+        except Exception as e:
+            logger.warning(f"Failed to save shared objects: {e}")
+
+    async def load(self, key: str) -> Optional[Any]:
+        """Object saved by any worker (None if absent or Redis is down)"""
+        if not self.shared:
+            return None
+        try:
+            raw = await self.redis_client.get(self._object_key(key))
+        except Exception as e:
+            logger.warning(f"Failed to load shared object: {e}")
+            return None
+        if raw is None:
+            return None
+        try:
+            obj = self.from_json(json.loads(raw))
+        except (ValueError, TypeError, KeyError) as e:
+            # Unreadable (e.g. written by an older version) - treat as absent
+            logger.warning(f"Ignoring unreadable shared object {key}: {e}")
+            return None
+        self.stats['objects_loaded'] += 1
+        return obj
+
+    def on_invalidate(self, handler: Callable[[Optional[str]], None]):
+        """
+        handler(key) runs when another worker saves that key;
+        handler(None) after a listener reconnect (messages may have been missed)
+        """
+        self._invalidation_handlers.append(handler)
+
+    def _invalidate(self, keys: Iterable[str]):
+        for key in keys:
+            self.stats['invalidations'] += 1
+            for handler in self._invalidation_handlers:
+                handler(key)
+
+    async def _listen_invalidations(self):
+        delay = 0.5
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(self.INVALIDATE_CHANNEL)
+                delay = 0.5
+                async for message in pubsub_messages(pubsub):
+                    data = json.loads(message['data'])
+                    if data.get('from') != self.instance_id:
+                        self._invalidate(data.get('keys', []))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Shared state listener error: {e}, retrying in {delay:.1f}s")
+                self._invalidate([None])
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'shared': self.shared, 'pending_deltas': len(self._deltas)}
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
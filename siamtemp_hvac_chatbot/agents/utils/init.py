@@ -1,10 +1,21 @@
 # agents/utils/__init__.py
 """Utility functions and formatters"""
 
-from .table_formatter import TableFormatter, format_results_as_table_response, create_table_response
+from .table_formatter import (
+    TableFormatter, MarkdownTableStream, format_results_as_table_response,
+    create_table_response, get_table_title
+)
+from .profiling import SamplingProfiler, profile_task, summarize_profile
+from .metrics_snapshots import CollectorSnapshots
 
 __all__ = [
     'TableFormatter',
+    'MarkdownTableStream',
+    'get_table_title',
     'format_results_as_table_response', 
-    'create_table_response'
+    'create_table_response',
+    'SamplingProfiler',
+    'profile_task',
+    'summarize_profile',
+    'CollectorSnapshots'
 ]
\ No newline at end of file
@@ -0,0 +1,112 @@
+# agents/utils/metrics_snapshots.py
+"""
+Custom Prometheus collectors across gunicorn workers
+Collectors over in-process state (query stats, memory) have no
+multiprocess files, so each worker writes its samples to
+collectors_<pid>.json in PROMETHEUS_MULTIPROC_DIR and a scrape merges the
+files of every live worker, summing equal series. /metrics then reports
+all workers whichever one answers, without a per-worker pid label.
+A worker's file is removed when it exits (child_exit), so its counters
+leave the sum like a process restart
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from glob import glob
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client.metrics_core import Metric
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = 'collectors_'
+
+def snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{FILE_PREFIX}{pid}.json")
+
+def remove_snapshot(directory: str, pid: int):
+    """Drop a dead worker's snapshot (gunicorn child_exit)"""
+    try:
+        os.remove(snapshot_path(directory, pid))
+    except OSError:
+        pass
+
+class CollectorSnapshots:
+    """
+    write() publishes this worker's samples; collect() merges all workers
+    (register it on the scrape registry in multiprocess mode)
+    """
+
+    def __init__(self, directory: str, collectors: List[Any],
+                 interval: float = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '15'))):
+        self.directory = directory
+        self.collectors = collectors
+        self.interval = interval
+        # Snapshots not refreshed for this long belong to a hung or vanished worker
+        self.max_age = max(interval * 4, 60.0)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """This worker's families as JSON-safe dicts (run on the event loop thread)"""
+        families = []
+        for collector in self.collectors:
+            for family in collector.collect():
+                families.append({
+                    'name': family.name, 'documentation': family.documentation,
+                    'type': family.type, 'unit': family.unit,
+                    'samples': [[s.name, s.labels, s.value] for s in family.samples]
+                })
+        return families
+
+    def write(self, families: Optional[List[Dict[str, Any]]] = None):
+        path = snapshot_path(self.directory, os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(families if families is not None else self.snapshot(), f)
+        os.replace(tmp, path)
+
+    async def run(self):
+        """Refresh this worker's snapshot every interval (started from the service lifespan)"""
+        while True:
+            try:
+                await asyncio.to_thread(self.write, self.snapshot())
+            except Exception as e:
+                logger.warning(f"Collector snapshot failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _read_all(self) -> Iterable[List[Dict[str, Any]]]:
+        cutoff = time.time() - self.max_age
+        for path in glob(os.path.join(self.directory, f"{FILE_PREFIX}*.json")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    continue
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue   # removed or being replaced
+
+    def collect(self):
+        # The answering worker's own snapshot is always current
+        try:
+            self.write()
+        except Exception as e:
+            logger.warning(f"Collector snapshot failed: {e}")
+
+        merged: Dict[str, Tuple[Dict[str, Any], Dict[Tuple, float]]] = {}
+        for families in self._read_all():
+            for family in families:
+                meta, values = merged.setdefault(family['name'], (family, {}))
+                for name, labels, value in family['samples']:
+                    key = (name, tuple(sorted(labels.items())))
+                    values[key] = values.get(key, 0.0) + value
+
+        for name, (meta, values) in merged.items():
+            metric = Metric(name, meta['documentation'], meta['type'], meta['unit'])
+            for (sample_name, labels), value in values.items():
+                metric.add_sample(sample_name, dict(labels), value)
+            yield metric
+
+    def describe(self):
+        return []
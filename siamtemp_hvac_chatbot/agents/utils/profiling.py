@@ -0,0 +1,311 @@
+# agents/utils/profiling.py
+"""
+On-demand profiling of a running worker (no restart)
+- SamplingProfiler: a daemon thread samples the event-loop thread's stack
+  every `interval` seconds for a bounded window and counts collapsed stacks
+  ("frame;frame;frame N" - the input of flamegraph.pl and speedscope);
+  optional tracemalloc over the same window for top allocation sites
+- profile_task(): cProfile of one request's pipeline (X-Profile header),
+  enabled only while that request's task (and tasks it creates) runs on the
+  loop, summarised per function and per agents/ module
+"""
+
+import os
+import sys
+import time
+import asyncio
+import contextvars
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CWD = os.getcwd()
+_short_paths: Dict[str, str] = {}
+
+def _short_path(filename: str) -> str:
+    """site-packages/... or path relative to the app directory"""
+    short = _short_paths.get(filename)
+    if short is None:
+        if 'site-packages/' in filename:
+            short = filename.split('site-packages/', 1)[1]
+        elif filename.startswith(_CWD):
+            short = os.path.relpath(filename, _CWD)
+        else:
+            short = os.path.basename(filename)
+        _short_paths[filename] = short
+    return short
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+# Leaf frames of an event loop waiting for I/O
+_IDLE_FUNCTIONS = frozenset({'select', 'poll', 'epoll', 'kqueue', 'wait'})
+
+# =============================================================================
+# SAMPLING PROFILER
+# =============================================================================
+
+class SamplingProfiler:
+    """
+    Statistical profiler of one thread (the event loop), started for a bounded window
+    Overhead is one stack walk per interval in a separate thread
+    """
+
+    def __init__(self, max_seconds: float = float(os.getenv('PROFILE_MAX_SECONDS', '300')),
+                 max_stacks: int = 20000, max_depth: int = 128):
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.interval = 0.0
+        self.memory: Optional[Dict[str, Any]] = None
+        self._memory_start = None
+        self._owns_tracemalloc = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005, trace_memory: bool = False,
+              thread_id: Optional[int] = None) -> Dict[str, Any]:
+        """Sample thread_id (default: the calling thread) for up to max_seconds"""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("A profile is already running")
+            self._reset()
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            self.interval = max(interval, 0.001)
+            self.started_at = time.time()
+            if trace_memory:
+                self._start_tracemalloc()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(thread_id or threading.get_ident(), time.monotonic() + seconds),
+                name='sampling-profiler',
+                daemon=True
+            )
+            self._thread.start()
+        logger.info(f"🔬 Sampling profiler started for {seconds:.0f}s every {self.interval * 1000:.0f}ms"
+                    f"{' with tracemalloc' if trace_memory else ''}")
+        return {'seconds': seconds, 'interval': self.interval, 'trace_memory': trace_memory}
+
+    def stop(self):
+        """End the window early (results stay available)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self, thread_id: int, deadline: float):
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    self._sample(frame)
+        except Exception as e:
+            logger.error(f"Sampling profiler failed: {e}")
+        finally:
+            self._finish()
+
+    def _sample(self, frame):
+        names: List[str] = []
+        leaf = frame.f_code.co_name
+        while frame is not None and len(names) < self.max_depth:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        stack = ';'.join(reversed(names))
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            stack = '[other]'
+        self.stacks[stack] += 1
+        self.samples += 1
+        if leaf in _IDLE_FUNCTIONS:
+            self.idle_samples += 1
+
+    def _finish(self):
+        self.finished_at = time.time()
+        if self._memory_start is not None:
+            try:
+                self.memory = self._memory_report(tracemalloc.take_snapshot())
+            except Exception as e:
+                logger.warning(f"tracemalloc report failed: {e}")
+            finally:
+                if self._owns_tracemalloc:
+                    tracemalloc.stop()
+                self._memory_start = None
+        logger.info(f"🔬 Sampling profiler finished: {self.samples} samples")
+
+    # =========================================================================
+    # TRACEMALLOC
+    # =========================================================================
+
+    def _start_tracemalloc(self):
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(int(os.getenv('TRACEMALLOC_FRAMES', '1')))
+        self._memory_start = tracemalloc.take_snapshot()
+
+    def _memory_report(self, snapshot, limit: int = 25) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+
+        def site(stat) -> Dict[str, Any]:
+            frame = stat.traceback[0]
+            return {'site': f"{_short_path(frame.filename)}:{frame.lineno}",
+                    'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+
+        growth = [stat for stat in snapshot.compare_to(self._memory_start, 'lineno') if stat.size_diff > 0]
+        return {
+            'traced_mb': round(current / 1024 / 1024, 2),
+            'peak_mb': round(peak / 1024 / 1024, 2),
+            'top_sites': [site(stat) for stat in snapshot.statistics('lineno')[:limit]],
+            'growth': [{**site(stat), 'size_diff_kb': round(stat.size_diff / 1024, 1), 'count_diff': stat.count_diff}
+                       for stat in growth[:limit]]
+        }
+
+    # =========================================================================
+    # RESULTS
+    # =========================================================================
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, one "frame;frame count" per line (flamegraph.pl / speedscope)"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, limit: int = 30) -> Dict[str, Any]:
+        self_samples: Counter = Counter()
+        total_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_samples[frames[-1]] += count
+            for name in set(frames):
+                total_samples[name] += count
+
+        samples = self.samples or 1
+        end = self.finished_at if not self.running and self.finished_at else time.time()
+        return {
+            'state': 'running' if self.running else ('finished' if self.started_at else 'idle'),
+            'started_at': self.started_at,
+            'duration_seconds': round(end - self.started_at, 2) if self.started_at else 0.0,
+            'interval': self.interval,
+            'samples': self.samples,
+            'busy_share': round(1 - self.idle_samples / samples, 3) if self.samples else 0.0,
+            'top_self': [{'function': name, 'samples': count, 'share': round(count / samples, 3)}
+                         for name, count in self_samples.most_common(limit)],
+            'top_total': [{'function': name, 'samples': count, 'share': round(count / samples, 3)}
+                          for name, count in total_samples.most_common(limit)],
+            'memory': self.memory
+        }
+
+# =============================================================================
+# PER-REQUEST CPROFILE
+# =============================================================================
+
+# Profiler of the request that created the current task (copied into child tasks)
+_task_profiler: contextvars.ContextVar[Optional[cProfile.Profile]] = contextvars.ContextVar(
+    'task_profiler', default=None
+)
+
+class _ProfiledSteps:
+    """
+    Await a coroutine with profiler enabled only inside its own steps;
+    it is disabled whenever the coroutine yields to the loop, so other
+    requests' callbacks are not counted
+    """
+
+    def __init__(self, coro, profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.enable()
+            try:
+                if error is not None:
+                    future = self.coro.throw(error)
+                else:
+                    future = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.disable()
+            try:
+                value, error = (yield future), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+async def _profiled(coro, profiler: cProfile.Profile):
+    return await _ProfiledSteps(coro, profiler)
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop):
+    """Wrap tasks created from a profiled request (asyncio.gather, create_task) in its profiler"""
+    previous = loop.get_task_factory()
+    if getattr(previous, 'profiles_tasks', False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        context = kwargs.get('context')
+        profiler = context.get(_task_profiler) if context is not None else _task_profiler.get()
+        if profiler is not None and asyncio.iscoroutine(coro):
+            coro = _profiled(coro, profiler)
+        if previous is not None:
+            return previous(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    factory.profiles_tasks = True
+    loop.set_task_factory(factory)
+
+async def profile_task(awaitable: Awaitable) -> Tuple[Any, cProfile.Profile]:
+    """
+    (result, profiler) of awaitable under a cProfile scoped to this request:
+    its own steps and the tasks it creates, not concurrent requests.
+    Work handed to threads (asyncio.to_thread) is not included
+    """
+    profiler = cProfile.Profile()
+    _install_task_factory(asyncio.get_running_loop())
+    token = _task_profiler.set(profiler)
+    try:
+        result = await _ProfiledSteps(awaitable.__await__(), profiler)
+    finally:
+        _task_profiler.reset(token)
+    return result, profiler
+
+def summarize_profile(profiler: cProfile.Profile, limit: int = 30, module_prefix: str = 'agents/') -> Dict[str, Any]:
+    """Top functions by own time, and own time per module under module_prefix"""
+    stats = pstats.Stats(profiler)
+    functions = []
+    modules: Counter = Counter()
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        path = _short_path(filename)
+        functions.append({
+            'function': f"{name} ({path}:{line})",
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3)
+        })
+        if path.startswith(module_prefix):
+            modules[path] += tottime
+    functions.sort(key=lambda f: f['tottime_ms'], reverse=True)
+    return {
+        'total_ms': round(stats.total_tt * 1000, 3),
+        'functions': functions[:limit],
+        'modules': [{'module': path, 'tottime_ms': round(seconds * 1000, 3)}
+                    for path, seconds in modules.most_common(limit)]
+    }
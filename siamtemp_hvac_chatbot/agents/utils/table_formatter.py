@@ -3,7 +3,7 @@
 Table Formatter for converting database results to formatted tables
 """
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 import json
 from datetime import datetime
 
@@ -21,8 +21,9 @@ class TableFormatter:
     
     def format_results_as_table(self, results: List[Dict], 
                                style: str = 'markdown',
-                               title: str = None) -> str:
-        """สร้างตารางจาก results - แสดงเป็นตารางทั้งหมด"""
+                               title: str = None,
+                               summary: str = None) -> str:
+        """สร้างตารางจาก results - แสดงเป็นตารางทั้งหมด (summary แทนบรรทัดจำนวนรายการ)"""
         
         if not results:
             return "ไม่มีข้อมูล"
@@ -39,38 +40,33 @@ class TableFormatter:
         if title:
             response += f"## {title}\n\n"
         
-        response += f"**จำนวนรายการทั้งหมด: {len(results)} รายการ**\n\n"
+        response += f"**{summary or f'จำนวนรายการทั้งหมด: {len(results)} รายการ'}**\n\n"
         response += table
         
         return response
     
     def _process_data(self, results: List[Dict]) -> List[List[str]]:
         """ประมวลผลข้อมูลให้เหมาะสำหรับแสดงในตาราง"""
-        processed = []
-        
-        for row in results:
-            processed_row = []
-            for key, value in row.items():
-                # แปลงค่าต่างๆ ให้เป็น string ที่เหมาะสม
-                if value is None:
-                    processed_row.append("-")
-                elif isinstance(value, (int, float)):
-                    if isinstance(value, float) and value.is_integer():
-                        processed_row.append(str(int(value)))
-                    else:
-                        processed_row.append(f"{value:,.0f}" if isinstance(value, float) else str(value))
-                elif isinstance(value, str):
-                    # ตัดความยาวหากเกิน max_cell_width
-                    if len(value) > self.max_cell_width:
-                        processed_row.append(value[:self.max_cell_width-3] + "...")
-                    else:
-                        processed_row.append(value)
-                else:
-                    processed_row.append(str(value))
-            
-            processed.append(processed_row)
-        
-        return processed
+        return [[self._format_cell(value) for value in row.values()] for row in results]
+    
+    def _format_cell(self, value: Any) -> str:
+        """แปลงค่าต่างๆ ให้เป็น string ที่เหมาะสม"""
+        if value is None:
+            return "-"
+        elif isinstance(value, (int, float)):
+            if isinstance(value, float) and value.is_integer():
+                return str(int(value))
+            return f"{value:,.0f}" if isinstance(value, float) else str(value)
+        elif isinstance(value, str):
+            # ตัดความยาวหากเกิน max_cell_width
+            if len(value) > self.max_cell_width:
+                return value[:self.max_cell_width-3] + "..."
+            return value
+        return str(value)
+    
+    def markdown_stream(self, title: str = None, rows_per_chunk: int = 50) -> 'MarkdownTableStream':
+        """สร้าง markdown table แบบ incremental สำหรับ streaming"""
+        return MarkdownTableStream(self, title, rows_per_chunk)
     
     def _format_markdown_table(self, headers: List[str], data: List[List[str]]) -> str:
         """สร้าง Markdown table"""
@@ -211,6 +207,62 @@ class TableFormatter:
         
         return [translation_map.get(header, header) for header in headers]
 
+class MarkdownTableStream:
+    """
+    Incremental markdown table - feed rows batch by batch, get text chunks back
+    Memory is bounded by rows_per_chunk, not by result size
+    """
+    
+    def __init__(self, formatter: TableFormatter, title: str = None, rows_per_chunk: int = 50):
+        self.formatter = formatter
+        self.title = title
+        self.rows_per_chunk = rows_per_chunk
+        self.headers: List[str] = []
+        self.row_count = 0
+    
+    def feed(self, rows: Iterable[Dict]) -> Iterator[str]:
+        """Yield markdown chunks for the given rows (header is emitted with the first row)"""
+        lines = []
+        for row in rows:
+            if not self.headers:
+                self.headers = list(row.keys())
+                lines.append(self._header())
+            cells = [self.formatter._format_cell(row.get(h)) for h in self.headers]
+            lines.append("| " + " | ".join(cells) + " |")
+            self.row_count += 1
+            
+            if len(lines) >= self.rows_per_chunk:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        
+        if lines:
+            yield "\n".join(lines) + "\n"
+    
+    def close(self) -> str:
+        """Footer with the final row count (unknown until the stream ends)"""
+        if not self.row_count:
+            return "ไม่พบข้อมูลที่ตรงกับคำถาม"
+        return f"\n**จำนวนรายการทั้งหมด: {self.row_count} รายการ**"
+    
+    def _header(self) -> str:
+        thai_headers = self.formatter._translate_headers(self.headers)
+        parts = []
+        if self.title:
+            parts.append(f"## {self.title}\n")
+        parts.append("| " + " | ".join(thai_headers) + " |")
+        parts.append("| " + " | ".join(["---"] * len(self.headers)) + " |")
+        return "\n".join(parts)
+
+def get_table_title(context_question: str) -> str:
+    """กำหนด title จากคำถาม"""
+    if 'งาน' in context_question:
+        return 'ข้อมูลงานและการบริการ'
+    elif 'อะไหล่' in context_question:
+        return 'ข้อมูลอะไหล่และคลังสินค้า'
+    elif 'รายได้' in context_question or 'ยอดขาย' in context_question:
+        return 'ข้อมูลรายได้และยอดขาย'
+    return 'ผลลัพธ์การค้นหา'
+
 # Integration function for orchestrator.py
 def create_table_response(results: List[Dict], context_question: str = "", 
                          table_style: str = 'markdown') -> str:
@@ -218,20 +270,10 @@ def create_table_response(results: List[Dict], context_question: str = "",
     
     formatter = TableFormatter()
     
-    # กำหนด title จากคำถาม
-    if 'งาน' in context_question:
-        title = 'ข้อมูลงานและการบริการ'
-    elif 'อะไหล่' in context_question:
-        title = 'ข้อมูลอะไหล่และคลังสินค้า'
-    elif 'รายได้' in context_question or 'ยอดขาย' in context_question:
-        title = 'ข้อมูลรายได้และยอดขาย'
-    else:
-        title = 'ผลลัพธ์การค้นหา'
-    
     return formatter.format_results_as_table(
         results=results,
         style=table_style,
-        title=title
+        title=get_table_title(context_question)
     )
 
 # สำหรับใช้ใน _generate_response() 
@@ -5,19 +5,21 @@ FastAPI service layer for the Ultimate Dual Model Dynamic AI System
 """
 
 import os
+import hmac
 import asyncio
 import time
 import json
 from datetime import datetime
 from typing import Dict, Any, List, Optional
-from fastapi import FastAPI, HTTPException, Depends, Header, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Header, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import uvicorn
 import logging
 from contextlib import asynccontextmanager
-from prometheus_client import Counter, Histogram, Gauge, generate_latest
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry, multiprocess
 # Import the ultimate AI system
 # from agents.dual_model_dynamic_ai import (
 #     DualModelDynamicAISystem,
@@ -27,6 +29,16 @@ from prometheus_client import Counter, Histogram, Gauge, generate_latest
 from agents import (
     ImprovedDualModelDynamicAISystem as UnifiedEnhancedPostgresOllamaAgent
 )
+from agents.storage.query_stats import QueryStatsCollector, LATENCY_BUCKETS
+from agents.storage.memory import ConversationMemoryCollector
+from agents.data.analytics import ResultColumns
+from agents.storage.result_export import parse_byte_range, iter_file_range
+from agents.storage.redis_memory import close_async_pools
+from agents.storage.admission import AdmissionController, AdmissionMiddleware, TenantLimits
+from agents.utils.profiling import SamplingProfiler, profile_task, summarize_profile
+from agents.utils.metrics_snapshots import CollectorSnapshots
+from openai_compat import create_openai_router, extract_user_message, classify_background_task
+from tracing import TracingMiddleware, setup_tracing, shutdown_tracing, tracing_enabled, span
 
 # Configure logging
 logging.basicConfig(
@@ -42,8 +54,53 @@ logger = logging.getLogger(__name__)
 # Prometheus metrics
 request_count = Counter('chatbot_requests_total', 'Total number of requests', ['endpoint', 'status'])
 response_time = Histogram('chatbot_response_time_seconds', 'Response time in seconds', ['endpoint'])
-active_users = Gauge('chatbot_active_users', 'Number of active users')
-cache_hit_rate = Gauge('chatbot_cache_hit_rate', 'Cache hit rate percentage')
+active_users = Gauge('chatbot_active_users', 'Users seen within ACTIVE_USER_WINDOW (from the Redis index)',
+                     multiprocess_mode='max')
+background_prompts = Counter('chatbot_background_prompts_total',
+                             'OpenWebUI background prompts answered without the pipeline', ['task'])
+cache_hit_rate = Gauge('chatbot_cache_hit_rate', 'Cache hit rate percentage', multiprocess_mode='liveall')
+admission_total = Counter('chatbot_admission_total',
+                          'Admission decisions (admitted, throttled_tenant, throttled_user, rejected_concurrency)',
+                          ['tenant', 'outcome'])
+admission_wait = Histogram('chatbot_admission_wait_seconds', 'Time queued for an in-flight slot', ['tenant'])
+tenant_in_flight = Gauge('chatbot_tenant_in_flight', 'Admitted requests still running', ['tenant'],
+                         multiprocess_mode='livesum')
+pipeline_stage_time = Histogram('chatbot_pipeline_stage_seconds', 'Time spent per pipeline stage',
+                                ['stage', 'tenant', 'intent', 'outcome'], buckets=LATENCY_BUCKETS)
+dependency_in_flight = Gauge('chatbot_dependency_in_flight', 'Calls in progress to Ollama / Postgres / Redis',
+                             ['dependency'], multiprocess_mode='livesum')
+
+# Ollama usage from /api/generate stats (labels: model, template, intent, tenant)
+OLLAMA_LABELS = ['model', 'template', 'intent', 'tenant']
+ollama_prompt_tokens = Histogram('chatbot_ollama_prompt_tokens', 'Prompt tokens evaluated per Ollama call',
+                                 OLLAMA_LABELS, buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+ollama_output_tokens = Histogram('chatbot_ollama_output_tokens', 'Tokens generated per Ollama call',
+                                 OLLAMA_LABELS, buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+ollama_tokens_per_second = Histogram('chatbot_ollama_tokens_per_second', 'Generation speed per Ollama call',
+                                     OLLAMA_LABELS, buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 200))
+ollama_load_time = Histogram('chatbot_ollama_load_seconds', 'Model load time per Ollama call (high = model was reloaded)',
+                             ['model'], buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+def observe_stage(stage: str, seconds: float, tenant: str, intent: str, outcome: str):
+    pipeline_stage_time.labels(stage=stage, tenant=tenant, intent=intent, outcome=outcome).observe(seconds)
+
+def observe_dependency(dependency: str, in_flight: int):
+    dependency_in_flight.labels(dependency=dependency).set(in_flight)
+
+def observe_ollama_usage(usage, labels: Dict[str, str]):
+    label_values = {'model': usage.model, 'template': labels['template'],
+                    'intent': labels['intent'], 'tenant': labels['tenant']}
+    ollama_prompt_tokens.labels(**label_values).observe(usage.prompt_tokens)
+    ollama_output_tokens.labels(**label_values).observe(usage.output_tokens)
+    if usage.eval_seconds:
+        ollama_tokens_per_second.labels(**label_values).observe(usage.tokens_per_second)
+    ollama_load_time.labels(model=usage.model).observe(usage.load_seconds)
+
+# Custom collectors over in-process state (registered at startup); under
+# gunicorn every worker publishes them to the multiprocess dir for /metrics
+worker_collectors: List[Any] = []
+collector_snapshots = (CollectorSnapshots(os.environ['PROMETHEUS_MULTIPROC_DIR'], worker_collectors)
+                       if os.getenv('PROMETHEUS_MULTIPROC_DIR') else None)
 
 # =============================================================================
 # CONFIGURATION
@@ -90,6 +147,14 @@ class ServiceConfig:
         self.enable_streaming = os.getenv('ENABLE_STREAMING', 'true').lower() == 'true'
         self.enable_metrics = os.getenv('ENABLE_METRICS', 'true').lower() == 'true'
         self.enable_cors = os.getenv('ENABLE_CORS', 'true').lower() == 'true'
+        # Per-stage timings in every /v1/chat response (otherwise only with "debug": true)
+        self.debug_timings = os.getenv('DEBUG_TIMINGS', 'false').lower() == 'true'
+        # /v1/admin/profile/* and the X-Profile request header (off by default);
+        # with PROFILING_TOKEN set, both need a matching X-Admin-Token header
+        self.enable_profiling = os.getenv('ENABLE_PROFILING', 'false').lower() == 'true'
+        self.profiling_token = os.getenv('PROFILING_TOKEN', '')
+        # OpenAI-compatible API for OpenWebUI (replaces the openwebui_proxy hop)
+        self.enable_openai_api = os.getenv('ENABLE_OPENAI_API', 'true').lower() == 'true'
 
 config = ServiceConfig()
 
@@ -106,6 +171,7 @@ class ChatRequest(BaseModel):
     use_parallel_processing: bool = Field(default=True, description="Enable parallel processing")
     use_data_cleaning: bool = Field(default=True, description="Enable data cleaning")
     stream: bool = Field(default=False, description="Enable streaming response")
+    debug: bool = Field(default=False, description="Include per-stage timings in the response")
     context: Optional[Dict[str, Any]] = Field(default=None, description="Additional context from conversation history")
 
 class ChatResponse(BaseModel):
@@ -131,6 +197,15 @@ class ChatResponse(BaseModel):
     suggested_followups: Optional[List[str]] = None
     conversation_turn: int = 1
     references_resolved: Optional[Dict] = None
+    
+    # Full result download for large answers
+    export: Optional[Dict] = None
+    
+    # Milliseconds per pipeline stage (debug only)
+    timings: Optional[Dict[str, float]] = None
+    
+    # cProfile of this request's pipeline (X-Profile header)
+    profile: Optional[Dict] = None
 
 
 class SystemStatus(BaseModel):
@@ -185,12 +260,32 @@ try:
     ai_agent.enable_parallel_processing = os.getenv('ENABLE_PARALLEL', 'true').lower() == 'true'
     ai_agent.enable_data_cleaning = os.getenv('ENABLE_CLEANING', 'true').lower() == 'true'
     ai_agent.enable_sql_validation = os.getenv('ENABLE_VALIDATION', 'true').lower() == 'true'
+    ai_agent.shared_state.flags.update(ai_agent.feature_flags())
     
     logger.info("✅ Ultimate AI System initialized successfully")
     logger.info(f"📊 Features: Memory={ai_agent.enable_conversation_memory}, "
                 f"Parallel={ai_agent.enable_parallel_processing}, "
                 f"Cleaning={ai_agent.enable_data_cleaning}, "
                 f"Validation={ai_agent.enable_sql_validation}")
+    if config.enable_profiling and not config.profiling_token:
+        logger.warning("⚠️ ENABLE_PROFILING=true without PROFILING_TOKEN: profiling endpoints are unauthenticated")
+    
+    # Per-fingerprint query histograms on /metrics
+    worker_collectors.append(QueryStatsCollector(ai_agent.db_handler.query_stats))
+    
+    # Per-stage latency and dependency concurrency on /metrics
+    ai_agent.instrumentation.observe_stage = observe_stage
+    ai_agent.instrumentation.observe_dependency = observe_dependency
+    ai_agent.ollama_client.usage.observe = observe_ollama_usage
+    
+    # Size of in-process per-user state (fallback memory only when Redis is down)
+    memory = ai_agent.conversation_memory
+    worker_collectors.append(ConversationMemoryCollector(
+        memory=None if memory.redis_available else memory.memory,
+        states=ai_agent.conversation_states
+    ))
+    for collector in worker_collectors:
+        REGISTRY.register(collector)
     
     AI_SYSTEM_AVAILABLE = True
     
@@ -228,14 +323,34 @@ async def lifespan(app: FastAPI):
     {'='*60}
     """)
     
+    # Per worker (after fork): span per stage and per Ollama / Postgres / Redis call
+    if setup_tracing('hvac-ai-service'):
+        ai_agent.instrumentation.span = span
+    
+    export_cleanup = asyncio.create_task(ai_agent.result_exports.run_cleanup())
+    snapshot_refresh = asyncio.create_task(collector_snapshots.run()) if collector_snapshots else None
+    ai_agent.conversation_memory.start()
+    ai_agent.shared_state.start()
+    
     yield  # ⬅️ ส่วนนี้สำคัญ! Application runs here
     
     # ========== SHUTDOWN ==========
     logger.info("Shutting down service...")
+    export_cleanup.cancel()
+    if snapshot_refresh:
+        snapshot_refresh.cancel()
     
     # Close database connections
     if hasattr(ai_agent, 'db_handler'):
         ai_agent.db_handler.close_connections()
+    if hasattr(ai_agent, 'fanout_executor'):
+        await ai_agent.fanout_executor.close()
+    
+    # Finish queued history writes and counters, then release the shared Redis pool
+    await ai_agent.conversation_memory.flush()
+    await ai_agent.shared_state.close()
+    await close_async_pools()
+    shutdown_tracing()
     
     logger.info("Service shutdown complete")
 
@@ -248,12 +363,47 @@ app = FastAPI(
     redoc_url="/redoc",
     openapi_tags=[
         {"name": "Chat", "description": "Main chat endpoints"},
+        {"name": "OpenAI", "description": "OpenAI-compatible endpoints for OpenWebUI"},
         {"name": "System", "description": "System monitoring and health"},
         {"name": "History", "description": "Conversation history management"},
+        {"name": "Results", "description": "Exported result downloads"},
         {"name": "Admin", "description": "Administrative functions"}
     ]
 )
 
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+
+ADMISSION_PATHS = ("/v1/chat", "/v1/chat/stream", "/v1/chat/completions")
+
+def observe_admission(tenant: str, outcome: str, wait_seconds: float, in_flight: int):
+    if outcome != 'released':
+        admission_total.labels(tenant=tenant, outcome=outcome).inc()
+    if outcome == 'admitted':
+        admission_wait.labels(tenant=tenant).observe(wait_seconds)
+    tenant_in_flight.labels(tenant=tenant).set(in_flight)
+
+def is_background_prompt(payload: Dict[str, Any]) -> bool:
+    """OpenWebUI background prompts are answered without the pipeline, so they skip admission"""
+    messages = payload.get('messages')
+    return isinstance(messages, list) and classify_background_task(extract_user_message(messages)) is not None
+
+admission = AdmissionController(
+    default_limits=TenantLimits(requests_per_minute=config.max_requests_per_minute),
+    observe=observe_admission
+)
+
+if config.rate_limit_enabled:
+    # Added before CORS so 429 responses still carry the CORS headers
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission,
+        paths=ADMISSION_PATHS,
+        resolve_tenant=get_tenant_id,
+        skip=is_background_prompt
+    )
+
 # Add CORS middleware if enabled
 if config.enable_cors:
     app.add_middleware(
@@ -262,8 +412,13 @@ if config.enable_cors:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Trace-Id", "Retry-After"],
     )
 
+# Outermost: the trace covers admission queueing; X-Trace-Id on every response
+if tracing_enabled():
+    app.add_middleware(TracingMiddleware)
+
 # =============================================================================
 # MAIN ENDPOINTS
 # =============================================================================
@@ -272,7 +427,9 @@ if config.enable_cors:
 async def chat_endpoint(
     request: ChatRequest,
     background_tasks: BackgroundTasks,
-    user_id: str = Depends(get_user_id)
+    user_id: str = Depends(get_user_id),
+    x_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None)
 ):
     """
     Main chat endpoint with all features
@@ -282,19 +439,22 @@ async def chat_endpoint(
     - Parallel processing for faster response
     - Real-time data cleaning
     - SQL validation and retry
+    
+    Header "X-Profile: 1" returns a cProfile summary of the pipeline in "profile"
+    (ENABLE_PROFILING=true, plus X-Admin-Token when PROFILING_TOKEN is set)
     """
     start_time = time.time()
     
     try:
         # Update metrics
         request_count.labels(endpoint='chat', status='processing').inc()
-        active_users.inc()
         
         # Override user_id if provided in header
         if user_id != "default":
             request.user_id = user_id
         
-        # Configure features for this request
+        # Configure features for this request (shared flags first, then per-request opt-outs)
+        ai_agent.apply_feature_flags()
         if not request.use_conversation_memory:
             ai_agent.enable_conversation_memory = False
         if not request.use_parallel_processing:
@@ -302,17 +462,24 @@ async def chat_endpoint(
         if not request.use_data_cleaning:
             ai_agent.enable_data_cleaning = False
         
-        # Process the question
-        result = await ai_agent.process_any_question(
-            question=request.question,
-            tenant_id=request.tenant_id,
-            user_id=request.user_id
-        )
+        # Process the question (under cProfile when asked for)
+        profile = None
+        if x_profile and x_profile.lower() in ('1', 'true', 'yes') and profiling_allowed(x_admin_token):
+            result, profiler = await profile_task(ai_agent.process_any_question(
+                question=request.question,
+                tenant_id=request.tenant_id,
+                user_id=request.user_id
+            ))
+            profile = {**summarize_profile(profiler), 'scope': 'task'}
+        else:
+            result = await ai_agent.process_any_question(
+                question=request.question,
+                tenant_id=request.tenant_id,
+                user_id=request.user_id
+            )
         
-        # Reset features to default
-        ai_agent.enable_conversation_memory = True
-        ai_agent.enable_parallel_processing = True
-        ai_agent.enable_data_cleaning = True
+        # Reset features to the shared flags
+        ai_agent.apply_feature_flags()
         
         # Prepare response
         response = ChatResponse(
@@ -327,7 +494,10 @@ async def chat_endpoint(
             intent=result.get('intent'),
             entities=result.get('entities'),
             data_quality=result.get('data_quality'),
-            features_used=result.get('features_used')
+            features_used=result.get('features_used'),
+            export=result.get('export'),
+            timings=result.get('timings') if request.debug or config.debug_timings else None,
+            profile=profile
         )
         
         # Update metrics
@@ -344,28 +514,18 @@ async def chat_endpoint(
         logger.error(f"Chat endpoint error: {e}")
         request_count.labels(endpoint='chat', status='error').inc()
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        active_users.dec()
 
 @app.post("/v1/chat/stream", tags=["Chat"])
 async def chat_stream_endpoint(request: ChatRequest):
     """
-    Fixed streaming endpoint with proper OpenAI format
+    Streaming endpoint with proper OpenAI format
+    Rows flow from a server-side cursor through the cleaner and table
+    formatter; each markdown chunk is sent as soon as it is rendered
     """
     if not config.enable_streaming:
         raise HTTPException(status_code=400, detail="Streaming is not enabled")
     async def generate():
         try:
-            # Process question
-            result = await ai_agent.process_any_question(
-                question=request.question,
-                tenant_id=request.tenant_id,
-                user_id=request.user_id
-            )
-            
-            answer = result.get('answer', '')
-            
             # ✅ Send initial chunk with role
             initial_chunk = {
                 "id": f"chatcmpl-{int(time.time())}",
@@ -380,11 +540,14 @@ async def chat_stream_endpoint(request: ChatRequest):
             }
             yield f"data: {json.dumps(initial_chunk)}\n\n"
             
-            # ✅ Stream content in chunks
-            chunk_size = 50
-            for i in range(0, len(answer), chunk_size):
-                chunk = answer[i:i + chunk_size]
-                
+            # ✅ Stream table chunks as the pipeline produces them
+            async for chunk in ai_agent.stream_any_question(
+                question=request.question,
+                tenant_id=request.tenant_id,
+                user_id=request.user_id
+            ):
+                if not chunk:
+                    continue
                 content_chunk = {
                     "id": f"chatcmpl-{int(time.time())}",
                     "object": "chat.completion.chunk", 
@@ -397,7 +560,6 @@ async def chat_stream_endpoint(request: ChatRequest):
                     }]
                 }
                 yield f"data: {json.dumps(content_chunk, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0.05)
             
             # ✅ Send completion chunk
             final_chunk = {
@@ -441,6 +603,25 @@ async def chat_stream_endpoint(request: ChatRequest):
             "X-Accel-Buffering": "no"
         }
     )
+
+# =============================================================================
+# OPENAI-COMPATIBLE ENDPOINTS
+# =============================================================================
+
+def observe_request(endpoint: str, status: str, seconds: float):
+    request_count.labels(endpoint=endpoint, status=status).inc()
+    response_time.labels(endpoint=endpoint).observe(seconds)
+
+def observe_background(task: str, seconds: float):
+    background_prompts.labels(task=task).inc()
+    response_time.labels(endpoint='background').observe(seconds)
+
+if config.enable_openai_api:
+    # /v1/chat/completions and /v1/models, same contract as openwebui_proxy
+    app.include_router(create_openai_router(
+        ai_agent, resolve_tenant=get_tenant_id, observe=observe_request, observe_background=observe_background
+    ))
+
 # =============================================================================
 # CONVERSATION HISTORY ENDPOINTS
 # =============================================================================
@@ -451,17 +632,13 @@ async def get_conversation_history(user_id: str, limit: int = 20):
     Get conversation history for a user
     """
     try:
-        conversations = list(ai_agent.conversation_memory.conversations[user_id])[-limit:]
+        conversations, total_count = await ai_agent.conversation_memory.get_history(user_id, limit)
         
         return ConversationHistory(
             user_id=user_id,
             conversations=conversations,
-            total_count=len(ai_agent.conversation_memory.conversations[user_id]),
-            session_stats={
-                'total_queries': len(conversations),
-                'successful_queries': sum(1 for c in conversations if c.get('success', False)),
-                'avg_processing_time': sum(c.get('processing_time', 0) for c in conversations) / max(len(conversations), 1)
-            }
+            total_count=total_count,
+            session_stats=session_stats(conversations)
         )
     except Exception as e:
         logger.error(f"Failed to get history: {e}")
@@ -473,8 +650,7 @@ async def clear_conversation_history(user_id: str):
     Clear conversation history for a user
     """
     try:
-        if user_id in ai_agent.conversation_memory.conversations:
-            ai_agent.conversation_memory.conversations[user_id].clear()
+        if await ai_agent.conversation_memory.clear_history(user_id):
             return {"message": f"History cleared for user {user_id}"}
         else:
             return {"message": f"No history found for user {user_id}"}
@@ -482,6 +658,50 @@ async def clear_conversation_history(user_id: str):
         logger.error(f"Failed to clear history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# =============================================================================
+# RESULT DOWNLOADS
+# =============================================================================
+
+@app.api_route("/v1/results/{result_id}", methods=["GET", "HEAD"], tags=["Results"])
+async def download_result(result_id: str, request: Request):
+    """
+    Download an exported result (CSV / JSON Lines / Parquet)
+    Supports single byte ranges for resumable downloads
+    """
+    info = ai_agent.result_exports.get(result_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    
+    size = info.size_bytes
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{info.filename}"',
+        'Cache-Control': f"private, max-age={max(int(info.expires_at - time.time()), 0)}",
+        'ETag': f'"{info.result_id}"'
+    }
+    
+    byte_range = parse_byte_range(request.headers.get('range'), size)
+    if byte_range is False:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{size}'})
+    
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    
+    if request.method == 'HEAD':
+        return Response(status_code=status_code, headers=headers, media_type=info.media_type)
+    
+    return StreamingResponse(
+        iter_file_range(ai_agent.result_exports.path_for(info), start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=info.media_type
+    )
+
 # =============================================================================
 # SYSTEM MONITORING ENDPOINTS
 # =============================================================================
@@ -498,6 +718,7 @@ async def health_check():
         "service": config.service_name,
         "version": config.version,
         "uptime_seconds": uptime,
+        "worker_pid": os.getpid(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -508,16 +729,18 @@ async def get_system_status():
     """
     try:
         stats = ai_agent.get_system_stats()
+        performance = await ai_agent.get_shared_performance()
         uptime = (datetime.now() - SERVICE_START_TIME).total_seconds()
         
+        ai_agent.apply_feature_flags()
         return SystemStatus(
             status="operational" if AI_SYSTEM_AVAILABLE else "degraded",
             version=config.version,
             uptime_seconds=uptime,
-            total_queries=stats['performance']['total_queries'],
-            success_rate=stats['performance']['success_rate'],
-            avg_response_time=stats['performance']['avg_response_time'],
-            active_features=stats['features'],
+            total_queries=performance['total_queries'],
+            success_rate=performance['success_rate'],
+            avg_response_time=performance['avg_response_time'],
+            active_features=ai_agent.feature_flags(),
             model_status={
                 'sql_model': stats['models']['sql_generation'],
                 'nl_model': stats['models']['response_generation']
@@ -535,7 +758,15 @@ async def get_prometheus_metrics():
     if not config.enable_metrics:
         raise HTTPException(status_code=404, detail="Metrics not enabled")
     
-    return generate_latest()
+    await update_active_users_metric()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Several gunicorn workers: merge every worker's metric files and the
+        # custom collectors' snapshots (summed over live workers)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(collector_snapshots)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 # =============================================================================
 # ADMIN ENDPOINTS
@@ -574,7 +805,8 @@ async def toggle_feature(feature: str, enabled: bool):
         raise HTTPException(status_code=400, detail=f"Invalid feature. Valid options: {valid_features}")
     
     try:
-        setattr(ai_agent, f"enable_{feature}", enabled)
+        # Stored in Redis: every worker applies it within SHARED_STATE_INTERVAL
+        await ai_agent.set_feature_flag(feature, enabled)
         
         return {
             "message": f"Feature '{feature}' {'enabled' if enabled else 'disabled'}",
@@ -589,6 +821,122 @@ async def toggle_feature(feature: str, enabled: bool):
         logger.error(f"Failed to toggle feature: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/v1/admin/query-stats", tags=["Admin"])
+async def get_query_stats(limit: int = 20, order_by: str = 'total_time'):
+    """
+    Top SQL fingerprints (application-side pg_stat_statements)
+    order_by: total_time, calls, mean_time, p95_time, p99_time, errors, mean_rows
+    """
+    try:
+        query_stats = ai_agent.db_handler.query_stats
+        return {
+            "summary": query_stats.summary(),
+            "order_by": order_by if order_by in query_stats.ORDER_FIELDS else 'total_time',
+            "queries": query_stats.top(limit, order_by),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to get query stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/v1/admin/admission", tags=["Admin"])
+async def get_admission_stats():
+    """
+    Per-tenant admission counters, in-flight and queued requests (this worker)
+    """
+    return {
+        "enabled": config.rate_limit_enabled,
+        **admission.get_stats(),
+        "limits": {
+            "default": vars(admission.default_limits),
+            **{tenant: vars(limits) for tenant, limits in admission.tenant_limits.items()}
+        },
+        "worker_pid": os.getpid(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/v1/admin/ollama-usage", tags=["Admin"])
+async def get_ollama_usage(limit: int = 20):
+    """
+    Ollama token usage (this worker): most expensive prompts, per-template
+    totals and recent model loads (evicted models being reloaded)
+    """
+    try:
+        return {
+            **ai_agent.ollama_client.usage.report(limit),
+            "worker_pid": os.getpid(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to get Ollama usage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# =============================================================================
+# PROFILING (this worker)
+# =============================================================================
+
+profiler = SamplingProfiler()
+
+def profiling_allowed(admin_token: Optional[str]) -> bool:
+    if not config.enable_profiling:
+        return False
+    return not config.profiling_token or hmac.compare_digest(admin_token or '', config.profiling_token)
+
+def require_profiling(x_admin_token: Optional[str] = Header(None)):
+    if not config.enable_profiling:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (ENABLE_PROFILING=false)")
+    if not profiling_allowed(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Token")
+
+@app.post("/v1/admin/profile/start", tags=["Admin"], dependencies=[Depends(require_profiling)])
+async def start_profile(seconds: float = 30, interval_ms: float = 5, memory: bool = False):
+    """
+    Sample the event-loop thread for `seconds` (capped by PROFILE_MAX_SECONDS);
+    memory=true also runs tracemalloc over the window. Only the worker that
+    receives this request is profiled
+    """
+    try:
+        started = profiler.start(seconds, interval_ms / 1000, trace_memory=memory)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**started, "worker_pid": os.getpid(), "timestamp": datetime.now().isoformat()}
+
+@app.post("/v1/admin/profile/stop", tags=["Admin"], dependencies=[Depends(require_profiling)])
+async def stop_profile(limit: int = 30):
+    """End the sampling window early and return the report"""
+    await asyncio.to_thread(profiler.stop)
+    return {**profiler.report(limit), "worker_pid": os.getpid()}
+
+@app.get("/v1/admin/profile", tags=["Admin"], dependencies=[Depends(require_profiling)])
+async def get_profile(limit: int = 30):
+    """
+    Sampling report: hottest functions by own samples (top_self) and by
+    samples anywhere on the stack (top_total), loop busy share, tracemalloc sites
+    """
+    return {**profiler.report(limit), "worker_pid": os.getpid()}
+
+@app.get("/v1/admin/profile/collapsed", tags=["Admin"], dependencies=[Depends(require_profiling)])
+async def get_profile_collapsed():
+    """Collapsed stacks for flamegraph.pl / speedscope"""
+    return PlainTextResponse(profiler.collapsed())
+
+@app.post("/v1/admin/customer-alias/rebuild", tags=["Admin"])
+async def rebuild_customer_alias():
+    """
+    Rebuild the customer_alias table from the views and reload SQL rewriting
+    """
+    try:
+        stats = await asyncio.to_thread(ai_agent.rebuild_customer_aliases)
+        return {
+            "message": "Customer alias rebuilt",
+            "build": stats,
+            "rewriter": ai_agent.customer_alias.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to rebuild customer alias: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/v1/admin/sql-examples", tags=["Admin"])
 async def get_sql_examples():
     """
@@ -608,6 +956,15 @@ async def get_sql_examples():
 # HELPER FUNCTIONS
 # =============================================================================
 
+def session_stats(conversations: List[Dict]) -> Dict:
+    """Summary of a user's conversation history"""
+    columns = ResultColumns(conversations)
+    return {
+        'total_queries': columns.row_count,
+        'successful_queries': columns.count_truthy('success'),
+        'avg_processing_time': columns.mean('processing_time')
+    }
+
 async def update_cache_metrics():
     """Update cache hit rate metric"""
     try:
@@ -616,6 +973,13 @@ async def update_cache_metrics():
     except Exception as e:
         logger.error(f"Failed to update cache metrics: {e}")
 
+async def update_active_users_metric():
+    """Refresh the active users gauge from the active_users index (scrape time)"""
+    try:
+        active_users.set(await ai_agent.conversation_memory.get_active_users())
+    except Exception as e:
+        logger.error(f"Failed to update active users metric: {e}")
+
 # =============================================================================
 # STARTUP AND SHUTDOWN EVENTS
 # =============================================================================
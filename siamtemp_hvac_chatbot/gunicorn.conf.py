@@ -0,0 +1,50 @@
+# gunicorn.conf.py
+"""
+Multi-worker deployment: gunicorn -c gunicorn.conf.py enhanced_multi_agent_service:app
+
+The app is imported once in the master (preload_app), so prompts, schema
+metadata, intent tables and the customer alias map are built once and
+shared copy-on-write by all workers. Per-worker sockets are closed before
+fork and reopened lazily. Counters, feature flags and conversation state
+are shared through Redis (agents/storage/shared_state.py)
+"""
+
+import gc
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+# n8n waits up to N8N_TIMEOUT (600 s) for an answer
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '620'))
+graceful_timeout = 30
+keepalive = 5
+
+# prometheus_client picks multi-process mode at import time, so the
+# directory has to exist (and be emptied of old pids) before the app loads
+_metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+def _service():
+    import enhanced_multi_agent_service
+    return enhanced_multi_agent_service
+
+def when_ready(server):
+    """Master, after preload and before the first fork"""
+    _service().ai_agent.prepare_for_fork()
+    # Keep the preloaded objects out of GC scans so workers don't dirty their pages
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded app shared by {workers} workers")
+
+def post_fork(server, worker):
+    _service().ai_agent.after_fork()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    from agents.utils.metrics_snapshots import remove_snapshot
+    multiprocess.mark_process_dead(worker.pid)
+    remove_snapshot(_metrics_dir, worker.pid)
@@ -0,0 +1,297 @@
+# openai_compat.py
+"""
+OpenAI-compatible chat API (/v1/chat/completions, /v1/models)
+
+create_openai_router() is mounted in enhanced_multi_agent_service.app so
+OpenWebUI can call the service directly: no proxy hop, no second JSON
+round trip, and streamed answers go out as the pipeline renders them.
+The request helpers (system-prompt blocking, message extraction, chunk
+format) are also used by openwebui_proxy.py when it runs on its own.
+
+OpenWebUI's background prompts (title, tags, follow-up suggestions, ...)
+never reach the pipeline: they are classified by a precompiled matcher and
+answered locally from the user's last question and intent
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# REQUEST HELPERS
+# =============================================================================
+
+class ChatCompletionRequest(BaseModel):
+    """OpenAI-compatible request format"""
+    model: str
+    messages: list
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 2000
+    stream: Optional[bool] = False
+
+# OpenWebUI background tasks (titles, tags, follow-up suggestions)
+SYSTEM_PROMPT_INDICATORS = (
+    "### Task:",
+    "### Guidelines:",
+    "### Output:",
+    "Suggest 3-5 relevant follow-up",
+    "follow_ups",
+    "<chat_history>",
+    "USER:",
+    "ASSISTANT:",
+    "JSON format:"
+)
+
+BLOCKED_PROMPT_ANSWER = '{"follow_ups": []}'
+
+_SYSTEM_PROMPT_RE = re.compile('|'.join(re.escape(indicator) for indicator in SYSTEM_PROMPT_INDICATORS))
+
+def is_system_prompt(message: str) -> bool:
+    """Detect OpenWebUI system prompts"""
+    if not message:
+        return False
+    return _SYSTEM_PROMPT_RE.search(message) is not None
+
+def extract_user_message(messages: list) -> str:
+    """Extract user message from OpenAI format"""
+    for msg in reversed(messages):
+        if isinstance(msg, dict):
+            if msg.get("role") == "user":
+                return msg.get("content", "")
+    return ""
+
+# =============================================================================
+# BACKGROUND TASKS
+# =============================================================================
+
+# Matched against the instructions (before <chat_history>); the task sentence
+# comes first, so the leftmost keyword decides ("title with an emoji" is a title)
+BACKGROUND_TASK_PATTERNS = {
+    'title': r'\btitle\b',
+    'tags': r'\btags\b',
+    'follow_ups': r'follow[-_ ]?ups?\b',
+    'queries': r'search quer',
+    'autocomplete': r'autocomplet',
+    'emoji': r'\bemoji\b'
+}
+
+_BACKGROUND_TASK_RE = re.compile(
+    '|'.join(f'(?P<{task}>{pattern})' for task, pattern in BACKGROUND_TASK_PATTERNS.items()),
+    re.IGNORECASE
+)
+_HISTORY_USER_RE = re.compile(r'^\s*USER:\s*(.+?)\s*$', re.MULTILINE)
+_INSTRUCTIONS_LIMIT = 2000
+
+def classify_background_task(message: str) -> Optional[str]:
+    """Background task type of an OpenWebUI system prompt ('other' if unknown), None for user questions"""
+    if not is_system_prompt(message):
+        return None
+    instructions = message.split('<chat_history>', 1)[0][:_INSTRUCTIONS_LIMIT]
+    match = _BACKGROUND_TASK_RE.search(instructions)
+    return match.lastgroup if match else 'other'
+
+def chat_history_question(message: str) -> str:
+    """First user question in the prompt's <chat_history> block"""
+    _, _, history = message.partition('<chat_history>')
+    match = _HISTORY_USER_RE.search(history)
+    return match.group(1) if match else ''
+
+def short_title(question: str, max_length: int = 40) -> str:
+    title = ' '.join(question.split())
+    if len(title) > max_length:
+        cut = title.rfind(' ', 0, max_length)
+        title = title[:cut if cut > max_length // 2 else max_length].rstrip() + '…'
+    return f"💬 {title}" if title else "💬 สนทนาใหม่"
+
+def intent_tags(intent: Optional[str]) -> List[str]:
+    tags = ['HVAC']
+    if intent and intent not in ('unknown', 'greeting'):
+        tags.append(intent.replace('_', ' ').title())
+    return tags
+
+def background_answer(task: str, question: str = '', intent: Optional[str] = None,
+                      followups: Optional[List[str]] = None) -> str:
+    """Content OpenWebUI expects for a background task"""
+    if task == 'title':
+        return json.dumps({"title": short_title(question)}, ensure_ascii=False)
+    if task == 'tags':
+        return json.dumps({"tags": intent_tags(intent)}, ensure_ascii=False)
+    if task == 'follow_ups':
+        return json.dumps({"follow_ups": followups or []}, ensure_ascii=False)
+    if task == 'queries':
+        return '{"queries": []}'
+    if task == 'autocomplete':
+        return '{"text": ""}'
+    if task == 'emoji':
+        return "💬"
+    return BLOCKED_PROMPT_ANSWER
+
+# =============================================================================
+# RESPONSE FORMAT
+# =============================================================================
+
+def completion_id() -> str:
+    return f"chatcmpl-{int(time.time())}"
+
+def completion(model: str, content: str, prompt: Optional[str] = None) -> Dict[str, Any]:
+    """Non-streaming chat.completion body (usage counts words; zero without a prompt)"""
+    prompt_tokens = len(prompt.split()) if prompt is not None else 0
+    completion_tokens = len(content.split()) if prompt is not None else 0
+    return {
+        "id": completion_id(),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+def completion_chunk(model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+    """One chat.completion.chunk as a server-sent event"""
+    chunk = {
+        "id": completion_id(),
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+def single_answer_stream(model: str, content: str):
+    """A whole answer as a chunk stream (role, content, stop, [DONE])"""
+    yield completion_chunk(model, {"role": "assistant", "content": ""})
+    yield completion_chunk(model, {"content": content})
+    yield completion_chunk(model, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+# =============================================================================
+# IN-PROCESS ROUTER
+# =============================================================================
+
+async def answer_background_task(agent, task: str, user_id: str, message: str) -> str:
+    """Answer a background prompt from the user's last turn (agent.last_turn)"""
+    if task not in ('title', 'tags', 'follow_ups'):
+        return background_answer(task)
+    history_question = chat_history_question(message)
+    # A title needs no intent, so skip detection when nothing is cached
+    turn = await agent.last_turn(user_id, history_question if task != 'title' else '')
+    followups = agent.context_handler.suggest_followups(turn) if task == 'follow_ups' and turn.question else []
+    return background_answer(task, turn.question or history_question, turn.intent, followups)
+
+def create_openai_router(agent, resolve_tenant: Callable[[Optional[str]], str],
+                         observe: Optional[Callable[[str, str, float], None]] = None,
+                         observe_background: Optional[Callable[[str, float], None]] = None) -> APIRouter:
+    """
+    Endpoints answered by the agent in this process
+    resolve_tenant(header_value) returns a known tenant id;
+    observe(endpoint, status, seconds) feeds the service metrics,
+    observe_background(task, seconds) counts background prompts kept off the pipeline
+    """
+    router = APIRouter(tags=["OpenAI"])
+    model_name = os.getenv('OPENAI_MODEL_NAME', 'AI')
+    force_tenant = os.getenv('FORCE_TENANT')
+    block_system_prompts = os.getenv('BLOCK_SYSTEM_PROMPTS', 'true').lower() == 'true'
+
+    def record(status: str, start: float):
+        if observe:
+            observe('chat_completions', status, time.time() - start)
+
+    async def stream_answer(question: str, tenant_id: str, user_id: str, model: str, start: float):
+        yield completion_chunk(model, {"role": "assistant", "content": ""})
+        try:
+            async for chunk in agent.stream_any_question(question=question, tenant_id=tenant_id, user_id=user_id):
+                if chunk:
+                    yield completion_chunk(model, {"content": chunk})
+            yield completion_chunk(model, {}, "stop")
+            record('success', start)
+        except Exception as e:
+            logger.error(f"Streaming error: {e}")
+            yield completion_chunk(model, {"content": f"เกิดข้อผิดพลาด: {str(e)}"}, "stop")
+            record('error', start)
+        yield "data: [DONE]\n\n"
+
+    @router.post("/v1/chat/completions")
+    async def chat_completions(
+        request: ChatCompletionRequest,
+        x_tenant_id: Optional[str] = Header(None),
+        x_user_id: Optional[str] = Header(None),
+        x_openwebui_user_id: Optional[str] = Header(None)
+    ):
+        """OpenAI-compatible chat, answered in-process"""
+        start = time.time()
+        tenant_id = resolve_tenant(force_tenant or x_tenant_id)
+        user_id = x_user_id or x_openwebui_user_id or "openwebui_user"
+
+        user_message = extract_user_message(request.messages)
+        if not user_message:
+            raise HTTPException(400, "No user message found")
+
+        task = classify_background_task(user_message) if block_system_prompts else None
+        if task:
+            content = await answer_background_task(agent, task, user_id, user_message)
+            if observe_background:
+                observe_background(task, time.time() - start)
+            logger.debug(f"⚡ Background {task} prompt from {user_id} answered locally")
+            if request.stream:
+                return StreamingResponse(single_answer_stream(request.model, content),
+                                         media_type="text/event-stream", headers=SSE_HEADERS)
+            return completion(request.model, content)
+
+        logger.info(f"📨 OpenAI request for {tenant_id}: {user_message[:50]}...")
+        agent.apply_feature_flags()
+
+        if request.stream:
+            return StreamingResponse(
+                stream_answer(user_message, tenant_id, user_id, request.model, start),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+
+        try:
+            result = await agent.process_any_question(question=user_message, tenant_id=tenant_id, user_id=user_id)
+            record('success', start)
+            answer = result.get('answer', 'ไม่สามารถประมวลผลได้')
+        except Exception as e:
+            logger.error(f"Chat completion error: {e}", exc_info=True)
+            record('error', start)
+            answer = f"ขออภัย เกิดข้อผิดพลาด: {str(e)}"
+        return completion(request.model, answer, user_message)
+
+    @router.get("/v1/models")
+    async def list_models(x_tenant_id: Optional[str] = Header(None)):
+        """List available models"""
+        tenant_id = resolve_tenant(force_tenant or x_tenant_id)
+        return {
+            "object": "list",
+            "data": [{
+                "id": model_name,
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": f"siamtemp-{tenant_id}"
+            }]
+        }
+
+    return router
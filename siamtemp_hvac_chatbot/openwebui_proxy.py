@@ -6,17 +6,26 @@ OpenWebUI Proxy with n8n Workflow Integration
 
 import os
 import json
+import time
 import asyncio
 import aiohttp
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 from typing import Dict, Any, Optional
 import uvicorn
 from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
-from pydantic import BaseModel
 import logging
 
+from replica_router import ReplicaRouter
+from tracing import TracingMiddleware, setup_tracing, shutdown_tracing, tracing_enabled, span, inject_headers
+from openai_compat import (
+    ChatCompletionRequest, SSE_HEADERS, extract_user_message, completion, completion_chunk,
+    classify_background_task, chat_history_question, background_answer, single_answer_stream
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -28,6 +37,16 @@ class ProxyConfig:
     def __init__(self):
         # Main service URL
         self.main_service_url = os.getenv('MAIN_SERVICE_URL', 'http://hvac-ai-service:5000')
+        # Replicas of the main service (comma separated); users are pinned by consistent hash
+        self.main_service_urls = [
+            url.strip() for url in os.getenv('MAIN_SERVICE_URLS', self.main_service_url).split(',') if url.strip()
+        ]
+        self.routing_load_factor = float(os.getenv('ROUTING_LOAD_FACTOR', '1.25'))
+        self.routing_vnodes = int(os.getenv('ROUTING_VNODES', '160'))
+        self.replica_health_interval = float(os.getenv('REPLICA_HEALTH_INTERVAL', '10'))
+        # One pooled client session per process (keep-alive to replicas and n8n)
+        self.http_pool_size = int(os.getenv('PROXY_HTTP_POOL_SIZE', '100'))
+        self.http_pool_per_host = int(os.getenv('PROXY_HTTP_POOL_PER_HOST', '50'))
         self.default_tenant = os.getenv('DEFAULT_TENANT', 'company-a')
         self.force_tenant = os.getenv('FORCE_TENANT')
         self.port = int(os.getenv('PROXY_PORT', '8001'))
@@ -38,14 +57,65 @@ class ProxyConfig:
         self.n8n_webhook_path = 'webhook/siamtemp-chat'  # path ของ webhook ใน n8n
         self.n8n_timeout = int(os.getenv('N8N_TIMEOUT', '600'))
         self.n8n_fallback_to_direct = os.getenv('N8N_FALLBACK_TO_DIRECT', 'true').lower() == 'true'
+        # sequential: n8n, then direct on failure; race: direct starts after the hedge delay
+        # (n8n's measured p95 once N8N_HEDGE_MIN_SAMPLES calls are known, never below
+        # N8N_HEDGE_DELAY) - a hedged question runs the whole pipeline twice
+        self.n8n_dispatch_mode = os.getenv('N8N_DISPATCH_MODE', 'sequential').lower()
+        self.n8n_hedge_delay = float(os.getenv('N8N_HEDGE_DELAY', '30'))
+        self.n8n_hedge_min_samples = int(os.getenv('N8N_HEDGE_MIN_SAMPLES', '20'))
+        # Part of the deadline n8n may not use, so the direct fallback still has time
+        self.direct_fallback_reserve = float(os.getenv('DIRECT_FALLBACK_RESERVE', '120'))
+        # Whole-request budget shared by n8n and the direct call
+        self.request_deadline = float(os.getenv(
+            'REQUEST_DEADLINE', str(self.n8n_timeout + self.direct_fallback_reserve)
+        ))
         self.block_system_prompts = os.getenv('BLOCK_SYSTEM_PROMPTS', 'true').lower() == 'true'
+        # Tags / follow-ups ask the service's fast path (last intent); give up after this
+        self.background_timeout = float(os.getenv('BACKGROUND_PROMPT_TIMEOUT', '2'))
         # Tenant configurations
         self.tenant_configs = {
             'company-a': {'name': 'siamtemp Bangkok HQ', 'model': 'AI', 'language': 'th'},
         }
 
 config = ProxyConfig()
-app = FastAPI(title="OpenWebUI Proxy", version="2.0.0")
+router = ReplicaRouter(
+    config.main_service_urls,
+    vnodes=config.routing_vnodes,
+    load_factor=config.routing_load_factor,
+    health_interval=config.replica_health_interval
+)
+
+_sessions: Dict[bool, aiohttp.ClientSession] = {}
+
+def get_session(cancellable: bool = False) -> aiohttp.ClientSession:
+    """
+    Shared pooled session (created on first use in the running loop)
+    cancellable=True is for calls a race may cancel: they don't reuse
+    connections, since aiohttp 3.9 can return a cancelled request's
+    connection to the pool and the next request then waits behind it
+    """
+    session = _sessions.get(cancellable)
+    if session is None or session.closed:
+        keepalive = {'force_close': True} if cancellable else {'keepalive_timeout': 30}
+        session = _sessions[cancellable] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=config.http_pool_size,
+            limit_per_host=config.http_pool_per_host,
+            ttl_dns_cache=300,
+            **keepalive
+        ))
+    return session
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_tracing('openwebui-proxy')
+    router.start(get_session)
+    yield
+    await router.close()
+    for session in _sessions.values():
+        await session.close()
+    shutdown_tracing()
+
+app = FastAPI(title="OpenWebUI Proxy", version="2.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware, 
@@ -55,27 +125,21 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-# =============================================================================
-# REQUEST MODELS
-# =============================================================================
-
-class ChatCompletionRequest(BaseModel):
-    """OpenAI-compatible request format"""
-    model: str
-    messages: list
-    temperature: Optional[float] = 0.7
-    max_tokens: Optional[int] = 2000
-    stream: Optional[bool] = False
+# Trace starts here (or continues OpenWebUI's traceparent) and follows the request to the service
+if tracing_enabled():
+    app.add_middleware(TracingMiddleware)
 
 # =============================================================================
 # N8N WORKFLOW INTEGRATION (เพิ่มใหม่)
 # =============================================================================
 
-async def call_n8n_workflow(message: str, tenant_id: str, user_id: str = "default") -> Optional[Dict]:
-    """Call n8n workflow for processing"""
+async def call_n8n_workflow(message: str, tenant_id: str, user_id: str = "default",
+                            timeout: Optional[float] = None, cancellable: bool = False) -> Optional[Dict]:
+    """Call n8n workflow for processing (timeout: seconds left before the request deadline)"""
     
     if not config.use_n8n_workflow:
         return None
+    timeout = min(config.n8n_timeout, timeout) if timeout is not None else config.n8n_timeout
     
     webhook_url = f"{config.n8n_base_url}/{config.n8n_webhook_path}"
     
@@ -93,13 +157,15 @@ async def call_n8n_workflow(message: str, tenant_id: str, user_id: str = "defaul
         logger.info(f"🔄 Calling n8n workflow at: {webhook_url}")
         logger.debug(f"Sending payload: {json.dumps(payload, indent=2)}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        with span('n8n.workflow', {'http.url': webhook_url, 'tenant': tenant_id}, kind='client') as n8n_span:
+            async with get_session(cancellable).post(
                 webhook_url,
                 json=payload,  # ✅ ใช้ json= แค่ครั้งเดียว
-                headers={"Content-Type": "application/json"},
-                timeout=aiohttp.ClientTimeout(total=config.n8n_timeout)
+                headers=inject_headers({"Content-Type": "application/json"}),
+                timeout=aiohttp.ClientTimeout(total=timeout)
             ) as response:
+                if n8n_span is not None:
+                    n8n_span.set_attribute('http.status_code', response.status)
                 
                 if response.status == 200:
                     result = await response.json()
@@ -110,9 +176,9 @@ async def call_n8n_workflow(message: str, tenant_id: str, user_id: str = "defaul
                     if config.n8n_fallback_to_direct:
                         logger.info("⚠️ Falling back to direct service call")
                     return None
-                    
+                
     except asyncio.TimeoutError:
-        logger.error(f"⏱️ n8n workflow timeout after {config.n8n_timeout}s")
+        logger.error(f"⏱️ n8n workflow timeout after {timeout:.0f}s")
         return None
     except Exception as e:
         logger.error(f"❌ n8n workflow error: {e}")
@@ -123,47 +189,270 @@ async def call_n8n_workflow(message: str, tenant_id: str, user_id: str = "defaul
 # EXISTING FUNCTIONS (ไม่เปลี่ยน)
 # =============================================================================
 
-async def call_main_service(endpoint: str, payload: dict, stream: bool = False):
-    """Direct call to main AI service"""
-    url = f"{config.main_service_url}{endpoint}"
-    
-    try:
-        async with aiohttp.ClientSession() as session:
+async def call_main_service(endpoint: str, payload: dict, stream: bool = False,
+                            timeout: Optional[float] = None, cancellable: bool = False,
+                            route_key: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+    """
+    Call the main AI service on the replica the user is pinned to
+    (tenant_id, user_id from the payload unless route_key is given);
+    connection failures move on to the next replica on the ring
+    """
+    route_key = route_key or router.route_key(payload.get('tenant_id', config.default_tenant),
+                                              payload.get('user_id', 'default'))
+    headers = {"Content-Type": "application/json", **(headers or {})}
+    tried = []
+    while True:
+        replica = router.acquire(route_key, exclude=tried)
+        if replica is None:
+            error = "No main service replica reachable"
+            yield json.dumps({"error": error}).encode() if stream else {"error": error}
+            return
+        tried.append(replica.url)
+        url = f"{replica.url}{endpoint}"
+
+        # Not the current span: this generator yields inside it
+        call_span = span('main_service', {'http.url': url, 'replica': replica.url, 'route_key': route_key},
+                         kind='client', current=False)
+        try:
+            session = get_session(cancellable)
             if stream:
-                async with session.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=aiohttp.ClientTimeout(total=120)
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            if line:
-                                yield line
-                    else:
-                        logger.error(f"Service error: {response.status}")
-                        error_msg = json.dumps({"error": f"Service error: {response.status}"})
-                        yield error_msg.encode()
+                try:
+                    with call_span as active:
+                        async with session.post(
+                            url,
+                            json=payload,
+                            headers=inject_headers(headers, parent=active),
+                            timeout=aiohttp.ClientTimeout(total=timeout or 120)
+                        ) as response:
+                            if response.status == 200:
+                                async for line in response.content:
+                                    if line:
+                                        yield line
+                            else:
+                                logger.error(f"Service error: {response.status}")
+                                error_msg = json.dumps({"error": f"Service error: {response.status}"})
+                                yield error_msg.encode()
+                finally:
+                    router.release(replica)
             else:
-                async with session.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=aiohttp.ClientTimeout(total=600)
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        yield result
-                    else:
-                        yield {"error": f"Service error: {response.status}"}
-                        
-    except Exception as e:
-        logger.error(f"Service call error: {e}")
-        if stream:
-            error_msg = json.dumps({"error": str(e)})
-            yield error_msg.encode()
+                try:
+                    with call_span as active:
+                        async with session.post(
+                            url,
+                            json=payload,
+                            headers=inject_headers(headers, parent=active),
+                            timeout=aiohttp.ClientTimeout(total=timeout or 600)
+                        ) as response:
+                            if response.status == 200:
+                                result = await response.json()
+                            else:
+                                result = {"error": f"Service error: {response.status}"}
+                finally:
+                    # Free the slot before handing back - callers stop after one item
+                    router.release(replica)
+                yield result
+            return
+
+        except aiohttp.ClientConnectorError as e:
+            # Nothing was sent, so another replica can take the request
+            router.mark_failed(replica, str(e))
+            logger.warning(f"🔀 {replica.url} unreachable, rerouting {route_key}")
+        except Exception as e:
+            logger.error(f"Service call error: {e}")
+            if stream:
+                error_msg = json.dumps({"error": str(e)})
+                yield error_msg.encode()
+            else:
+                yield {"error": str(e)}
+            return
+
+# =============================================================================
+# N8N / DIRECT DISPATCH
+# =============================================================================
+
+class DispatchStats:
+    """Per-path attempts, wins and latency (recent successful calls)"""
+    
+    PATHS = ('n8n', 'direct')
+    
+    def __init__(self, window: int = 500):
+        self.paths = {
+            path: {'attempts': 0, 'wins': 0, 'failures': 0, 'cancelled': 0, 'latency': deque(maxlen=window)}
+            for path in self.PATHS
+        }
+    
+    def attempt(self, path: str):
+        self.paths[path]['attempts'] += 1
+    
+    def finish(self, path: str, ok: bool, seconds: float):
+        if ok:
+            self.paths[path]['latency'].append(seconds)
         else:
-            yield {"error": str(e)}
+            self.paths[path]['failures'] += 1
+    
+    def cancel(self, path: str):
+        self.paths[path]['cancelled'] += 1
+    
+    def win(self, path: str):
+        self.paths[path]['wins'] += 1
+    
+    def percentile(self, path: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Latency percentile of recent successful calls (None below min_samples)"""
+        latency = sorted(self.paths[path]['latency'])
+        if len(latency) < max(min_samples, 1):
+            return None
+        return latency[min(int(len(latency) * q), len(latency) - 1)]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        total_wins = sum(p['wins'] for p in self.paths.values()) or 1
+        result = {}
+        for path, p in self.paths.items():
+            latency = sorted(p['latency'])
+            result[path] = {
+                'attempts': p['attempts'],
+                'wins': p['wins'],
+                'failures': p['failures'],
+                'cancelled': p['cancelled'],
+                'win_rate': round(p['wins'] / total_wins, 3),
+                'latency_p50_ms': round(latency[len(latency) // 2] * 1000, 1) if latency else None,
+                'latency_p95_ms': round(latency[int(len(latency) * 0.95)] * 1000, 1) if latency else None
+            }
+        return result
+
+dispatch_stats = DispatchStats()
+
+def hedge_delay() -> float:
+    """Seconds to wait for n8n before also asking the direct service"""
+    p95 = dispatch_stats.percentile('n8n', 0.95, config.n8n_hedge_min_samples)
+    return max(config.n8n_hedge_delay, p95 or 0.0)
+
+def n8n_budget(deadline: float) -> float:
+    """Time n8n may use, keeping DIRECT_FALLBACK_RESERVE for the direct fallback"""
+    if not config.n8n_fallback_to_direct:
+        return remaining(deadline)
+    return max(0.001, remaining(deadline) - config.direct_fallback_reserve)
+
+def remaining(deadline: float) -> float:
+    """Seconds left before the request deadline (monotonic clock)"""
+    return max(0.001, deadline - time.monotonic())
+
+def succeeded(result: Any) -> bool:
+    return bool(result) and not (isinstance(result, dict) and 'error' in result)
+
+async def timed_call(path: str, coro):
+    """Run one dispatch path and record its outcome"""
+    dispatch_stats.attempt(path)
+    start = time.monotonic()
+    try:
+        result = await coro
+    except asyncio.CancelledError:
+        dispatch_stats.cancel(path)
+        raise
+    except Exception as e:
+        logger.error(f"{path} path error: {e}")
+        result = None
+    dispatch_stats.finish(path, succeeded(result), time.monotonic() - start)
+    return result
+
+async def call_main_service_once(payload: dict, timeout: float, cancellable: bool = False):
+    async for result in call_main_service("/v1/chat", payload, timeout=timeout, cancellable=cancellable):
+        return result
+
+async def race_n8n_and_direct(message: str, tenant_id: str, user_id: str,
+                              payload: dict, deadline: float) -> Optional[Dict]:
+    """
+    Start n8n, then the direct service after hedge_delay() (or as soon as
+    n8n fails); the first successful answer wins and the other is cancelled
+    Cancelling only drops the HTTP call - a hedged question still finishes in
+    the service, so the delay tracks n8n's p95 to hedge only the slow tail
+    """
+    n8n_call = call_n8n_workflow(message, tenant_id, user_id, remaining(deadline), cancellable=True)
+    tasks = {asyncio.create_task(timed_call('n8n', n8n_call)): 'n8n'}
+    delay = hedge_delay()
+    hedge_at = time.monotonic() + delay
+    direct_started = False
+    fallback = None
+    
+    def start_direct():
+        nonlocal direct_started
+        direct_started = True
+        tasks[asyncio.create_task(
+            timed_call('direct', call_main_service_once(payload, remaining(deadline), cancellable=True))
+        )] = 'direct'
+    
+    try:
+        while tasks and time.monotonic() < deadline:
+            wait_for = remaining(deadline) if direct_started else max(0.0, hedge_at - time.monotonic())
+            done, _ = await asyncio.wait(list(tasks), timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            if not done and not direct_started:
+                logger.info(f"⏱️ n8n slower than {delay:.1f}s, starting direct path")
+                start_direct()
+                continue
+            for task in done:
+                path = tasks.pop(task)
+                result = task.result()
+                if succeeded(result):
+                    dispatch_stats.win(path)
+                    logger.info(f"🏁 {path} answered first")
+                    return result
+                fallback = result or fallback
+            if not direct_started:
+                start_direct()
+        return fallback
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# =============================================================================
+# BACKGROUND PROMPTS (OpenWebUI titles, tags, follow-ups)
+# =============================================================================
+
+background_stats = Counter()
+# Last question forwarded per user, for titles
+recent_questions: "OrderedDict[str, str]" = OrderedDict()
+RECENT_QUESTIONS_MAX = 10000
+
+def remember_question(route_key: str, question: str):
+    recent_questions[route_key] = question
+    recent_questions.move_to_end(route_key)
+    if len(recent_questions) > RECENT_QUESTIONS_MAX:
+        recent_questions.popitem(last=False)
+
+def background_summary() -> Dict[str, Any]:
+    """Background prompts answered without the pipeline, by task"""
+    tasks = {k: v for k, v in background_stats.items() if k not in ('pipeline', 'forwarded')}
+    answered = sum(tasks.values())
+    total = answered + background_stats['pipeline']
+    return {
+        "by_task": tasks,
+        "forwarded_to_service": background_stats['forwarded'],
+        "pipeline_requests": background_stats['pipeline'],
+        "pipeline_share_avoided": round(answered / total, 3) if total else 0.0
+    }
+
+async def answer_background_prompt(task: str, tenant_id: str, user_id: str, message: str) -> str:
+    """
+    Titles and the rest are answered here; tags and follow-ups need the
+    user's last intent, so they go to the service's fast path on the
+    user's replica (no pipeline there either)
+    """
+    route_key = router.route_key(tenant_id, user_id)
+    if task in ('tags', 'follow_ups'):
+        async for result in call_main_service(
+            "/v1/chat/completions",
+            {"model": "AI", "messages": [{"role": "user", "content": message}]},
+            timeout=config.background_timeout,
+            route_key=route_key,
+            headers={"X-Tenant-Id": tenant_id, "X-User-Id": user_id}
+        ):
+            if isinstance(result, dict) and result.get('choices'):
+                background_stats['forwarded'] += 1
+                return result['choices'][0]['message']['content']
+            break
+    question = recent_questions.get(route_key) or chat_history_question(message)
+    return background_answer(task, question)
 
 # =============================================================================
 # HELPER FUNCTIONS
@@ -177,48 +466,21 @@ def get_tenant_id(x_tenant_id: Optional[str] = None) -> str:
         return x_tenant_id
     return config.default_tenant
 
-def extract_user_message(messages: list) -> str:
-    """Extract user message from OpenAI format"""
-    for msg in reversed(messages):
-        if isinstance(msg, dict):
-            if msg.get("role") == "user":
-                return msg.get("content", "")
-    return ""
-
 # =============================================================================
 # MAIN ENDPOINT WITH N8N SUPPORT (แก้ไข)
 # =============================================================================
 
-def is_system_prompt(message: str) -> bool:
-    """Detect OpenWebUI system prompts"""
-    if not message:
-        return False
-    
-    system_indicators = [
-        "### Task:",
-        "### Guidelines:",
-        "### Output:",
-        "Suggest 3-5 relevant follow-up",
-        "follow_ups",
-        "<chat_history>",
-        "USER:",
-        "ASSISTANT:",
-        "JSON format:"
-    ]
-    
-    return any(indicator in message for indicator in system_indicators)
-
 @app.post("/v1/chat/completions")
 async def chat_completions(
     request: ChatCompletionRequest,
     x_tenant_id: Optional[str] = Header(None),
-    x_user_id: Optional[str] = Header(None)
+    x_user_id: Optional[str] = Header(None),
+    x_openwebui_user_id: Optional[str] = Header(None)
 ):
     """OpenAI-compatible endpoint with n8n workflow support"""
     
     tenant_id = get_tenant_id(x_tenant_id)
-    user_id = x_user_id or "openwebui_user"
-    tenant_config = config.tenant_configs.get(tenant_id, config.tenant_configs['company-a'])
+    user_id = x_user_id or x_openwebui_user_id or "openwebui_user"
     
     try:
         # ✅ Extract message เพียงครั้งเดียว
@@ -226,170 +488,90 @@ async def chat_completions(
         if not user_message:
             raise HTTPException(400, "No user message found")
         
-        # ✅ Safety check ทันทีหลังได้ message
-        if config.block_system_prompts and is_system_prompt(user_message):
-            logger.warning(f"🚫 Blocked system prompt from {user_id}: {user_message[:100]}...")
-            
-            # Return empty response for system prompts
-            return {
-                "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-                "object": "chat.completion",
-                "created": int(datetime.now().timestamp()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": '{"follow_ups": []}'  # Return empty JSON for follow-up requests
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
-            }
+        # ✅ OpenWebUI background prompts never reach n8n or the pipeline
+        task = classify_background_task(user_message) if config.block_system_prompts else None
+        if task:
+            content = await answer_background_prompt(task, tenant_id, user_id, user_message)
+            background_stats[task] += 1
+            logger.debug(f"⚡ Background {task} prompt from {user_id} answered without the pipeline")
+            if request.stream:
+                return StreamingResponse(single_answer_stream(request.model, content),
+                                         media_type="text/event-stream", headers=SSE_HEADERS)
+            return completion(request.model, content)
         
         logger.info(f"📨 Valid request for {tenant_id}: {user_message[:50]}...")
+        background_stats['pipeline'] += 1
+        remember_question(router.route_key(tenant_id, user_id), user_message)
+        
+        deadline = time.monotonic() + config.request_deadline
+        service_payload = {
+            "question": user_message,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "stream": request.stream
+        }
         
-        # ========== Try n8n workflow first (ถ้าเปิดใช้งาน) ==========
         result = None
-        if config.use_n8n_workflow:
+        if config.use_n8n_workflow and config.n8n_dispatch_mode == 'race' and config.n8n_fallback_to_direct:
+            # ========== Race n8n and the direct service ==========
+            logger.info("🔄 Racing n8n workflow and direct service...")
+            result = await race_n8n_and_direct(user_message, tenant_id, user_id, service_payload, deadline)
+            if not result:
+                result = {"error": "No answer before the request deadline"}
+        
+        elif config.use_n8n_workflow:
+            # ========== Try n8n workflow first (ถ้าเปิดใช้งาน) ==========
             logger.info("🔄 Attempting n8n workflow processing...")
-            n8n_result = await call_n8n_workflow(user_message, tenant_id, user_id)
+            n8n_result = await timed_call(
+                'n8n', call_n8n_workflow(user_message, tenant_id, user_id, n8n_budget(deadline))
+            )
             
             if n8n_result:
                 result = n8n_result
+                dispatch_stats.win('n8n')
                 logger.info("✅ Using n8n workflow response")
             elif config.n8n_fallback_to_direct:
                 logger.info("⚠️ n8n failed, falling back to direct service")
             else:
                 raise HTTPException(503, "n8n workflow unavailable and fallback disabled")
         
+        # ========== Streaming: pass the service's OpenAI chunks straight through ==========
+        if request.stream and not result:
+            return StreamingResponse(
+                call_main_service("/v1/chat/stream", service_payload, stream=True, timeout=remaining(deadline)),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        
         # ========== Direct service call (ถ้าไม่ใช้ n8n หรือ fallback) ==========
         if not result:
-            service_payload = {
-                "question": user_message,
-                "tenant_id": tenant_id,
-                "user_id": user_id,
-                "stream": request.stream
-            }
-            
-            endpoint = "/v1/chat/stream" if request.stream else "/v1/chat"
-            
-            async for chunk in call_main_service(endpoint, service_payload, request.stream):
-                result = chunk
-                break
+            result = await timed_call('direct', call_main_service_once(service_payload, remaining(deadline)))
+            if succeeded(result):
+                dispatch_stats.win('direct')
+        
+        answer = result.get('answer', 'ไม่สามารถประมวลผลได้') if isinstance(result, dict) else str(result)
         
-        # ========== Format response ==========
         if request.stream:
-            # Streaming response
+            # n8n answers arrive whole; re-chunk them
             async def generate():
-                try:
-                    # Send initial chunk
-                    initial_chunk = {
-                        "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(datetime.now().timestamp()),
-                        "model": request.model,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"role": "assistant", "content": ""},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(initial_chunk)}\n\n"
-                    
-                    # Stream the answer
-                    answer = result.get('answer', '') if isinstance(result, dict) else str(result)
-                    chunk_size = 50
-                    
-                    for i in range(0, len(answer), chunk_size):
-                        chunk = answer[i:i + chunk_size]
-                        stream_chunk = {
-                            "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-                            "object": "chat.completion.chunk",
-                            "created": int(datetime.now().timestamp()),
-                            "model": request.model,
-                            "choices": [{
-                                "index": 0,
-                                "delta": {"content": chunk},
-                                "finish_reason": None
-                            }]
-                        }
-                        yield f"data: {json.dumps(stream_chunk)}\n\n"
-                        await asyncio.sleep(0.05)
-                    
-                    # Send completion
-                    final_chunk = {
-                        "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(datetime.now().timestamp()),
-                        "model": request.model,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {},
-                            "finish_reason": "stop"
-                        }]
-                    }
-                    yield f"data: {json.dumps(final_chunk)}\n\n"
-                    yield "data: [DONE]\n\n"
-                    
-                except Exception as e:
-                    logger.error(f"Streaming error: {e}")
-                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield completion_chunk(request.model, {"role": "assistant", "content": ""})
+                chunk_size = 50
+                for i in range(0, len(answer), chunk_size):
+                    yield completion_chunk(request.model, {"content": answer[i:i + chunk_size]})
+                    await asyncio.sleep(0.05)
+                yield completion_chunk(request.model, {}, "stop")
+                yield "data: [DONE]\n\n"
             
-            return StreamingResponse(
-                generate(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"
-                }
-            )
+            return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
         
-        else:
-            # Non-streaming response
-            answer = result.get('answer', 'ไม่สามารถประมวลผลได้') if isinstance(result, dict) else str(result)
-            
-            return {
-                "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-                "object": "chat.completion",
-                "created": int(datetime.now().timestamp()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": answer
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": len(user_message.split()),
-                    "completion_tokens": len(answer.split()),
-                    "total_tokens": len(user_message.split()) + len(answer.split())
-                }
-            }
+        return completion(request.model, answer, user_message)
             
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
-        
-        return {
-            "id": f"chatcmpl-{int(datetime.now().timestamp())}",
-            "object": "chat.completion",
-            "created": int(datetime.now().timestamp()),
-            "model": request.model,
-            "choices": [{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": f"ขออภัย เกิดข้อผิดพลาด: {str(e)}"
-                },
-                "finish_reason": "stop"
-            }],
-            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
-        }
+        return completion(request.model, f"ขออภัย เกิดข้อผิดพลาด: {str(e)}")
+
 # =============================================================================
 # HEALTH CHECK WITH N8N STATUS (แก้ไข)
 # =============================================================================
@@ -398,27 +580,20 @@ async def chat_completions(
 async def health():
     """Health check endpoint with n8n status"""
     
-    # Check main AI service
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{config.main_service_url}/health",
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as response:
-                service_healthy = response.status == 200
-    except:
-        service_healthy = False
+    # Check main AI service replicas
+    await router.check_all(get_session())
+    routing = router.get_stats()
+    service_healthy = any(r['healthy'] for r in routing['replicas'])
     
     # Check n8n status (ถ้าเปิดใช้งาน)
     n8n_status = "disabled"
     if config.use_n8n_workflow:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{config.n8n_base_url}/healthz",
-                    timeout=aiohttp.ClientTimeout(total=5)
-                ) as response:
-                    n8n_status = "healthy" if response.status == 200 else "unhealthy"
+            async with get_session().get(
+                f"{config.n8n_base_url}/healthz",
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                n8n_status = "healthy" if response.status == 200 else "unhealthy"
         except:
             n8n_status = "unreachable"
     
@@ -427,15 +602,34 @@ async def health():
         "service": "OpenWebUI Proxy",
         "version": "2.0.0",
         "main_service": "connected" if service_healthy else "disconnected",
+        "replicas": routing['replicas'],
         "n8n_workflow": {
             "enabled": config.use_n8n_workflow,
             "status": n8n_status,
             "url": config.n8n_base_url if config.use_n8n_workflow else None,
-            "fallback": config.n8n_fallback_to_direct
+            "fallback": config.n8n_fallback_to_direct,
+            "dispatch_mode": config.n8n_dispatch_mode
         },
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/v1/routing")
+async def routing_status():
+    """Replica ring, per-replica load and health"""
+    return router.get_stats()
+
+@app.get("/v1/dispatch")
+async def dispatch_status():
+    """n8n / direct win rates and latency"""
+    return {
+        "mode": config.n8n_dispatch_mode,
+        "hedge_delay_seconds": round(hedge_delay(), 3),
+        "direct_fallback_reserve_seconds": config.direct_fallback_reserve,
+        "request_deadline_seconds": config.request_deadline,
+        "paths": dispatch_stats.snapshot(),
+        "background": background_summary()
+    }
+
 @app.get("/v1/models")
 async def list_models():
     """List available models"""
@@ -460,12 +654,13 @@ if __name__ == "__main__":
     print("=" * 60)
     print("OpenWebUI Proxy Service")
     print("=" * 60)
-    print(f"Main Service: {config.main_service_url}")
+    print(f"Main Service: {', '.join(config.main_service_urls)}")
     print(f"n8n Workflow: {'ENABLED' if config.use_n8n_workflow else 'DISABLED'}")
     if config.use_n8n_workflow:
         print(f"n8n URL: {config.n8n_base_url}")
         print(f"n8n Webhook: /{config.n8n_webhook_path}")
         print(f"Fallback: {config.n8n_fallback_to_direct}")
+        print(f"Dispatch: {config.n8n_dispatch_mode} (hedge ≥ {config.n8n_hedge_delay}s, n8n p95 when known)")
     print(f"Port: {config.port}")
     print(f"Default Tenant: {config.default_tenant}")
     print("=" * 60)
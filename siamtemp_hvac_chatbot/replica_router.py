@@ -0,0 +1,209 @@
+# replica_router.py
+"""
+User-affinity routing over several hvac-ai-service replicas (used by openwebui_proxy.py)
+- Consistent hash ring with virtual nodes, keyed on (tenant, user_id), so a
+  user's follow-ups reach the replica holding their conversation and result cache
+- Bounded loads: a replica takes a request only while its in-flight count is
+  below ceil(load_factor * average load); otherwise the next replica
+  clockwise on the ring is used, so hot users spill over instead of piling up
+- Health checks: replicas failing /health (or a request) are skipped until
+  they pass again; they stay on the ring so their users move back afterwards
+- Adding or removing a replica moves only ~1/N of the users
+"""
+
+import math
+import time
+import bisect
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class Replica:
+    __slots__ = ('url', 'healthy', 'in_flight', 'requests', 'failures', 'last_error', 'last_check')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_check': self.last_check
+        }
+
+class ReplicaRouter:
+    """
+    Consistent hashing with bounded loads over a replica list
+    acquire(key) picks and reserves a replica, release(replica) frees it
+    """
+
+    def __init__(self, urls: Sequence[str], vnodes: int = 160, load_factor: float = 1.25,
+                 health_path: str = '/health', health_interval: float = 10.0, health_timeout: float = 3.0):
+        if load_factor < 1:
+            raise ValueError("load_factor must be >= 1")
+        self.vnodes = vnodes
+        self.load_factor = load_factor
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.replicas: Dict[str, Replica] = {}
+        self._ring: List[int] = []
+        self._owners: List[str] = []
+        self._health_task: Optional[asyncio.Task] = None
+        self.stats = {'routed': 0, 'spilled': 0, 'rebuilds': 0}
+        self.set_replicas(urls)
+
+    # =========================================================================
+    # RING
+    # =========================================================================
+
+    def set_replicas(self, urls: Sequence[str]):
+        """
+        Replace the replica list; replicas that stay keep their state
+        and their ring points, so only the keys of added/removed ones move
+        """
+        urls = list(dict.fromkeys(url.rstrip('/') for url in urls if url.strip()))
+        if not urls:
+            raise ValueError("At least one replica URL is required")
+        self.replicas = {url: self.replicas.get(url) or Replica(url) for url in urls}
+
+        points = sorted((_hash(f"{url}#{i}"), url) for url in urls for i in range(self.vnodes))
+        self._ring = [point for point, _ in points]
+        self._owners = [url for _, url in points]
+        self.stats['rebuilds'] += 1
+        logger.info(f"🔀 Replica ring: {len(urls)} replicas x {self.vnodes} vnodes")
+
+    @staticmethod
+    def route_key(tenant_id: str, user_id: str) -> str:
+        return f"{tenant_id}:{user_id}"
+
+    def preference(self, key: str) -> Iterator[Replica]:
+        """Distinct replicas in ring order starting at the key's position"""
+        start = bisect.bisect(self._ring, _hash(key))
+        seen = set()
+        for i in range(len(self._ring)):
+            url = self._owners[(start + i) % len(self._ring)]
+            if url not in seen:
+                seen.add(url)
+                yield self.replicas[url]
+                if len(seen) == len(self.replicas):
+                    return
+
+    def owner(self, key: str) -> Replica:
+        """Replica the key hashes to, ignoring load and health"""
+        return next(self.preference(key))
+
+    # =========================================================================
+    # ROUTING
+    # =========================================================================
+
+    def capacity(self) -> int:
+        """Per-replica in-flight limit, counting the request being placed"""
+        healthy = sum(1 for r in self.replicas.values() if r.healthy) or len(self.replicas)
+        total = sum(r.in_flight for r in self.replicas.values()) + 1
+        return math.ceil(self.load_factor * total / healthy)
+
+    def choose(self, key: str, exclude: Sequence[str] = ()) -> Optional[Replica]:
+        """First healthy replica on the ring below capacity (None if all are excluded)"""
+        limit = self.capacity()
+        candidates = [r for r in self.preference(key) if r.url not in exclude]
+        healthy = [r for r in candidates if r.healthy]
+        for replica in healthy:
+            if replica.in_flight < limit:
+                if replica is not candidates[0]:
+                    self.stats['spilled'] += 1
+                return replica
+        # Everything is down or full: the owner is still the best guess
+        return (healthy or candidates or [None])[0]
+
+    def acquire(self, key: str, exclude: Sequence[str] = ()) -> Optional[Replica]:
+        replica = self.choose(key, exclude)
+        if replica is not None:
+            replica.in_flight += 1
+            replica.requests += 1
+            self.stats['routed'] += 1
+        return replica
+
+    def release(self, replica: Replica):
+        replica.in_flight = max(0, replica.in_flight - 1)
+
+    def mark_failed(self, replica: Replica, error: str):
+        """Take a replica out of rotation until the next passing health check"""
+        if replica.healthy:
+            logger.warning(f"⚠️ Replica {replica.url} marked down: {error}")
+        replica.healthy = False
+        replica.failures += 1
+        replica.last_error = error
+
+    # =========================================================================
+    # HEALTH CHECKS
+    # =========================================================================
+
+    async def check(self, session: aiohttp.ClientSession, replica: Replica):
+        try:
+            async with session.get(f"{replica.url}{self.health_path}",
+                                   timeout=aiohttp.ClientTimeout(total=self.health_timeout)) as response:
+                ok = response.status == 200
+                error = None if ok else f"HTTP {response.status}"
+        except Exception as e:
+            ok, error = False, str(e) or type(e).__name__
+        replica.last_check = time.time()
+        if ok:
+            if not replica.healthy:
+                logger.info(f"✅ Replica {replica.url} is back")
+            replica.healthy = True
+            replica.last_error = None
+        else:
+            self.mark_failed(replica, error)
+
+    async def check_all(self, session: Optional[aiohttp.ClientSession] = None):
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.check_all(session)
+        await asyncio.gather(*(self.check(session, r) for r in list(self.replicas.values())))
+
+    async def _health_loop(self, session_factory: Optional[Callable[[], aiohttp.ClientSession]]):
+        while True:
+            try:
+                await self.check_all(session_factory() if session_factory else None)
+            except Exception as e:
+                logger.error(f"Replica health check error: {e}")
+            await asyncio.sleep(self.health_interval)
+
+    def start(self, session_factory: Optional[Callable[[], aiohttp.ClientSession]] = None):
+        """Start periodic health checks, on the caller's pooled session if given"""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(session_factory))
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'load_factor': self.load_factor,
+            'vnodes': self.vnodes,
+            'capacity': self.capacity(),
+            'replicas': [r.to_dict() for r in self.replicas.values()]
+        }
@@ -0,0 +1,95 @@
+# scripts/bench_cleaner.py
+"""
+Benchmark DataCleaningEngine: row-wise vs column-planned cleaning
+on a synthetic 10k-row v_sales result
+
+Usage: python scripts/bench_cleaner.py [--rows 10000] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.data.cleaner import DataCleaningEngine
+
+CUSTOMERS = [
+    'STANLEY ELECTRIC CO.,LTD.', 'HONDA AUTOMOBILE (THAILAND) CO.,LTD.',
+    'CLARION  ASIA CO.,LTD.', 'IRPC PUBIC COMPANY LIMITED', 'sadesa (THAILAND)',
+    'บริษัท ไทยออยล์ จำกัด (มหาชน)', 'คลีนิค ประกอบโรคศิลปะฯ', 'SIAM  CEMENT   GROUP',
+    'บริษัท  เอสซีจี  เคมิคอลส์ จำกัด', 'Panasonic Appliances Co.,Ltd.'
+]
+
+def make_rows(count: int, seed: int = 42):
+    """Rows shaped like SELECT * FROM v_sales2024"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rows.append({
+            'id': i,
+            'job_no': f"SV-{2024}-{i:05d}",
+            'customer_name': rng.choice(CUSTOMERS) if rng.random() > 0.02 else None,
+            'description': rng.choice(['งานซ่อม  Chiller', 'PM  รายปี ', 'Overhaul compressor', '']),
+            'overhaul_num': Decimal(rng.randint(0, 500000)) if rng.random() > 0.5 else Decimal('0'),
+            'replacement_num': Decimal(rng.randint(0, 200000)),
+            'service_num': Decimal(f"{rng.randint(0, 90000)}.{rng.randint(0, 99):02d}"),
+            'parts_num': Decimal(rng.randint(0, 50000)) if rng.random() > 0.1 else None,
+            'product_num': Decimal('0'),
+            'solution_num': Decimal(rng.randint(0, 1000000)),
+            'total_revenue': Decimal(f"{rng.randint(0, 2000000)}.{rng.randint(0, 99):02d}"),
+            'year_label': '2024'
+        })
+    return rows
+
+def clean_rowwise(engine: DataCleaningEngine, rows):
+    """The per-row path (pre column-planning behaviour)"""
+    stats = engine.new_stats()
+    stats['total_rows'] = len(rows)
+    return [engine._clean_single_row(row, stats) for row in rows], stats
+
+def clean_columnar(engine: DataCleaningEngine, rows):
+    stats = engine.new_stats()
+    stats['total_rows'] = len(rows)
+    return engine._clean_columnar(rows, stats, 'v_sales2024'), stats
+
+def timed(func, engine, rows, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(engine, rows)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    engine = DataCleaningEngine()
+
+    rowwise_time, (rowwise_rows, rowwise_stats) = timed(clean_rowwise, engine, rows, args.repeat)
+    columnar_time, (columnar_rows, columnar_stats) = timed(clean_columnar, engine, rows, args.repeat)
+
+    identical = rowwise_rows == columnar_rows and rowwise_stats == columnar_stats
+    same_types = all(
+        type(a[k]) is type(b[k]) for a, b in zip(rowwise_rows, columnar_rows) for k in a
+    )
+
+    print(f"rows:       {args.rows:,} x {len(rows[0])} columns (best of {args.repeat})")
+    print(f"row-wise:   {rowwise_time * 1000:8.1f} ms")
+    print(f"columnar:   {columnar_time * 1000:8.1f} ms  ({rowwise_time / columnar_time:.1f}x)")
+    print(f"identical:  {identical} (types match: {same_types})")
+    print(f"stats:      {columnar_stats}")
+
+    if not (identical and same_types):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# scripts/bench_redis_indexes.py
+"""
+Load test for the pattern / active-user lookups as the keyspace grows
+
+Fills Redis with per-user history keys and per-pattern counters (the old
+KEYS-based layout) plus the sorted-set indexes that replaced them, then
+times get_successful_patterns / get_active_users both ways at each size.
+KEYS time grows with the keyspace; the index lookups should stay flat
+
+Runs against REDIS_HOST/REDIS_PORT (db is flushed!), or an in-process
+fakeredis server with --fake
+
+Usage: python scripts/bench_redis_indexes.py [--keys 1000000] [--steps 10000,100000,1000000] [--fake]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import redis.asyncio as aioredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.storage.redis_memory import ScalableConversationMemory, RedisConfig
+
+INTENTS = ['sales', 'work_plan', 'parts_price', 'customer_history', 'repair_history']
+
+# =============================================================================
+# SETUP
+# =============================================================================
+
+def make_client(args) -> aioredis.Redis:
+    if args.fake:
+        import fakeredis
+        return fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    config = RedisConfig()
+    return aioredis.Redis(host=config.host, port=config.port, db=args.db, password=config.password)
+
+async def fill(client, memory, start: int, stop: int, rng: random.Random, batch: int = 5000):
+    """
+    Keys start..stop: 4 of every 5 are users, 1 is a pattern counter
+    Each is written in the old layout and into the new index
+    """
+    now = time.time()
+    for offset in range(start, stop, batch):
+        async with client.pipeline(transaction=False) as pipe:
+            for i in range(offset, min(offset + batch, stop)):
+                if i % 5:
+                    user_id = f"user-{i}"
+                    pipe.set(memory._history_key(user_id), b'[]')
+                    pipe.zadd(memory.ACTIVE_USERS_KEY, {user_id: now - rng.random() * memory.ttl_seconds})
+                else:
+                    intent = INTENTS[i % len(INTENTS)]
+                    entities = json.dumps({'years': [2020 + i % 6], 'id': i}, sort_keys=True)
+                    count = rng.randint(1, 500)
+                    pipe.set(f"pattern_count:pattern:{intent}:{entities}", count)
+                    pipe.zadd(memory._patterns_key(intent), {entities: count})
+            await pipe.execute()
+
+# =============================================================================
+# LOOKUPS
+# =============================================================================
+
+async def legacy_patterns(client, intent: str, limit: int = 5):
+    keys = (await client.keys(f"pattern_count:pattern:{intent}:*"))[:limit]
+    counts = await client.mget(keys) if keys else []
+    return sorted(
+        ({'pattern': key, 'count': int(count)} for key, count in zip(keys, counts) if count),
+        key=lambda x: x['count'], reverse=True
+    )
+
+async def legacy_active_users(client):
+    return len(await client.keys("conv_history:*"))
+
+async def timed(coro_factory, repeat: int) -> float:
+    """Median latency in ms"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+async def run(args):
+    client = make_client(args)
+    await client.flushdb()
+    # Index sizes are not trimmed here - the point is lookup cost at full size
+    memory = ScalableConversationMemory(redis_client=client)
+    rng = random.Random(7)
+
+    steps = sorted(int(step) for step in args.steps.split(',') if int(step) <= args.keys) or [args.keys]
+    print(f"{'keys':>10} | {'KEYS patterns':>14} {'ZREVRANGE':>10} | {'KEYS users':>11} {'ZCOUNT':>8}   (median ms)")
+
+    filled = 0
+    for step in steps:
+        fill_start = time.perf_counter()
+        await fill(client, memory, filled, step, rng)
+        filled = step
+        fill_seconds = time.perf_counter() - fill_start
+
+        legacy_p = await timed(lambda: legacy_patterns(client, 'sales'), args.legacy_repeat)
+        index_p = await timed(lambda: memory.get_successful_patterns('sales'), args.repeat)
+        legacy_u = await timed(lambda: legacy_active_users(client), args.legacy_repeat)
+        index_u = await timed(lambda: memory.get_active_users(memory.ttl_seconds), args.repeat)
+        print(f"{step:>10,} | {legacy_p:>14.3f} {index_p:>10.3f} | {legacy_u:>11.3f} {index_u:>8.3f}"
+              f"   (filled in {fill_seconds:.1f}s)")
+
+    top = await memory.get_successful_patterns('sales', limit=3)
+    print(f"Top 'sales' patterns: {[p['count'] for p in top]}; "
+          f"active users (7d): {await memory.get_active_users(memory.ttl_seconds):,}")
+    if not args.fake:
+        await client.flushdb()
+    await client.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=1_000_000)
+    parser.add_argument('--steps', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=200, help='samples per index lookup')
+    parser.add_argument('--legacy-repeat', type=int, default=5, help='samples per KEYS lookup')
+    parser.add_argument('--db', type=int, default=15, help='Redis db to use (flushed!)')
+    parser.add_argument('--fake', action='store_true', help='use fakeredis instead of a server')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# scripts/bench_redis_memory.py
+"""
+Benchmark the Redis conversation store: round trips and latency per request
+(one get_context + one add_conversation, as in the chat pipeline)
+
+Compares the previous per-entry key layout, the pipelined single-list
+layout, and the two-tier L1 + write-behind memory (round trips for the
+latter include its batched flushes, amortized per request). Runs against REDIS_HOST/REDIS_PORT, or an in-process fakeredis
+server with --fake; --rtt-ms adds a simulated network round trip
+
+Usage: python scripts/bench_redis_memory.py [--requests 2000] [--users 50] [--fake] [--rtt-ms 0.5]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime
+
+import redis.asyncio as aioredis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.storage.redis_memory import ScalableConversationMemory, TwoTierConversationMemory, RedisConfig
+
+# =============================================================================
+# ROUND-TRIP COUNTING
+# =============================================================================
+
+def counting_connection(base_class, counter: dict, rtt_seconds: float):
+    """Connection class that counts (and optionally delays) every round trip"""
+    class CountingConnection(base_class):
+        async def send_packed_command(self, command, check_health=True):
+            counter['round_trips'] += 1
+            if rtt_seconds:
+                await asyncio.sleep(rtt_seconds)
+            return await super().send_packed_command(command, check_health)
+    return CountingConnection
+
+def make_client(args, counter: dict) -> aioredis.Redis:
+    rtt = args.rtt_ms / 1000
+    if args.fake:
+        import fakeredis
+        fake_connection = getattr(fakeredis, 'FakeAsyncRedisConnection', None) or fakeredis.FakeAsyncConnection
+        pool = aioredis.ConnectionPool(
+            connection_class=counting_connection(fake_connection, counter, rtt),
+            server=fakeredis.FakeServer()
+        )
+    else:
+        config = RedisConfig()
+        pool = aioredis.ConnectionPool(
+            connection_class=counting_connection(aioredis.Connection, counter, rtt),
+            host=config.host, port=config.port, db=args.db
+        )
+    return aioredis.Redis(connection_pool=pool)
+
+# =============================================================================
+# STORES
+# =============================================================================
+
+class LegacyMemory(ScalableConversationMemory):
+    """Previous layout: one key per entry + list of keys, one command per step"""
+
+    async def add_conversation(self, user_id, query, response):
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'query': query,
+            'intent': response.get('intent', 'unknown'),
+            'entities': response.get('entities', {}),
+            'success': response.get('success', False),
+            'processing_time': response.get('processing_time', 0)
+        }
+        key = f"conv:{user_id}:{datetime.now().timestamp()}"
+        await self.redis_client.setex(key, self.ttl_seconds, json.dumps(entry))
+        list_key = f"conv_list:{user_id}"
+        await self.redis_client.lpush(list_key, key)
+        await self.redis_client.ltrim(list_key, 0, 99)
+        await self.redis_client.expire(list_key, self.ttl_seconds)
+        if entry['success']:
+            pattern_key = f"pattern:{entry['intent']}:{json.dumps(entry['entities'], sort_keys=True)}"
+            await self.redis_client.incr(f"pattern_count:{pattern_key}")
+            await self.redis_client.expire(f"pattern_count:{pattern_key}", self.ttl_seconds)
+
+    async def get_context(self, user_id, current_query):
+        list_key = f"conv_list:{user_id}"
+        recent = []
+        for key in await self.redis_client.lrange(list_key, 0, 4):
+            data = await self.redis_client.get(key)
+            if data:
+                recent.append(json.loads(data))
+        return {
+            'conversation_count': await self.redis_client.llen(list_key),
+            'recent_queries': [c['query'] for c in recent],
+            'recent_intents': [c['intent'] for c in recent],
+            'recent_entities': self._merge_entities(recent),
+            'has_history': len(recent) > 0
+        }
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def two_tier(redis_client):
+    return TwoTierConversationMemory(ScalableConversationMemory(redis_client=redis_client))
+
+async def run(name, memory_factory, args):
+    counter = {'round_trips': 0}
+    client = make_client(args, counter)
+    if not args.fake:
+        await client.flushdb()
+    memory = memory_factory(redis_client=client)
+
+    latencies, trips = [], []
+    for i in range(args.requests):
+        user_id = f"bench-user-{i % args.users}"
+        before = counter['round_trips']
+        start = time.perf_counter()
+        await memory.get_context(user_id, 'รายได้ปี 2024')
+        written = memory.add_conversation(user_id, f'รายได้ปี 2024 #{i}', {
+            'intent': 'sales', 'entities': {'years': [2024]}, 'success': True, 'processing_time': 1.2
+        })
+        if written is not None:
+            await written
+        latencies.append((time.perf_counter() - start) * 1000)
+        trips.append(counter['round_trips'] - before)
+        # Let the write-behind flusher run between requests, as it would under real traffic
+        await asyncio.sleep(0)
+
+    if isinstance(memory, TwoTierConversationMemory):
+        before = counter['round_trips']
+        await memory.close()
+        trips[-1] += counter['round_trips'] - before
+
+    latencies.sort()
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(f"{name:<10} round trips/request: {statistics.mean(trips):5.2f}   "
+          f"p50: {statistics.median(latencies):7.3f} ms   p99: {p99:7.3f} ms")
+    await client.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--db', type=int, default=15, help='Redis db to use (flushed!)')
+    parser.add_argument('--fake', action='store_true', help='use fakeredis instead of a server')
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='simulated network round trip')
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests over {args.users} users "
+          f"({'fakeredis' if args.fake else 'redis'}, rtt +{args.rtt_ms} ms)")
+    asyncio.run(run('before', LegacyMemory, args))
+    asyncio.run(run('pipelined', ScalableConversationMemory, args))
+    asyncio.run(run('two-tier', two_tier, args))
+
+if __name__ == '__main__':
+    main()
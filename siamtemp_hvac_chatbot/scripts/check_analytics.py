@@ -0,0 +1,240 @@
+# scripts/check_analytics.py
+"""
+Check that the NumPy result analytics give the same numbers as the
+original per-row loops, on the tables recorded in test/api_test_results_*
+plus a synthetic mixed-type result set
+
+Usage: python scripts/check_analytics.py [--results-dir ../test]
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import random
+import argparse
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.data.cleaner import DataCleaningEngine
+from agents.nlp.prompt_manager import PromptManager
+from agents.utils.table_formatter import TableFormatter
+from enhanced_multi_agent_service import session_stats
+
+_ANSWER = re.compile(r'"answer"\s*:\s*("(?:[^"\\]|\\.)*")')
+_NUMBER = re.compile(r'^-?[\d,]+(?:\.\d+)?$')
+
+# =============================================================================
+# REFERENCE IMPLEMENTATIONS (per-row loops the analytics module replaced)
+# =============================================================================
+
+def legacy_analyze_results(results):
+    stats = []
+    for field in ['total_revenue', 'total', 'overhaul', 'total_value']:
+        if field in results[0]:
+            total = 0
+            for r in results:
+                try:
+                    value = r.get(field, 0) or 0
+                    if isinstance(value, (int, float)):
+                        total += value
+                    elif isinstance(value, str):
+                        cleaned = re.sub(r'[^0-9.-]', '', value)
+                        if cleaned:
+                            total += float(cleaned)
+                except:
+                    continue
+            if total > 0:
+                stats.append(f"ยอดรวม ({field}): {total:,.0f} บาท")
+            break
+    if 'year' in results[0] or 'year_label' in results[0]:
+        field = 'year' if 'year' in results[0] else 'year_label'
+        years = set(r.get(field) for r in results if r.get(field))
+        if years:
+            stats.append(f"ปีที่มีข้อมูล: {', '.join(sorted(str(y) for y in years))}")
+    if 'customer_name' in results[0] or 'customer' in results[0]:
+        field = 'customer_name' if 'customer_name' in results[0] else 'customer'
+        customers = set(r.get(field) for r in results if r.get(field))
+        if customers:
+            stats.append(f"จำนวนลูกค้า: {len(customers)} ราย")
+    return '\n'.join(stats)
+
+def legacy_work_insights(results, insights):
+    job_types, statuses, teams = Counter(), Counter(), Counter()
+    for r in results:
+        if 'job_type' in r:
+            job_types[r['job_type']] += 1
+        if 'status' in r:
+            statuses[r['status']] += 1
+        if r.get('service_group'):
+            teams[r['service_group']] += 1
+    insights['summary'] = {'job_types': dict(job_types.most_common()), 'status_breakdown': dict(statuses)}
+    insights['top_items'] = {'busiest_teams': dict(teams.most_common(5))}
+    completed = statuses.get('Completed', 0)
+    total = len(results)
+    insights['statistics'] = {
+        'total_jobs': total,
+        'success_rate': f"{(completed/total*100):.1f}%" if total > 0 else "0%",
+        'pending_jobs': statuses.get('Pending', 0)
+    }
+    return insights
+
+def legacy_parts_insights(results, insights):
+    total_value = sum(r.get('total_num', 0) or 0 for r in results)
+    in_stock = sum(1 for r in results if (r.get('balance_num', 0) or 0) > 0)
+    warehouse_counts = Counter()
+    for r in results:
+        if r.get('wh'):
+            warehouse_counts[r['wh']] += 1
+    insights['summary'] = {
+        'total_inventory_value': f"{total_value:,.0f}",
+        'in_stock_percentage': f"{(in_stock/len(results)*100):.1f}%" if results else "0%"
+    }
+    insights['top_items'] = {'warehouse_distribution': dict(warehouse_counts.most_common())}
+    insights['statistics'] = {
+        'total_items': len(results), 'in_stock_items': in_stock, 'out_of_stock_items': len(results) - in_stock
+    }
+    return insights
+
+def legacy_customer_insights(engine, results, insights):
+    customer_totals = defaultdict(lambda: {'revenue': 0, 'transactions': 0})
+    for r in results:
+        customer = engine._standardize_company_name(r.get('customer_name') or r.get('customer', ''))
+        if customer:
+            customer_totals[customer]['revenue'] += r.get('total_revenue', 0) or 0
+            customer_totals[customer]['transactions'] += 1
+    top_customers = sorted(customer_totals.items(), key=lambda x: x[1]['revenue'], reverse=True)[:10]
+    insights['summary'] = {
+        'unique_customers': len(customer_totals),
+        'total_transactions': sum(c['transactions'] for c in customer_totals.values())
+    }
+    insights['top_items'] = {
+        'top_10_customers': {
+            name: {
+                'revenue': f"{data['revenue']:,.0f}",
+                'transactions': data['transactions'],
+                'avg_transaction': f"{data['revenue']/data['transactions']:,.0f}" if data['transactions'] > 0 else "0"
+            }
+            for name, data in top_customers
+        }
+    }
+    return insights
+
+def legacy_session_stats(conversations):
+    return {
+        'total_queries': len(conversations),
+        'successful_queries': sum(1 for c in conversations if c.get('success', False)),
+        'avg_processing_time': sum(c.get('processing_time', 0) for c in conversations) / max(len(conversations), 1)
+    }
+
+# =============================================================================
+# RECORDED RESULTS
+# =============================================================================
+
+def recorded_tables(results_dir: str):
+    """Result sets rebuilt from the markdown tables in recorded answers"""
+    headers_by_thai = {}
+    formatter = TableFormatter()
+    for name in ['date', 'customer', 'project', 'job_description_pm', 'detail', 'service_group',
+                 'customer_name', 'year', 'total_revenue', 'overhaul_num', 'replacement_num',
+                 'service_num', 'parts_num', 'product_num', 'solution_num', 'product_code',
+                 'product_name', 'wh', 'balance_num', 'unit_price_num', 'total_num']:
+        headers_by_thai.setdefault(formatter._translate_headers([name])[0], name)
+
+    for path in sorted(glob.glob(os.path.join(results_dir, 'api_test_results_*', 'responses.json'))):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        for match in _ANSWER.finditer(text):
+            answer = json.loads(match.group(1))
+            lines = [line for line in answer.splitlines() if line.startswith('|')]
+            if len(lines) < 3:
+                continue
+            headers = [headers_by_thai.get(h.strip(), h.strip()) for h in lines[0].strip('|').split('|')]
+            rows = []
+            for line in lines[2:]:
+                cells = [c.strip() for c in line.strip('|').split('|')]
+                if len(cells) != len(headers):
+                    continue
+                rows.append({h: parse_cell(c) for h, c in zip(headers, cells)})
+            if rows:
+                yield path, rows
+
+def parse_cell(cell: str):
+    if cell == '-':
+        return None
+    if _NUMBER.match(cell):
+        return float(cell.replace(',', ''))
+    return cell
+
+def synthetic_rows(count: int = 5000, seed: int = 7):
+    rng = random.Random(seed)
+    customers = ['STANLEY ELECTRIC CO.,LTD.', 'Stanley Electric Co., Ltd.', 'บริษัท ไทยออยล์ จำกัด (มหาชน)',
+                 'CLARION  ASIA CO.,LTD.', '', None]
+    rows = []
+    for i in range(count):
+        rows.append({
+            'customer_name': rng.choice(customers),
+            'year_label': rng.choice(['2023', '2024', 2025, None]),
+            'total_revenue': rng.choice([rng.random() * 1e6, rng.randint(0, 10**6), None,
+                                         f"{rng.random() * 1e5:,.2f} บาท", 'n/a', True]),
+            'total_num': rng.random() * 1e4,
+            'balance_num': rng.choice([0, 1.5, -2, None]),
+            'wh': rng.choice(['A', 'B', '', None]),
+            'job_type': rng.choice(['PM', 'Repair', None]),
+            'status': rng.choice(['Completed', 'Pending', 'Cancelled']),
+            'service_group': rng.choice(['ทีม A', 'ทีม B', None]),
+            'success': rng.random() > 0.2,
+            'processing_time': rng.random() * 30,
+        })
+    return rows
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def compare(label, rows, engine, prompts, failures):
+    numeric_rows = [
+        {k: v for k, v in row.items() if not isinstance(v, str) or k not in ('total_revenue', 'total_num')}
+        for row in rows
+    ]
+    checks = [
+        ('analyze_results', legacy_analyze_results(rows), prompts._analyze_results(rows)),
+        ('work_insights', legacy_work_insights(rows, {}), engine._create_work_insights(rows, {})),
+        ('parts_insights', legacy_parts_insights(numeric_rows, {}), engine._create_parts_insights(numeric_rows, {})),
+        ('customer_insights', legacy_customer_insights(engine, numeric_rows, {}),
+         engine._create_customer_insights(numeric_rows, {})),
+        ('session_stats', legacy_session_stats(rows), session_stats(rows)),
+    ]
+    for name, expected, actual in checks:
+        if expected != actual:
+            failures.append(f"{label} {name}:\n  legacy={expected}\n  new   ={actual}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'test')
+    parser.add_argument('--results-dir', default=default_dir)
+    args = parser.parse_args()
+
+    engine = DataCleaningEngine()
+    prompts = PromptManager()
+    failures = []
+    tables = 0
+
+    for path, rows in recorded_tables(args.results_dir):
+        tables += 1
+        compare(os.path.relpath(path, args.results_dir), rows, engine, prompts, failures)
+
+    compare('synthetic', synthetic_rows(), engine, prompts, failures)
+
+    print(f"Recorded tables checked: {tables} (+1 synthetic result set)")
+    if failures:
+        print(f"❌ {len(failures)} mismatches")
+        for failure in failures[:20]:
+            print(failure)
+        sys.exit(1)
+    print("✅ Analytics match the per-row implementations")
+
+if __name__ == '__main__':
+    main()
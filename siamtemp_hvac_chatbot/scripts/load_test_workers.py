@@ -0,0 +1,123 @@
+# scripts/load_test_workers.py
+"""
+Multi-worker load test against a running service (gunicorn -c gunicorn.conf.py)
+
+1. Sends --requests chat requests with --concurrency in flight, spread over
+   --users users, and records which worker pids answered /health
+2. Checks /v1/system/status total_queries grew by exactly the number of
+   requests sent, whichever worker answers the status call
+3. Toggles a feature flag and checks every worker reports it
+4. Checks each user's history count matches the answered requests
+
+Usage: python scripts/load_test_workers.py [--url http://localhost:5000] [--requests 400] [--concurrency 32]
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+
+import aiohttp
+
+async def chat(session, url, user_id, i):
+    start = time.perf_counter()
+    async with session.post(f"{url}/v1/chat", json={
+        'question': f'รายได้ปี 2024 ครั้งที่ {i}', 'tenant_id': 'company-a', 'user_id': user_id
+    }, headers={'X-User-Id': user_id}) as resp:
+        body = await resp.json() if resp.status == 200 else {}
+        return resp.status, body.get('success', False), (time.perf_counter() - start) * 1000
+
+async def status(session, url):
+    async with session.get(f"{url}/v1/system/status") as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+async def worker_pids(session, url, probes: int) -> Counter:
+    pids = Counter()
+    # New connections so the requests spread over workers
+    for _ in range(probes):
+        async with session.get(f"{url}/health", headers={'Connection': 'close'}) as resp:
+            pids[(await resp.json()).get('worker_pid')] += 1
+    return pids
+
+async def run(args):
+    failures = []
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency, force_close=True)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        pids = await worker_pids(session, args.url, args.probes)
+        print(f"Workers seen: {len(pids)} {dict(pids)}")
+        if len(pids) < 2:
+            failures.append(f"expected several workers, saw {len(pids)}")
+
+        before = (await status(session, args.url))['total_queries']
+        users = [f"load-user-{u}" for u in range(args.users)]
+        answered = Counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            user_id = users[i % len(users)]
+            async with semaphore:
+                code, success, ms = await chat(session, args.url, user_id, i)
+            if success:
+                answered[user_id] += 1
+            return code, ms
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(ms for _, ms in results)
+        codes = Counter(code for code, _ in results)
+        print(f"{args.requests} requests in {elapsed:.1f}s ({args.requests / elapsed:.1f} req/s), "
+              f"status codes {dict(codes)}, p50 {statistics.median(latencies):.0f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.0f} ms")
+
+        # Counters are flushed every SHARED_STATE_INTERVAL
+        await asyncio.sleep(args.settle)
+        counted = [(await status(session, args.url))['total_queries'] - before for _ in range(args.probes)]
+        print(f"total_queries delta as seen by {args.probes} status calls: {sorted(set(counted))}")
+        if set(counted) != {args.requests}:
+            failures.append(f"total_queries grew by {sorted(set(counted))}, expected {args.requests}")
+
+        async with session.post(f"{args.url}/v1/admin/toggle-feature",
+                                params={'feature': 'data_cleaning', 'enabled': 'false'}) as resp:
+            resp.raise_for_status()
+        await asyncio.sleep(args.settle)
+        flags = [(await status(session, args.url))['active_features']['data_cleaning'] for _ in range(args.probes)]
+        async with session.post(f"{args.url}/v1/admin/toggle-feature",
+                                params={'feature': 'data_cleaning', 'enabled': 'true'}) as resp:
+            resp.raise_for_status()
+        print(f"data_cleaning after toggle off, per status call: {Counter(flags)}")
+        if any(flags):
+            failures.append("some workers still report data_cleaning enabled")
+
+        mismatched = 0
+        for user_id, count in answered.items():
+            async with session.get(f"{args.url}/v1/history/{user_id}", params={'limit': 1}) as resp:
+                resp.raise_for_status()
+                mismatched += (await resp.json())['total_count'] != min(count, 100)
+        print(f"History checked for {len(answered)} users with answers "
+              f"({sum(answered.values())} answered requests)")
+        if mismatched:
+            failures.append(f"{mismatched} users have a wrong history count")
+
+    if failures:
+        print("❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("✅ Counters, flags and history are consistent across workers")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--probes', type=int, default=40, help='status/health calls per check')
+    parser.add_argument('--settle', type=float, default=2.5, help='seconds to wait for shared state sync')
+    parser.add_argument('--timeout', type=float, default=700)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# scripts/sim_replica_routing.py
+"""
+Offline check of the proxy's replica routing (replica_router.py)
+
+1. Rehash: share of users whose owner changes when a replica is added
+   or removed (ideal is 1/N), compared with hash-mod-N
+2. Affinity under load: a Zipf-like user population with a few hot users
+   keeps --in-flight requests outstanding; reports the busiest replica
+   against the bounded-load limit and how many requests stayed on the
+   user's own replica
+3. Failover: with one replica down, only its users move
+
+Usage: python scripts/sim_replica_routing.py [--replicas 4] [--users 20000] [--requests 200000]
+"""
+
+import os
+import sys
+import random
+import hashlib
+import argparse
+from collections import Counter, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replica_router import ReplicaRouter
+
+def replica_urls(count: int):
+    return [f"http://hvac-ai-service-{i}:5000" for i in range(1, count + 1)]
+
+def owners(router: ReplicaRouter, keys):
+    return {key: router.owner(key).url for key in keys}
+
+def moved_share(before, after) -> float:
+    return sum(before[k] != after[k] for k in before) / len(before)
+
+def mod_n(keys, n: int):
+    return {k: int(hashlib.md5(k.encode()).hexdigest(), 16) % n for k in keys}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=200_000)
+    parser.add_argument('--in-flight', type=int, default=64, help='requests outstanding at any time')
+    parser.add_argument('--load-factor', type=float, default=1.25)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    keys = [ReplicaRouter.route_key('company-a', f"user-{u}") for u in range(args.users)]
+    urls = replica_urls(args.replicas)
+    failures = []
+
+    # 1. Rehash
+    router = ReplicaRouter(urls, load_factor=args.load_factor)
+    base = owners(router, keys)
+    spread = Counter(base.values())
+    print(f"Users per replica: min {min(spread.values())}, max {max(spread.values())} "
+          f"(mean {args.users / args.replicas:.0f})")
+
+    router.set_replicas(urls + replica_urls(args.replicas + 1)[-1:])
+    added = moved_share(base, owners(router, keys))
+    router.set_replicas(urls[1:])
+    removed = moved_share(base, owners(router, keys))
+    mod_added = moved_share(mod_n(keys, args.replicas), mod_n(keys, args.replicas + 1))
+    print(f"Moved on add:    {added:6.1%} (ideal {1 / (args.replicas + 1):.1%}, hash mod N {mod_added:.1%})")
+    print(f"Moved on remove: {removed:6.1%} (ideal {1 / args.replicas:.1%})")
+    if added > 1.5 / (args.replicas + 1) or removed > 1.5 / args.replicas:
+        failures.append("too many users move on a membership change")
+
+    # 2. Affinity under load
+    router = ReplicaRouter(urls, load_factor=args.load_factor)
+    weights = [1 / (rank + 1) for rank in range(args.users)]
+    outstanding = deque()
+    peak = Counter()
+    on_owner = 0
+    for key in rng.choices(keys, weights=weights, k=args.requests):
+        if len(outstanding) >= args.in_flight:
+            router.release(outstanding.popleft())
+        replica = router.acquire(key)
+        outstanding.append(replica)
+        on_owner += replica.url == base[key]
+        for r in router.replicas.values():
+            peak[r.url] = max(peak[r.url], r.in_flight)
+    limit = -(-args.load_factor * args.in_flight // args.replicas)
+    print(f"Peak in-flight per replica: {sorted(peak.values())} (bounded-load limit {limit:.0f})")
+    print(f"Requests on the user's own replica: {on_owner / args.requests:.1%}, "
+          f"spilled {router.stats['spilled']:,}")
+    if max(peak.values()) > limit:
+        failures.append("a replica went over the bounded-load limit")
+
+    # 3. Failover
+    while outstanding:
+        router.release(outstanding.popleft())
+    down = router.replicas[urls[0]]
+    router.mark_failed(down, 'simulated')
+    rerouted = {key: router.choose(key).url for key in keys}
+    moved_users = [k for k in keys if rerouted[k] != base[k]]
+    print(f"With {urls[0]} down: {len(moved_users) / args.users:.1%} of users rerouted")
+    if any(base[k] != urls[0] for k in moved_users):
+        failures.append("users of healthy replicas were rerouted")
+
+    if failures:
+        print("❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("✅ Minimal rehash, bounded load and failover hold")
+
+if __name__ == '__main__':
+    main()
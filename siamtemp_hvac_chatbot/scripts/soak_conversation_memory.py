@@ -0,0 +1,121 @@
+# scripts/soak_conversation_memory.py
+"""
+Soak test for the in-process conversation memory on a simulated clock
+
+Replays several days of traffic from a synthetic user population (a core
+of regulars plus a stream of one-off users) into ConversationMemory and a
+BoundedStateStore, and samples traced Python memory once per simulated
+day. Memory must level off once the LRU / idle TTL bounds are reached;
+--legacy runs the previous unbounded layout for comparison
+
+Usage: python scripts/soak_conversation_memory.py [--days 5] [--requests-per-day 200000] [--legacy]
+"""
+
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+from collections import deque, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.storage.memory import ConversationMemory, BoundedStateStore
+
+INTENTS = ['sales', 'work_plan', 'parts_price', 'customer_history', 'repair_history']
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class LegacyMemory:
+    """Previous layout: unbounded users, unbounded pattern lists, unbounded turn lists"""
+
+    def __init__(self):
+        self.conversations = defaultdict(lambda: deque(maxlen=20))
+        self.successful_patterns = defaultdict(list)
+        self.conversation_turns = defaultdict(list)
+
+    def add_conversation(self, user_id, query, response):
+        entry = {'query': query, 'intent': response['intent'], 'entities': response['entities'],
+                 'success': response['success'], 'sql_query': response['sql_query'], 'results_count': 0}
+        self.conversations[user_id].append(entry)
+        self.conversation_turns[user_id].append(entry)
+        key = f"{entry['intent']}_{sorted(entry['entities'].items())}"
+        self.successful_patterns[key].append(entry['sql_query'])
+
+def synthetic_request(rng: random.Random, day: int, regulars: int, new_user_share: float):
+    if rng.random() < new_user_share:
+        user_id = f"visitor-{day}-{rng.getrandbits(40)}"
+    else:
+        user_id = f"regular-{int(rng.paretovariate(1.2)) % regulars}"
+    intent = rng.choice(INTENTS)
+    year = 2020 + rng.randrange(6)
+    customer = rng.randrange(5000)
+    query = f"{intent} ของลูกค้า {customer} ปี {year}"
+    response = {
+        'intent': intent,
+        'entities': {'years': [year], 'customer': customer},
+        'success': True,
+        'sql_query': f"SELECT * FROM v_sales{year} WHERE customer_id = {customer} LIMIT 100",
+        'processing_time': rng.random() * 20
+    }
+    return user_id, query, response
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--requests-per-day', type=int, default=200_000)
+    parser.add_argument('--regulars', type=int, default=2_000)
+    parser.add_argument('--new-user-share', type=float, default=0.3)
+    parser.add_argument('--max-users', type=int, default=10_000)
+    parser.add_argument('--idle-ttl-hours', type=float, default=24)
+    parser.add_argument('--legacy', action='store_true', help='run the unbounded layout instead')
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    clock = SimulatedClock()
+    idle_ttl = args.idle_ttl_hours * 3600
+    if args.legacy:
+        memory, states = LegacyMemory(), {}
+    else:
+        memory = ConversationMemory(max_users=args.max_users, idle_ttl=idle_ttl, clock=clock)
+        states = BoundedStateStore(args.max_users, idle_ttl, clock=clock)
+
+    tracemalloc.start()
+    step = 86400 / args.requests_per_day
+    samples = []
+    print(f"{'day':>4} {'traced MB':>10} {'users':>8} {'patterns':>9} {'est. MB':>8}")
+    for day in range(1, args.days + 1):
+        for _ in range(args.requests_per_day):
+            clock.now += step
+            user_id, query, response = synthetic_request(rng, day, args.regulars, args.new_user_share)
+            memory.add_conversation(user_id, query, response)
+            if args.legacy:
+                states.setdefault(user_id, {'last_result': response})
+            elif states.get(user_id) is None:
+                states.set(user_id, {'last_result': response})
+
+        traced_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        samples.append(traced_mb)
+        if args.legacy:
+            users, patterns, estimated = len(memory.conversations), len(memory.successful_patterns), float('nan')
+        else:
+            stats = memory.get_stats()
+            users, patterns, estimated = stats['users'], stats['patterns'], stats['estimated_bytes'] / 1e6
+        print(f"{day:>4} {traced_mb:>10.1f} {users:>8,} {patterns:>9,} {estimated:>8.1f}")
+
+    if len(samples) >= 3:
+        growth = (samples[-1] - samples[1]) / samples[1] * 100
+        print(f"Growth after day 2: {growth:+.1f}%")
+        if not args.legacy and growth > 10:
+            print("❌ Memory keeps growing")
+            sys.exit(1)
+    if not args.legacy:
+        print(f"✅ Evictions: conversations {memory.conversations.evictions}, states {states.evictions}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# tracing.py
+"""
+Distributed tracing for openwebui_proxy and enhanced_multi_agent_service
+- W3C trace context (traceparent) goes from the proxy to the service, so
+  one trace covers proxy → /v1/chat → pipeline stages → Ollama / Postgres / Redis
+- Head sampling: TRACE_SAMPLE_RATIO of new traces are recorded, requests
+  arriving with a sampled parent are always recorded (ParentBased)
+- Spans are written as OTLP/JSON lines (one ExportTraceServiceRequest per
+  line) to TRACE_EXPORT_FILE, per process ({pid}), so it works offline;
+  OTEL_EXPORTER_OTLP_ENDPOINT also ships them to a collector when the
+  OTLP exporter package is installed
+- Responses carry the trace id in X-Trace-Id
+OpenTelemetry is optional: without it every helper here is a no-op
+"""
+
+import os
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace, propagate
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+try:
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    OTEL_SDK_AVAILABLE = True
+except ImportError:
+    OTEL_SDK_AVAILABLE = False
+    SpanExporter = object
+
+TRACE_HEADER = 'x-trace-id'
+
+def tracing_enabled() -> bool:
+    return OTEL_SDK_AVAILABLE and os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+
+_tracer = trace.get_tracer('siamtemp') if OTEL_AVAILABLE else None
+_provider = None
+
+# =============================================================================
+# OTLP/JSON FILE EXPORTER
+# =============================================================================
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_otlp_value(v) for v in value]}}
+    return {'stringValue': str(value)}
+
+def _otlp_attributes(attributes) -> list:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in (attributes or {}).items()]
+
+def _otlp_span(span) -> Dict[str, Any]:
+    context = span.get_span_context()
+    data = {
+        'traceId': format(context.trace_id, '032x'),
+        'spanId': format(context.span_id, '016x'),
+        'name': span.name,
+        'kind': span.kind.value + 1,  # OTLP numbers kinds from SPAN_KIND_INTERNAL = 1
+        'startTimeUnixNano': str(span.start_time),
+        'endTimeUnixNano': str(span.end_time),
+        'attributes': _otlp_attributes(span.attributes),
+        'status': {'code': span.status.status_code.value}
+    }
+    if span.parent is not None:
+        data['parentSpanId'] = format(span.parent.span_id, '016x')
+    if span.status.description:
+        data['status']['message'] = span.status.description
+    if span.events:
+        data['events'] = [{'timeUnixNano': str(event.timestamp), 'name': event.name,
+                           'attributes': _otlp_attributes(event.attributes)} for event in span.events]
+    return data
+
+def encode_otlp_json(spans: Sequence) -> Dict[str, Any]:
+    """ExportTraceServiceRequest in the OTLP/JSON encoding"""
+    resources: Dict[int, Any] = {}
+    for span in spans:
+        resource, scopes = resources.setdefault(id(span.resource), (span.resource, {}))
+        scope = getattr(span, 'instrumentation_scope', None)
+        scope_name = scope.name if scope is not None else ''
+        scopes.setdefault(scope_name, []).append(_otlp_span(span))
+    return {'resourceSpans': [
+        {
+            'resource': {'attributes': _otlp_attributes(resource.attributes)},
+            'scopeSpans': [{'scope': {'name': name}, 'spans': spans} for name, spans in scopes.items()]
+        }
+        for resource, scopes in resources.values()
+    ]}
+
+class JsonFileSpanExporter(SpanExporter):
+    """Append OTLP/JSON lines to a per-process file, keeping one rotated copy"""
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024):
+        self.path = path.format(pid=os.getpid())
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans) -> 'SpanExportResult':
+        line = json.dumps(encode_otlp_json(spans), ensure_ascii=False, separators=(',', ':'))
+        try:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            return SpanExportResult.SUCCESS
+        except OSError as e:
+            logger.warning(f"Trace export to {self.path} failed: {e}")
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+# =============================================================================
+# SETUP
+# =============================================================================
+
+def setup_tracing(service_name: str) -> bool:
+    """
+    Install the tracer provider for this process (call in each worker, after fork)
+    Returns False when tracing is disabled or OpenTelemetry is not installed
+    """
+    global _provider
+    if not tracing_enabled():
+        return False
+    if _provider is not None:
+        return True
+
+    ratio = float(os.getenv('TRACE_SAMPLE_RATIO', '0.1'))
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': service_name}),
+        sampler=ParentBased(TraceIdRatioBased(ratio))
+    )
+    path = os.getenv('TRACE_EXPORT_FILE', 'logs/traces-{pid}.jsonl')
+    exporter = JsonFileSpanExporter(path, int(os.getenv('TRACE_EXPORT_MAX_BYTES', str(100 * 1024 * 1024))))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+
+    if os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        except ImportError:
+            logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT set but opentelemetry-exporter-otlp-proto-http is not installed")
+
+    trace.set_tracer_provider(provider)
+    _provider = provider
+    logger.info(f"🔭 Tracing {service_name}: sampling {ratio:.0%} of new traces → {exporter.path}")
+    return True
+
+def shutdown_tracing():
+    """Flush pending spans"""
+    global _provider
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+
+# =============================================================================
+# SPANS
+# =============================================================================
+
+_KINDS = {'internal': 'INTERNAL', 'client': 'CLIENT', 'server': 'SERVER'}
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None,
+         kind: str = 'internal', current: bool = True) -> Iterator[Any]:
+    """
+    Span around a block; current=False does not make it the active span,
+    for blocks that yield from an async generator (the context could not be
+    restored across the yield) - such spans cannot have children
+    """
+    if _tracer is None:
+        yield None
+        return
+    span_kind = getattr(SpanKind, _KINDS[kind])
+    if current:
+        with _tracer.start_as_current_span(name, kind=span_kind, attributes=attributes) as active:
+            yield active
+        return
+    detached = _tracer.start_span(name, kind=span_kind, attributes=attributes)
+    try:
+        yield detached
+    except Exception as e:
+        detached.record_exception(e)
+        detached.set_status(Status(StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        detached.end()
+
+def inject_headers(headers: Optional[Dict[str, str]] = None, parent: Any = None) -> Dict[str, str]:
+    """Headers plus traceparent for the current span (or parent)"""
+    headers = dict(headers or {})
+    if OTEL_AVAILABLE:
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        propagate.inject(headers, context=context)
+    return headers
+
+def current_trace_id() -> Optional[str]:
+    if not OTEL_AVAILABLE:
+        return None
+    context = trace.get_current_span().get_span_context()
+    return format(context.trace_id, '032x') if context.is_valid else None
+
+# =============================================================================
+# ASGI MIDDLEWARE
+# =============================================================================
+
+class TracingMiddleware:
+    """Server span per HTTP request, continuing an incoming traceparent; adds X-Trace-Id"""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ('/health', '/metrics')):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or _tracer is None or scope['path'] in self.skip_paths:
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope.get('headers', ())}
+        with _tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={'http.method': scope['method'], 'http.target': scope['path']}
+        ) as server_span:
+            context = server_span.get_span_context()
+            trace_id = format(context.trace_id, '032x').encode() if context.is_valid else None
+
+            async def send_with_trace_id(message):
+                if message['type'] == 'http.response.start':
+                    server_span.set_attribute('http.status_code', message['status'])
+                    if message['status'] >= 500:
+                        server_span.set_status(Status(StatusCode.ERROR))
+                    if trace_id:
+                        message = {**message, 'headers': [*message.get('headers', []), (TRACE_HEADER.encode(), trace_id)]}
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)